@@ -27,6 +27,10 @@
 
 
 import os
+import json
+import hashlib
+import tempfile
+from contextlib import suppress
 
 from ansible.module_utils.basic import AnsibleModule
 from ansible.parsing.yaml.objects import yaml
@@ -63,6 +67,17 @@ options:
         description:
             - Limit the collected informations to the ones of the jobs in this list
         required: false
+    platforms:
+        description:
+            - Also collect the platforms supported by the jobs, from their configuration file
+        required: false
+        default: false
+    manifest:
+        description:
+            - A file caching the platforms collected so far, so configuration files are
+              only parsed again when they changed; an empty value disables the cache
+        required: false
+        default: ~/.cache/openbach/jobs_metadata.json
 
 author:
     - Mathias Ettinger (mathias.ettinger@toulouse.viveris.fr)
@@ -141,7 +156,56 @@ def get_jobs_infos(folder):
                 yield name, parent
 
 
-def get_all_jobs_infos(folders, limit, substitute, include_platforms):
+class Manifest:
+    """Platforms of the configuration files parsed so far, along
+    with the modification time, size and SHA-256 of these files.
+    """
+
+    def __init__(self, path):
+        self.path = path and os.path.expanduser(path)
+        self.dirty = False
+        self.entries = {}
+        if self.path:
+            with suppress(OSError, ValueError):
+                with open(self.path, encoding='utf-8') as f:
+                    self.entries = json.load(f)
+
+    def platforms(self, configuration_file):
+        configuration_file = os.path.abspath(configuration_file)
+        stat = os.stat(configuration_file)
+        stats = [stat.st_mtime_ns, stat.st_size]
+        entry = self.entries.get(configuration_file)
+        if entry is not None and entry['stats'] == stats:
+            return entry['platforms']
+
+        with open(configuration_file, 'rb') as config:
+            content = config.read()
+        checksum = hashlib.sha256(content).hexdigest()
+        if entry is None or entry['checksum'] != checksum:
+            conf = yaml.safe_load(content.decode('utf-8'))
+            entry = {
+                    'checksum': checksum,
+                    'platforms': [
+                        {key: c[key] for key in REQUIRED_KEYS}
+                        for c in conf.get('platform_configuration', [])
+                    ],
+            }
+        self.entries[configuration_file] = dict(entry, stats=stats)
+        self.dirty = True
+        return entry['platforms']
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        folder = os.path.dirname(self.path)
+        with suppress(OSError):
+            os.makedirs(folder, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=folder, delete=False) as f:
+                json.dump(self.entries, f)
+            os.replace(f.name, self.path)
+
+
+def get_all_jobs_infos(folders, limit, substitute, include_platforms, manifest):
     for folder in folders:
         folder = os.path.expanduser(folder)
         for name, path in get_jobs_infos(folder):
@@ -152,12 +216,7 @@ def get_all_jobs_infos(folders, limit, substitute, include_platforms):
                 informations = {'name': name, 'path': path}
 
                 if include_platforms:
-                    with open(configuration_file, encoding='utf-8') as config:
-                        conf = yaml.safe_load(config)
-                    informations['platforms'] = [
-                            {key: c[key] for key in REQUIRED_KEYS}
-                            for c in conf.get('platform_configuration', [])
-                    ]
+                    informations['platforms'] = manifest.platforms(configuration_file)
 
                 yield informations
 
@@ -170,6 +229,7 @@ def run_module():
         substitute=dict(type='str', required=False, default=None),
         limit=dict(type='list', required=False, default=None),
         platforms=dict(type='bool', required=False, default=False),
+        manifest=dict(type='str', required=False, default='~/.cache/openbach/jobs_metadata.json'),
     )
 
     # seed the result dict in the object
@@ -202,12 +262,15 @@ def run_module():
     if limit_to is not None:
         limit_to = set(limit_to)
 
+    manifest = Manifest(module.params['manifest'])
     jobs = get_all_jobs_infos(
             module.params['folders'],
             limit_to,
             module.params['substitute'],
-            module.params['platforms'])
+            module.params['platforms'],
+            manifest)
     result['openbach_jobs'] = list(jobs)
+    manifest.save()
 
     module.exit_json(**result)
 
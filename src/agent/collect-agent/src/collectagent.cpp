@@ -31,6 +31,7 @@
 #include <string>
 #include <fstream>
 #include <cstring>
+#include <cstdint>
 #include <errno.h>
 #if defined(_WIN32)
 #include <direct.h>
@@ -45,6 +46,7 @@ unsigned int scenario_instance_id = 0;
 unsigned int owner_scenario_instance_id = 0;
 std::string agent_name("");
 std::string job_name;
+bool rstats_binary_protocol = true;
 
 
 namespace collect_agent {
@@ -203,16 +205,139 @@ private:
   }
 };
 
+/*
+ * Compact binary framing of the messages sent to RStats.
+ *
+ * A frame starts with the "\0OB" magic, a version byte and the command
+ * id, followed by the command parameters encoded as a MessagePack map
+ * (https://github.com/msgpack/msgpack/blob/master/spec.md) so RStats
+ * can decode it using the C implementation of the msgpack module.
+ */
+namespace wire {
+
+const unsigned char VERSION = 2;
+
+
+void put_uint(std::string& buffer, std::uint64_t value, int size) {
+  for (int shift = 8 * (size - 1); shift >= 0; shift -= 8) {
+    buffer.push_back(static_cast<char>((value >> shift) & 0xFF));
+  }
+}
+
+
+void put_size(std::string& buffer, std::size_t size, unsigned char fixed, std::size_t fixed_limit, unsigned char type16) {
+  // The 32 bits variant of a type always follows its 16 bits one
+  if (size < fixed_limit) {
+    buffer.push_back(static_cast<char>(fixed | size));
+  } else if (size <= 0xFFFF) {
+    buffer.push_back(static_cast<char>(type16));
+    put_uint(buffer, size, 2);
+  } else {
+    buffer.push_back(static_cast<char>(type16 + 1));
+    put_uint(buffer, size, 4);
+  }
+}
+
+
+void put_string(std::string& buffer, const std::string& value) {
+  if (value.size() >= 32 && value.size() <= 0xFF) {
+    buffer.push_back(static_cast<char>(0xd9));
+    put_uint(buffer, value.size(), 1);
+  } else {
+    put_size(buffer, value.size(), 0xa0, 32, 0xda);
+  }
+  buffer.append(value);
+}
+
+
+void put_integer(std::string& buffer, std::int64_t value) {
+  if (value >= 0 && value < 128) {
+    buffer.push_back(static_cast<char>(value));
+  } else if (value < 0 && value >= -32) {
+    buffer.push_back(static_cast<char>(value));
+  } else if (value >= INT32_MIN && value <= INT32_MAX) {
+    buffer.push_back(static_cast<char>(0xd2));
+    put_uint(buffer, static_cast<std::uint32_t>(static_cast<std::int32_t>(value)), 4);
+  } else {
+    buffer.push_back(static_cast<char>(0xd3));
+    put_uint(buffer, static_cast<std::uint64_t>(value), 8);
+  }
+}
+
+
+void put_map(std::string& buffer, const json::JSON& map);
+
+
+void put_value(std::string& buffer, const json::JSON& value) {
+  switch (value.JSONType()) {
+    case json::JSON::Class::Null:
+      buffer.push_back(static_cast<char>(0xc0));
+      break;
+    case json::JSON::Class::Boolean:
+      buffer.push_back(static_cast<char>(value.ToBool() ? 0xc3 : 0xc2));
+      break;
+    case json::JSON::Class::Integral:
+      put_integer(buffer, value.ToInt());
+      break;
+    case json::JSON::Class::Floating: {
+      double number = value.ToFloat();
+      std::uint64_t bits;
+      std::memcpy(&bits, &number, sizeof(bits));
+      buffer.push_back(static_cast<char>(0xcb));
+      put_uint(buffer, bits, 8);
+      break;
+    }
+    case json::JSON::Class::String:
+      put_string(buffer, value.ToRawString());
+      break;
+    case json::JSON::Class::Object:
+      put_map(buffer, value);
+      break;
+    case json::JSON::Class::Array:
+      put_size(buffer, value.size(), 0x90, 16, 0xdc);
+      for (auto& item : value.ArrayRange()) {
+        put_value(buffer, item);
+      }
+      break;
+  }
+}
+
+
+void put_map(std::string& buffer, const json::JSON& map) {
+  if (map.JSONType() != json::JSON::Class::Object) {
+    buffer.push_back(static_cast<char>(0x80));
+    return;
+  }
+  put_size(buffer, map.size(), 0x80, 16, 0xde);
+  for (auto& entry : map.ObjectRange()) {
+    put_string(buffer, entry.first);
+    put_value(buffer, entry.second);
+  }
+}
+
+
+std::string encode(const json::JSON& message) {
+  std::string buffer("\0OB", 3);
+  buffer.push_back(static_cast<char>(VERSION));
+  buffer.push_back(static_cast<char>(message.at("command_id").ToInt()));
+  put_map(buffer, message.at("command_parameters"));
+  return buffer;
+}
+
+}
+
+
 /*
  * Helper function to send a message to the local RStats relay.
  */
-std::string rstats_messager(const json::JSON& message) {
+std::string rstats_messager(const json::JSON& message, bool binary) {
   std::error_code error;
   RStatsClient rstats;
   static udp::endpoint endpoint = rstats.resolve("", "1111");
 
   // Connect to the RStats service and send our message
-  rstats.send_to(asio::buffer(message.serialize()), endpoint, std::chrono::seconds(10), error);
+  std::string data_to_send = binary ? wire::encode(message) : message.serialize();
+  rstats.send_to(asio::buffer(data_to_send), endpoint, std::chrono::seconds(10), error);
   if (error || rstats.timed_out()) {
     send_log(LOG_ERR, "Error: Connexion to rstats refused, maybe rstats service isn't started");
     throw asio::system_error(error);
@@ -230,6 +355,11 @@ std::string rstats_messager(const json::JSON& message) {
 }
 
 
+std::string rstats_messager(const json::JSON& message) {
+  return rstats_messager(message, rstats_binary_protocol);
+}
+
+
 /*
  * Create the message to register and configure a new job;
  * send it to the RStats service and propagate its response.
@@ -286,10 +416,15 @@ read:
     }
   };
 
-  // Send the message to rstats
+  // Send the message to rstats, falling back to the JSON
+  // protocol if rstats does not understand binary frames
   std::string result;
   try {
-    result = rstats_messager(command);
+    result = rstats_messager(command, true);
+    rstats_binary_protocol = result.compare(0, 2, "OK") == 0;
+    if (!rstats_binary_protocol) {
+      result = rstats_messager(command, false);
+    }
   } catch (std::exception& e) {
     send_log(LOG_ERR, "Failed to register to rstats service: %s", e.what());
     return false;
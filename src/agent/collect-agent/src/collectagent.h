@@ -484,6 +484,10 @@ class JSON
             return ok ? std::move( json_escape( *Internal.String ) ): string("");
         }
 
+        string ToRawString() const {
+            return Type == Class::String ? *Internal.String : string("");
+        }
+
         double ToFloat() const { bool b; return ToFloat( b ); }
         double ToFloat( bool &ok ) const {
             ok = (Type == Class::Floating);
@@ -42,6 +42,8 @@ __credits__ = '''Contributors:
 '''
 
 
+import os
+import time
 import socket
 import syslog
 import os.path
@@ -52,14 +54,18 @@ import traceback
 import contextlib
 import configparser
 import socketserver
-from itertools import groupby
+import itertools
 from time import strftime
 from datetime import datetime
-from collections import namedtuple
+from collections import namedtuple, deque
 try:
     import simplejson as json
 except ImportError:
     import json
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 import yaml
 
@@ -67,6 +73,10 @@ import yaml
 DEFAULT_LOG_PATH = '/var/openbach_stats/'
 RSTATS_CONFIG_FILE = '/opt/openbach/agent/rstats/rstats.yml'
 COLLECTOR_CONFIG_FILE = '/opt/openbach/agent/collector.yml'
+AGENT_NAME_FILE = '/opt/openbach/agent/agent_name'
+DEFAULT_SPOOL_PATH = '/opt/openbach/agent/rstats/spool/'
+BINARY_MAGIC = b'\0OB'
+BINARY_VERSION = 2
 
 
 class BadRequest(ValueError):
@@ -76,6 +86,10 @@ class BadRequest(ValueError):
         self.reason = reason
 
 
+class CollectorUnreachable(BadRequest):
+    """Raised when statistics could not be handed to the collector"""
+
+
 class AutoClosingFileHandler(logging.FileHandler):
     def __init__(self, filename, encoding=None):
         """
@@ -98,9 +112,86 @@ class AutoClosingFileHandler(logging.FileHandler):
             stream.close()
 
 
+def _collector_unreachable(err):
+    return CollectorUnreachable('Error code: {}, Message {}'.format(err.errno, err.strerror))
+
+
+class TCPSender:
+    """Send each statistic through a new TCP connection"""
+
+    def __init__(self, address):
+        self.address = address
+
+    def __call__(self, data):
+        try:
+            with socket.create_connection(self.address) as logstash:
+                logstash.sendall(data.encode())
+        except socket.error as err:
+            raise _collector_unreachable(err)
+
+    def check(self):
+        """Errors are reported when sending"""
+
+    def close(self):
+        pass
+
+
+class UDPSender:
+    """Send statistics through a single connected UDP socket.
+
+    Being connected, the socket reports the ICMP errors received for
+    its previous datagrams (port or host unreachable) as errors on the
+    next send, so a collector that went away is detected at the cost
+    of the datagram that triggered the error; a collector silently
+    dropping the traffic cannot be detected, use the TCP mode to spool
+    statistics in that case. The check method reports errors pending
+    for the datagrams already sent.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self._socket = None
+        self._lock = threading.Lock()
+
+    def _connected(self):
+        if self._socket is None:
+            logstash = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                logstash.connect(self.address)
+            except socket.error:
+                logstash.close()
+                raise
+            self._socket = logstash
+        return self._socket
+
+    def _fail(self, err):
+        self.close()
+        return _collector_unreachable(err)
+
+    def __call__(self, data):
+        with self._lock:
+            try:
+                self._connected().send(data.encode())
+            except socket.error as err:
+                raise self._fail(err)
+
+    def check(self):
+        with self._lock:
+            if self._socket is None:
+                return
+            error = self._socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if error:
+                raise self._fail(OSError(error, os.strerror(error)))
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
 @functools.lru_cache(maxsize=1)
 def get_statistics_sender():
-    """Build the function that will route data to the logstash
+    """Build the callable that will route data to the logstash
     server based on the provided configuration files.
     """
 
@@ -110,45 +201,281 @@ def get_statistics_sender():
     port = content['stats']['port']
     address = (host, int(port))
 
-    # Build functions to send stats to the configured address
+    with open(RSTATS_CONFIG_FILE, encoding='utf-8') as stream:
+        content = yaml.safe_load(stream)
+
+    # Select the right sender to use based on the configured mode
+    try:
+        sender = {
+            'tcp': TCPSender,
+            'udp': UDPSender,
+        }[content['logstash']['mode']]
+    except KeyError:
+        raise BadRequest('Mode not known')
+    return sender(address)
+
+
+class StatisticsSpool:
+    """Write-ahead queue of the statistics that could not reach the collector.
+
+    Records are appended to segment files on disk and a background
+    thread replays them, in order and at a bounded rate, once the
+    collector answers again. While records are pending, new ones are
+    queued behind them so the collector receives them in order. When
+    the spool grows past its maximal size, the oldest segments are
+    dropped.
+    """
+
+    SEGMENT_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, path=DEFAULT_SPOOL_PATH, max_size=256 * 1024 * 1024,
+                 rate=1000, report_interval=10):
+        self._path = path
+        self._max_size = max_size
+        self._rate = rate
+        self._report_interval = report_interval
+        self._condition = threading.Condition()
+        self._tail = None
+        self._segments = deque()
+        self._offset = 0
+        self._size = 0
+        self._records = 0
 
-    @contextlib.contextmanager
-    def socket_error_to_bad_request(message):
-        """Helper context manager aimed at reducing boilerplate code"""
         try:
-            yield
-        except socket.error as err:
-            raise BadRequest(message.format(*err))
+            self._load()
+        except OSError as error:
+            # Statistics are still sent, they are just not spooled
+            syslog.syslog(
+                    syslog.LOG_ERR,
+                    'Cannot use the statistics spool in {}, statistics '
+                    'will not be spooled: {}'.format(path, error))
+            self.enabled = False
+            self._segments.clear()
+            self._offset = self._size = self._records = 0
+        else:
+            self.enabled = True
+            self._drainer = threading.Thread(target=self._drain, daemon=True)
+            self._drainer.start()
+
+    def _load(self):
+        """Recover the records spooled by a previous run"""
+        os.makedirs(self._path, exist_ok=True)
+        self._segments.extend(sorted(
+                int(name[:-len('.seg')])
+                for name in os.listdir(self._path)
+                if name.endswith('.seg')
+        ))
+        try:
+            with open(self._offset_file) as stream:
+                self._offset = int(stream.read())
+        except (OSError, ValueError):
+            self._offset = 0
+        self._size = sum(os.path.getsize(self._segment(s)) for s in self._segments)
+        self._records = sum(self._count_records(s) for s in self._segments)
+        if self._segments:
+            with open(self._segment(self._segments[0]), 'rb') as segment:
+                self._records -= segment.read(self._offset).count(b'\n')
+            self._size -= self._offset
+
+    def __len__(self):
+        with self._condition:
+            return self._records
 
-    def send_udp(data):
-        with socket_error_to_bad_request('Failed to create socket'):
-            logstash = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    @property
+    def _offset_file(self):
+        return os.path.join(self._path, 'offset')
+
+    def _segment(self, segment_id):
+        return os.path.join(self._path, '{:020d}.seg'.format(segment_id))
 
-        with logstash:
-            with socket_error_to_bad_request('Error code: {}, Message {}'):
-                logstash.sendto(data.encode(), address)
+    def _count_records(self, segment_id):
+        with open(self._segment(segment_id), 'rb') as segment:
+            return sum(chunk.count(b'\n') for chunk in iter(lambda: segment.read(2**16), b''))
 
-    def send_tcp(data):
-        with socket_error_to_bad_request('Failed to create socket'):
-            logstash = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    def _save_offset(self):
+        with open(self._offset_file, 'w') as stream:
+            print(self._offset, file=stream)
 
-        with logstash:
-            with socket_error_to_bad_request('Failed to connect to server'):
-                logstash.connect(address)
-            with socket_error_to_bad_request('Error code: {}, Message {}'):
-                logstash.send(data.encode())
+    def send(self, data, spool=True):
+        """Send data to the collector, or queue it if older records
+        are still pending or if the collector could not be reached.
+        When spool is False, data is never queued and errors are
+        propagated to the caller.
+        """
+        spool = spool and self.enabled
+        # Unlocked peek: a record racing with the drainer is sent directly
+        if spool and self._records:
+            self._spool(data)
+            return
+
+        try:
+            get_statistics_sender()(data)
+        except CollectorUnreachable:
+            if not spool:
+                raise
+            self._spool(data)
+
+    def _spool(self, data):
+        try:
+            self.enqueue(data)
+        except OSError as error:
+            raise CollectorUnreachable('Cannot spool statistics: {}'.format(error))
+
+    def enqueue(self, data):
+        record = data.encode() + b'\n'
+        with self._condition:
+            if self._tail is None or self._tail.tell() >= self.SEGMENT_SIZE:
+                self._rotate()
+            self._tail.write(record)
+            self._tail.flush()
+            self._records += 1
+            self._size += len(record)
+            while self._size > self._max_size and len(self._segments) > 1:
+                self._drop_head()
+            self._condition.notify()
+
+    def _rotate(self):
+        if self._tail is not None:
+            self._tail.close()
+        segment_id = self._segments[-1] + 1 if self._segments else 0
+        self._segments.append(segment_id)
+        self._tail = open(self._segment(segment_id), 'ab')
+
+    def _drop_head(self):
+        segment_id = self._segments.popleft()
+        dropped = self._count_records(segment_id)
+        size = os.path.getsize(self._segment(segment_id))
+        with open(self._segment(segment_id), 'rb') as segment:
+            dropped -= segment.read(self._offset).count(b'\n')
+        self._records -= dropped
+        self._size -= size - self._offset
+        self._offset = 0
+        os.remove(self._segment(segment_id))
+        self._save_offset()
+        syslog.syslog(
+                syslog.LOG_WARNING,
+                'Statistics spool is full, dropped {} records'.format(dropped))
+
+    def _read_head(self, count):
+        """Read up to count records from the oldest segment"""
+        segment_id = self._segments[0]
+        with open(self._segment(segment_id), 'rb') as segment:
+            segment.seek(self._offset)
+            records = [line for line in itertools.islice(segment, count) if line.endswith(b'\n')]
+        return segment_id, records
+
+    def _consume(self, segment_id, records):
+        """Forget about records successfully sent from the given segment"""
+        if not self._segments or self._segments[0] != segment_id:
+            # Segment got dropped in the meantime
+            return
+        size = sum(map(len, records))
+        self._offset += size
+        self._size -= size
+        self._records -= len(records)
+        if not self._records:
+            # Everything was sent, restart from an empty spool
+            for segment_id in self._segments:
+                os.remove(self._segment(segment_id))
+            self._segments.clear()
+            if self._tail is not None:
+                self._tail.close()
+                self._tail = None
+            self._offset = 0
+        elif not records and len(self._segments) > 1:
+            # Nothing left but an incomplete record, move to the next segment
+            self._segments.popleft()
+            os.remove(self._segment(segment_id))
+            self._offset = 0
+        self._save_offset()
+
+    def _drain(self):
+        backoff = 1
+        last_report = 0
+        reported_depth = 0
+        while True:
+            with self._condition:
+                while not self._records and not reported_depth:
+                    self._condition.wait()
+                depth = self._records
+                segment_id, records = self._read_head(self._rate) if depth else (None, [])
+
+            now = time.monotonic()
+            if depth != reported_depth and (not depth or now - last_report >= self._report_interval):
+                try:
+                    self._report(depth)
+                except CollectorUnreachable:
+                    pass
+                else:
+                    last_report = now
+                    reported_depth = depth
+
+            sent = []
+            try:
+                sender = get_statistics_sender()
+                for record in records:
+                    sender(record[:-1].decode())
+                    time.sleep(1 / self._rate)
+                    # Keep the record if the collector reported an error for it meanwhile
+                    sender.check()
+                    sent.append(record)
+            except CollectorUnreachable:
+                time.sleep(backoff)
+                backoff = min(2 * backoff, 30)
+            except Exception:
+                syslog.syslog(syslog.LOG_ERR, traceback.format_exc())
+                time.sleep(backoff)
+            else:
+                backoff = 1
+                if reported_depth and not depth:
+                    # Could not report the spool being empty yet
+                    time.sleep(1)
+
+            if sent or (depth and not records):
+                with self._condition:
+                    self._consume(segment_id, sent)
+
+    def _report(self, depth):
+        """Send the spool depth as a statistic of rstats itself"""
+        with self._condition:
+            size = self._size
+        statistics = {
+                'spool_depth': depth,
+                'spool_size': size,
+                '_metadata': {
+                    'time': int(time.time() * 1000),
+                    'is_file': False,
+                    'flag': RstatsRule('default', True, True, False).flag,
+                    'job_name': 'rstats',
+                    'agent_name': get_agent_name(),
+                    'job_instance_id': 0,
+                    'scenario_instance_id': 0,
+                    'owner_scenario_instance_id': 0,
+                },
+        }
+        get_statistics_sender()(json.dumps(statistics))
+
+
+@functools.lru_cache(maxsize=1)
+def get_agent_name():
+    try:
+        with open(AGENT_NAME_FILE, encoding='utf-8') as stream:
+            return stream.readline().strip()
+    except OSError:
+        return socket.gethostname()
+
+
+@functools.lru_cache(maxsize=1)
+def get_statistics_spool():
+    """Build the spool holding statistics while the collector
+    is unreachable, using the optional configuration found in
+    the rstats configuration file.
+    """
 
     with open(RSTATS_CONFIG_FILE, encoding='utf-8') as stream:
         content = yaml.safe_load(stream)
 
-    # Select the right function to use based on the configured mode
-    try:
-        return {
-            'tcp': send_tcp,
-            'udp': send_udp,
-        }[content['logstash']['mode']]
-    except KeyError:
-        raise BadRequest('Mode not known')
+    return StatisticsSpool(**content.get('spool', {}))
 
 
 class Rstats:
@@ -194,35 +521,40 @@ class Rstats:
         self.reload_conf(reset_handlers, store_local, logpath)
 
     def reload_conf(self, reset_handlers=False, store_local=True, logpath=DEFAULT_LOG_PATH):
+        # Rules are never modified in place but replaced as a whole,
+        # so that send_stat can use them without holding the lock
         config = configparser.ConfigParser()
+        rules = {'default': RstatsRule(
+                'default',
+                RstatsRule.ACCEPT,
+                RstatsRule.ACCEPT,
+                RstatsRule.ACCEPT,
+        )}
+        try:
+            config.read(self._confpath)
+        except configparser.Error:
+            with self._mutex:
+                self._filter = RstatsFilter(rules)
+            return
+
+        rules.update(
+                (name, RstatsRule(
+                    name,
+                    section.getboolean('local', RstatsRule.ACCEPT),
+                    section.getboolean('storage', RstatsRule.ACCEPT),
+                    section.getboolean('broadcast', RstatsRule.ACCEPT),
+                ))
+                for name, section in config.items()
+                if section.values()
+        )
         with self._mutex:
-            self._rules = {'default': RstatsRule(
-                    'default',
-                    RstatsRule.ACCEPT,
-                    RstatsRule.ACCEPT,
-                    RstatsRule.ACCEPT,
-            )}
-            try:
-                config.read(self._confpath)
-            except configparser.Error:
-                return
-
-            self._rules.update(
-                    (name, RstatsRule(
-                        name,
-                        section.getboolean('local', RstatsRule.ACCEPT),
-                        section.getboolean('storage', RstatsRule.ACCEPT),
-                        section.getboolean('broadcast', RstatsRule.ACCEPT),
-                    ))
-                    for name, section in config.items()
-                    if section.values()
-            )
+            self._filter = RstatsFilter(rules)
 
         if reset_handlers:
             for handler in self._logger.handlers:
                 self._logger.removeHandler(handler)
 
-        if store_local and any(rule.local for rule in self._rules.values()):
+        if store_local and any(rule.local for rule in rules.values()):
             if not self._logger.hasHandlers():
                 self._logger.setLevel(logging.INFO)
                 filename = '{}_{}.stats'.format(self.metadata['job_name'], strftime("%Y-%m-%dT%H%M%S"))
@@ -238,51 +570,31 @@ class Rstats:
             for handler in self._logger.handlers:
                 self._logger.removeHandler(handler)
 
-    def send_stat(self, suffix, time, stats, files):
+    def set_default_rule(self, rule):
         with self._mutex:
-            statistics_metadata = {'time': time, 'is_file': files, **self.metadata}
-            if suffix is not None:
-                statistics_metadata['suffix'] = suffix
-
-            statistics_by_flag = sorted((
-                {statistic_name: value}
-                for statistic_name, value in stats.items()
-            ), key=self._get_flag)
-
-            for flag, statistics_group in groupby(statistics_by_flag, self._get_flag):
-                statistics_metadata['flag'] = flag
-                statistics = {
-                        name: value
-                        for statistic in statistics_group
-                        for name, value in statistic.items()
-                }
-                if flag:
-                    statistics['_metadata'] = statistics_metadata
-                    get_statistics_sender()(json.dumps(statistics))
-
-                # Filter out stats specifically specified local = False or
-                # include only those specified local = True, if default is False
-                use_local = self._rules['default'].local
-                statistics = {
-                        name: value
-                        for name, value in statistics.items()
-                        if (
-                            name not in self._rules or self._rules[name].local
-                            if use_local else
-                            name in self._rules and self._rules[name].local
-                        )
-                }
-                statistics['_metadata'] = statistics_metadata
-                if len(statistics) > 1:
-                    self._logger.info(json.dumps(statistics))
+            self._filter = RstatsFilter({**self._filter.rules, 'default': rule})
 
+    def send_stat(self, suffix, time, stats, files):
+        # No lock needed: metadata is never modified and the
+        # rules are replaced as a whole when they change
+        rules = self._filter
 
-    def _get_flag(self, statistic_holder):
-        statistic_name, = statistic_holder
-        if statistic_name in self._rules:
-            return self._rules[statistic_name].flag
-        else:
-            return self._rules['default'].flag
+        statistics_metadata = {'time': time, 'is_file': files, **self.metadata}
+        if suffix is not None:
+            statistics_metadata['suffix'] = suffix
+
+        for flag, names, local_names in rules.plan(tuple(stats)):
+            statistics_metadata['flag'] = flag
+            if flag:
+                statistics = {name: stats[name] for name in names}
+                statistics['_metadata'] = statistics_metadata
+                # Only statistics meant to be stored are worth replaying later
+                get_statistics_spool().send(json.dumps(statistics), spool=flag & 1)
+
+            if local_names:
+                statistics = {name: stats[name] for name in local_names}
+                statistics['_metadata'] = statistics_metadata
+                self._logger.info(json.dumps(statistics))
 
 
 class RstatsRule(namedtuple('RstatsRule', 'name local storage broadcast')):
@@ -305,12 +617,82 @@ class RstatsRule(namedtuple('RstatsRule', 'name local storage broadcast')):
                 self.name)
 
 
+class RstatsFilter:
+    """Rules of a filter configuration compiled for fast lookups.
+
+    A statistic uses the rule of its exact name if any, else the rule
+    of the longest section whose name, ending with a '*', is a prefix
+    of its name, else the default rule. Grouping plans are memoized
+    per set of statistic names, as jobs tend to send the same names
+    over and over.
+    """
+
+    MAX_PLANS = 256
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.default = rules['default']
+        self._exact = {}
+        self._prefixes = {}
+        self._plans = {}
+        for name, rule in rules.items():
+            if name.endswith('*'):
+                node = self._prefixes
+                for character in name[:-1]:
+                    node = node.setdefault(character, {})
+                node[None] = rule
+            else:
+                self._exact[name] = rule
+
+    def __getitem__(self, statistic_name):
+        try:
+            return self._exact[statistic_name]
+        except KeyError:
+            pass
+
+        node = self._prefixes
+        rule = node.get(None, self.default)
+        for character in statistic_name:
+            node = node.get(character)
+            if node is None:
+                break
+            rule = node.get(None, rule)
+        return rule
+
+    def plan(self, statistic_names):
+        """Group statistic names by increasing flag, keeping their
+        relative order, along with the names to store locally.
+        """
+        try:
+            return self._plans[statistic_names]
+        except KeyError:
+            pass
+
+        rules = [(name, self[name]) for name in statistic_names]
+        plan = []
+        for flag in sorted({rule.flag for _, rule in rules}):
+            names = tuple(name for name, rule in rules if rule.flag == flag)
+            local = tuple(name for name, rule in rules if rule.flag == flag and rule.local)
+            plan.append((flag, names, local))
+        plan = tuple(plan)
+        if len(self._plans) >= self.MAX_PLANS:
+            self._plans.clear()
+        self._plans[statistic_names] = plan
+        return plan
+
+
 class StatsManager:
-    """Borg storing the connections opened with the daemon"""
+    """Borg storing the connections opened with the daemon.
+
+    The shared mutex only guards the bookkeeping of connections;
+    each connection holds its own lock for its own state so that
+    statistics of different jobs are handled concurrently.
+    """
 
     __shared_state = {
             'stats': {},
             'cache': {},
+            'locks': {},
             'mutex': threading.RLock(),
             'id': 0,
     }
@@ -335,6 +717,11 @@ class StatsManager:
                 self.cache[key] = self.id
                 return self.id
 
+    def statistic_lock(self, id_):
+        """Lock serializing the (re)creation of the given connection"""
+        with self.mutex:
+            return self.locks.setdefault(id_, threading.Lock())
+
     @contextlib.contextmanager
     def _id_check(self):
         try:
@@ -362,6 +749,7 @@ class StatsManager:
         with self.mutex:
             self.stats.clear()
             self.cache.clear()
+            self.locks.clear()
             self.id = 0
 
 
@@ -390,9 +778,12 @@ def create_stat(confpath, job_name, job_instance_id, scenario_instance_id,
     with _handle_parse_errors('override', 'boolean'):
         override = bool(int(override))
 
-    with StatsManager() as manager:
-        statistic_id = manager.statistic_lookup(job_instance_id, scenario_instance_id)
+    manager = StatsManager()
+    statistic_id = manager.statistic_lookup(job_instance_id, scenario_instance_id)
 
+    # Build the connection outside of the shared mutex as it reads
+    # configuration files; other jobs need not wait for it
+    with manager.statistic_lock(statistic_id):
         if override or statistic_id not in manager:
             manager[statistic_id] = Rstats(
                     statistic_id,
@@ -456,16 +847,18 @@ def change_config(scenario_instance_id, job_instance_id, enable_broadcast, enabl
     with _handle_parse_errors('enable_storage', 'boolean'):
         enable_storage = bool(int(enable_storage))
 
-    with StatsManager() as manager:
-        id = manager.statistic_lookup(job_instance_id, scenario_instance_id)
-        client_connection = manager[id]
-        default_rule = RstatsRule('default', RstatsRule.ACCEPT, enable_storage, enable_broadcast)
-        client_connection._rules['default'] = default_rule
+    manager = StatsManager()
+    id = manager.statistic_lookup(job_instance_id, scenario_instance_id)
+    client_connection = manager[id]
+    default_rule = RstatsRule('default', RstatsRule.ACCEPT, enable_storage, enable_broadcast)
+    client_connection.set_default_rule(default_rule)
 
 
 def restart():
     with StatsManager() as manager:
         manager.reset()
+        with contextlib.suppress(Exception):
+            get_statistics_sender().close()
         get_statistics_sender.cache_clear()
 
 
@@ -473,6 +866,28 @@ def restart():
 # Requests handling #
 #####################
 
+def decode_binary_request(data):
+    """Decode the compact binary frames sent by collect-agent.
+
+    A frame is the "\\0OB" magic, a version byte and the command id,
+    followed by the command parameters as a MessagePack map.
+    """
+    if msgpack is None:
+        raise BadRequest('Binary frames are not supported without the msgpack module')
+    if len(data) < 5:
+        raise BadRequest('Request is not a valid binary frame')
+    if data[3] != BINARY_VERSION:
+        raise BadRequest('Binary protocol version {} is not supported'.format(data[3]))
+
+    try:
+        parameters = msgpack.unpackb(data[5:], raw=False)
+    except (ValueError, TypeError, msgpack.UnpackException):
+        raise BadRequest('Request is not a valid binary frame')
+    if not isinstance(parameters, dict):
+        raise BadRequest('Request is not a valid binary frame')
+    return data[4], parameters
+
+
 class RstatsRequestHandler(socketserver.BaseRequestHandler):
     AVAILABLE_FUNCTIONS = [
             create_stat,
@@ -488,9 +903,13 @@ class RstatsRequestHandler(socketserver.BaseRequestHandler):
         data, sock = self.request
         msg = 'KO: Unhandled exception occured\0'
         try:
-            data = data.decode()
-            syslog.syslog(syslog.LOG_INFO, data)
-            result = self.execute_request(data)
+            request, args = self.parse_request(data)
+            if self.server.trace:
+                syslog.syslog(syslog.LOG_INFO, json.dumps({
+                    'command_id': request,
+                    'command_parameters': args,
+                }))
+            result = self.execute_request(request, args)
         except BadRequest as e:
             syslog.syslog(syslog.LOG_ERR, traceback.format_exc())
             msg = 'KO: {}\0'.format(e.reason)
@@ -503,23 +922,29 @@ class RstatsRequestHandler(socketserver.BaseRequestHandler):
             else:
                 msg = 'OK {}\0'.format(result)
         finally:
-            syslog.syslog(syslog.LOG_INFO, msg)
+            if self.server.trace or not msg.startswith('OK'):
+                syslog.syslog(syslog.LOG_INFO, msg)
             sock.sendto(msg.encode(), self.client_address)
 
-    def execute_request(self, data):
+    def parse_request(self, data):
+        if data.startswith(BINARY_MAGIC):
+            return decode_binary_request(data)
+
         try:
-            command = json.loads(data)
-        except json.JSONDecodeError:
+            command = json.loads(data.decode())
+        except (UnicodeDecodeError, json.JSONDecodeError):
             raise BadRequest('Request is not a valid JSON string')
 
         try:
-            request = command['command_id']
-            args = command['command_parameters']
+            return command['command_id'], command['command_parameters']
         except KeyError as e:
             raise BadRequest('Request is missing parameters \'{}\''.format(e))
 
+    def execute_request(self, request, args):
         try:
             # Compensate for collect_agent using 1-based indexing
+            if request < 1:
+                raise IndexError(request)
             function = self.AVAILABLE_FUNCTIONS[request - 1]
         except (TypeError, IndexError):
             raise BadRequest('Type of request not recognized')
@@ -533,11 +958,15 @@ class RstatsRequestHandler(socketserver.BaseRequestHandler):
 class RstatsServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
     allow_reuse_address = True
     max_packet_size = 2**14
+    trace = False
 
 
 if __name__ == '__main__':
     syslog.openlog('openbach_rstats', syslog.LOG_PID, syslog.LOG_USER)
     server = RstatsServer(('', 1111), RstatsRequestHandler)
+    with contextlib.suppress(OSError, yaml.YAMLError, LookupError, TypeError, AttributeError):
+        with open(RSTATS_CONFIG_FILE, encoding='utf-8') as stream:
+            server.trace = bool(yaml.safe_load(stream)['rstats'].get('trace', False))
     try:
         server.serve_forever()
     finally:
@@ -291,10 +291,11 @@ function convertStartJobInstanceParameters(parameters: IStartJobParameters, subc
 
 export function getScenarioInstancesFromProject(project: string) {
     return (dispatch, getState) => {
-        const offset: number = getState().scenario.all.length;
+        const instances: IScenarioInstance[] = getState().scenario.all;
+        const cursor = instances.length ? instances[instances.length - 1].scenario_instance_id : undefined;
         return dispatch({
             payload: {
-                promise: getAllFromProject(project, offset),
+                promise: getAllFromProject(project, cursor),
             },
             types: [
                 GET_SCENARIO_INSTANCES_PENDING,
@@ -308,10 +309,11 @@ export function getScenarioInstancesFromProject(project: string) {
 
 export function getFilteredScenarioInstancesFromProject(project: string, scenarioName: string) {
     return (dispatch, getState) => {
-        const offset: number = getState().scenario.current.length;
+        const instances: IScenarioInstance[] = getState().scenario.current;
+        const cursor = instances.length ? instances[instances.length - 1].scenario_instance_id : undefined;
         return dispatch({
             payload: {
-                promise: getCurrentFromProject(project, scenarioName, offset),
+                promise: getCurrentFromProject(project, scenarioName, cursor),
             },
             types: [
                 GET_FILTERED_SCENARIO_INSTANCES_PENDING,
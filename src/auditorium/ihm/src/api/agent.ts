@@ -21,8 +21,10 @@ export function update(address: string, agent: IAgentUpdateForm): Promise<IAgent
 };
 
 
-export function status(address: string): Promise<IAgentState> {
-    return doApiCall("/agent/" + address + "/state")
+export function status(address: string, waitForChange: number = 0): Promise<IAgentState> {
+    // When waiting, the backend holds the request until the state differs
+    // from the one the browser revalidates through its cached ETag
+    return doApiCall("/agent/" + address + "/state" + (waitForChange ? "?wait=" + waitForChange : ""))
         .then((response: Response) => response.json<IAgentState>());
 };
 
@@ -43,11 +43,14 @@ const buildStatisticsRoute = (jobID: number, statName: string, suffix: string):
 };
 
 
-export function getStatistics(jobID: number, statName: string, suffix: string, origin?: number): Promise<IInfluxStatistics> {
+export function getStatistics(jobID: number, statName: string, suffix: string, origin?: number, maxPoints?: number): Promise<IInfluxStatistics> {
     let route = buildStatisticsRoute(jobID, statName, suffix);
     if (origin || origin === 0) {
         route += "&origin=" + origin;
     }
+    if (maxPoints) {
+        route += "&max_points=" + maxPoints;
+    }
     return doApiCall(route).then((response: Response) => response.json<IInfluxStatistics>());
 };
 
@@ -0,0 +1,76 @@
+import {IInfluxStatistics, ILiveSubscription} from "../interfaces/influx.interface";
+
+
+const buildLiveRoute = (jobID: number, statNames: string[], suffix: string, resolution: number): string => {
+    const query = statNames.map((name: string) => "name=" + encodeURIComponent(name));
+    query.push("resolution=" + resolution);
+    if (suffix) {
+        query.push("suffix=" + encodeURIComponent(suffix));
+    }
+    return `/live/statistics/${jobID}?${query.join("&")}`;
+};
+
+
+export function subscribeStatistics(
+    jobID: number,
+    statNames: string[],
+    suffix: string,
+    resolution: number,
+    onPoints: (points: IInfluxStatistics, history: boolean) => void,
+    onError?: () => void,
+): ILiveSubscription {
+    const source = new EventSource(buildLiveRoute(jobID, statNames, suffix, resolution));
+    let lastTime = -Infinity;
+
+    // The history is sent again each time the connection is
+    // re-established; only forward points we did not see yet
+    const forward = (data: string, history: boolean) => {
+        const points: IInfluxStatistics = JSON.parse(data);
+        const start = points.time.findIndex((time: number) => time > lastTime);
+        if (start === -1) {
+            return;
+        }
+        if (start > 0) {
+            for (const name in points) {
+                if (points.hasOwnProperty(name)) {
+                    points[name] = points[name].slice(start);
+                }
+            }
+        }
+        lastTime = points.time[points.time.length - 1];
+        onPoints(points, history);
+    };
+
+    source.addEventListener("history", (event: MessageEvent) => forward(event.data, true));
+    source.onmessage = (event: MessageEvent) => forward(event.data, false);
+    if (onError) {
+        source.onerror = () => onError();
+    }
+
+    return {close: () => source.close()};
+};
+
+
+export function appendStatistics(statistics: IInfluxStatistics, points: IInfluxStatistics, maxPoints: number): IInfluxStatistics {
+    const length = statistics.time.length;
+    const merged: IInfluxStatistics = {time: statistics.time.concat(points.time)};
+    const names = Object.keys(statistics).concat(Object.keys(points));
+    for (const name of names) {
+        if (name === "time" || merged.hasOwnProperty(name)) {
+            continue;
+        }
+        const previous = statistics[name] || new Array(length).fill(null);
+        const current = points[name] || new Array(points.time.length).fill(null);
+        merged[name] = previous.concat(current);
+    }
+
+    const excess = merged.time.length - maxPoints;
+    if (excess > 0) {
+        for (const name in merged) {
+            if (merged.hasOwnProperty(name)) {
+                merged[name] = merged[name].slice(excess);
+            }
+        }
+    }
+    return merged;
+};
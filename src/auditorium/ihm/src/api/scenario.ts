@@ -50,14 +50,14 @@ export function launchScenario(projectName: string, scenarioName: string, date:
 };
 
 
-export function getScenarioInstancesFromProject(projectName: string, offset: number): Promise<IScenarioInstance[]> {
-    const url = `/project/${projectName}/scenario_instance?quiet&offset=${offset}&limit=15`;
+export function getScenarioInstancesFromProject(projectName: string, cursor?: number): Promise<IScenarioInstance[]> {
+    const url = `/project/${projectName}/scenario_instance?quiet&limit=15` + (cursor === undefined ? "" : `&cursor=${cursor}`);
     return doApiCall(url).then((response: Response) => response.json<IScenarioInstance[]>());
 };
 
 
-export function getFilteredScenarioInstancesFromProject(projectName: string, scenarioName: string, offset: number): Promise<IScenarioInstance[]> {
-    const url = `/project/${projectName}/scenario/${scenarioName}/scenario_instance?quiet&offset=${offset}&limit=15`;
+export function getFilteredScenarioInstancesFromProject(projectName: string, scenarioName: string, cursor?: number): Promise<IScenarioInstance[]> {
+    const url = `/project/${projectName}/scenario/${scenarioName}/scenario_instance?quiet&limit=15` + (cursor === undefined ? "" : `&cursor=${cursor}`);
     return doApiCall(url).then((response: Response) => response.json<IScenarioInstance[]>());
 };
 
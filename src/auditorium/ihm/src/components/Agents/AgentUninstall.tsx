@@ -151,7 +151,7 @@ class AgentUninstall extends React.Component<IProps & IDispatchProps, IState> {
     }
 
     private refreshStatus() {
-        status(this.props.address).then((agentStatus: IAgentState) => {
+        status(this.props.address, 30).then((agentStatus: IAgentState) => {
             if (!agentStatus) {  // Agents installed by ansible lead to a 204
                 this.setState({ statusCode: 200 });
             } else {
@@ -160,7 +160,7 @@ class AgentUninstall extends React.Component<IProps & IDispatchProps, IState> {
                 const lastUnInstallDate = new Date(uninstall ? uninstall.last_operation_date : 0);
                 const operation = lastInstallDate < lastUnInstallDate ? uninstall : install;
                 const statusCode = operation ? operation.returncode : 202;
-                const timeoutId = statusCode === 202 ? window.setTimeout(this.refreshStatus, 2000) : null;
+                const timeoutId = statusCode === 202 ? window.setTimeout(this.refreshStatus, 0) : null;
                 this.setState({ statusCode, timeoutId });
             }
         }).catch((error: Error) => { this.setState({ statusCode: 500 }); });
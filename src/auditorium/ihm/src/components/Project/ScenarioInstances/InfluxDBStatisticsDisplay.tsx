@@ -5,15 +5,23 @@ import {List, ListItem} from "material-ui/List";
 
 import {notify} from "../../../actions/global";
 import {getStatisticsNames} from "../../../api/influx";
-import {IInfluxNames, IJobsDisplay} from "../../../interfaces/influx.interface";
+import {appendStatistics, subscribeStatistics} from "../../../api/live";
+import {IInfluxNames, IInfluxStatistics, IJobsDisplay, ILiveSubscription} from "../../../interfaces/influx.interface";
 
 import UnitsSelector from "./UnitsSelector";
 
 
+// Points kept per job to display the last value of its statistics
+const LIVE_MAX_POINTS = 100;
+const LIVE_RESOLUTION = 1000;
+
+
 class InfluxDBStatisticsDisplay extends React.Component<IProps & IStoreProps & IDispatchProps, IState> {
+    private subscriptions: ILiveSubscription[] = [];
+
     constructor(props) {
         super(props);
-        this.state = { statistics: {} };
+        this.state = { statistics: {}, live: {} };
     }
 
     public render() {
@@ -21,11 +29,13 @@ class InfluxDBStatisticsDisplay extends React.Component<IProps & IStoreProps & I
             const {name, id, agent} = job;
             const label = name + " (id " + id + " on " + agent + ")";
             const statisticsNames = this.state.statistics[name];
+            const live = this.state.live[id];
 
             const stats = (statisticsNames || []).map((statName: string, i: number) => (
                 <UnitsSelector
                     key={i}
                     name={statName}
+                    lastValue={live && this.lastValue(live, statName)}
                     onChange={this.props.onStatisticSelected.bind(this, name, id, agent, statName)}
                 />
             ));
@@ -49,16 +59,66 @@ class InfluxDBStatisticsDisplay extends React.Component<IProps & IStoreProps & I
             this.setState({ statistics: APIResult });
         }).catch((error: Error) => this.props.notify("Statistics names could not be fetched: " + error.message));
     }
+
+    public componentDidMount() {
+        if (this.props.live) {
+            this.subscribe(this.props.jobs);
+        }
+    }
+
+    public componentWillReceiveProps(nextProps: IProps & IStoreProps & IDispatchProps) {
+        if (!nextProps.live) {
+            this.unsubscribe();
+        } else if (!this.props.live || nextProps.jobs.length !== this.props.jobs.length) {
+            this.unsubscribe();
+            this.subscribe(nextProps.jobs);
+        }
+    }
+
+    public componentWillUnmount() {
+        this.unsubscribe();
+    }
+
+    private subscribe(jobs: IJobsDisplay[]) {
+        this.subscriptions = jobs.map((job: IJobsDisplay) => subscribeStatistics(
+            job.id, [], "", LIVE_RESOLUTION,
+            (points: IInfluxStatistics, history: boolean) => this.addPoints(job.id, points, history),
+        ));
+    }
+
+    private addPoints(jobId: number, points: IInfluxStatistics, history: boolean) {
+        const live = {...this.state.live};
+        const previous = live[jobId];
+        live[jobId] = history || !previous ? points : appendStatistics(previous, points, LIVE_MAX_POINTS);
+        this.setState({ statistics: this.state.statistics, live });
+    }
+
+    private unsubscribe() {
+        this.subscriptions.forEach((subscription: ILiveSubscription) => subscription.close());
+        this.subscriptions = [];
+    }
+
+    private lastValue(statistics: IInfluxStatistics, name: string): number {
+        const values = statistics[name] || [];
+        for (let i = values.length - 1; i >= 0; --i) {
+            if (values[i] !== null) {
+                return values[i];
+            }
+        }
+        return undefined;
+    }
 };
 
 
 interface IState {
     statistics: { [job: string]: string[]; };
+    live: { [jobId: number]: IInfluxStatistics; };
 };
 
 
 interface IProps {
     jobs: IJobsDisplay[];
+    live?: boolean;
     onStatisticSelected: (job: string, id: number, agent: string, name: string, unit: string) => void;
 };
 
@@ -59,6 +59,7 @@ class ScenarioStatisticsDialog extends React.Component<IProps & IDispatchProps,
         const form = (
             <InfluxDBStatisticsDisplay
                 jobs={jobs}
+                live={!this.props.instance.stop_date}
                 onStatisticSelected={this.addStatistic}
             />
         );
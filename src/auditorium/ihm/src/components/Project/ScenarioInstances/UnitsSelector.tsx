@@ -27,6 +27,7 @@ export default class UnitsSelector extends React.Component<IProps, IState> {
             <ListItem
                 leftCheckbox={<Checkbox style={{marginLeft: "16px"}} onCheck={this.doChange}/>}
                 primaryText={this.props.name}
+                secondaryText={this.props.lastValue === undefined ? undefined : "Last value: " + this.props.lastValue}
                 rightIconButton={unitForm}
             />
         );
@@ -56,5 +57,6 @@ interface IState {
 
 interface IProps {
     name: string;
+    lastValue?: number;
     onChange: (payload: string) => void;
 };
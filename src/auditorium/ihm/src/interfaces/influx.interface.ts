@@ -22,6 +22,11 @@ export interface IInfluxStatistics {
 };
 
 
+export interface ILiveSubscription {
+    close: () => void;
+};
+
+
 export interface IInfluxHistogram {
     buckets: number[];
     counts: number[];
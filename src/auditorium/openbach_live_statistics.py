@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Live statistics hub
+
+Receive the statistics broadcast by the collector, keep the last
+points of each series in memory and push them to the Auditorium
+charts as Server-Sent Events, decimated to the resolution each
+subscriber asked for.
+
+Subscribers connect to /statistics/<job_instance_id> with the optional
+query parameters `name` (repeatable, defaults to all statistics),
+`suffix` and `resolution` (in milliseconds). They first receive the
+buffered points as an `history` event then one message per flush
+interval containing the new points; both use the same
+{"time": [...], "<name>": [...]} layout than the statistics endpoint
+of the backend.
+
+Subscribers are not authenticated here: the hub only listens on the
+loopback interface and nginx asks the backend whether the user may see
+the job instance before proxying a subscription.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import time
+import syslog
+import asyncio
+import argparse
+import urllib.parse
+from collections import deque
+from datetime import datetime
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+
+MIN_RESOLUTION = 50
+DEFAULT_RESOLUTION = 1000
+KEEPALIVE_INTERVAL = 15
+MAX_PENDING_BROADCAST = 2**20  # Characters of an undecodable broadcast kept before dropping it
+
+
+def parse_timestamp(timestamp):
+    """Convert the @timestamp of an event into milliseconds"""
+    if isinstance(timestamp, (int, float)):
+        return timestamp
+    if timestamp.endswith('Z'):
+        timestamp = timestamp[:-1] + '+00:00'
+    return datetime.fromisoformat(timestamp).timestamp() * 1000
+
+
+def decimate(points, resolution, names):
+    """Reduce a sequence of (timestamp, values) points to at most one
+    point per resolution milliseconds, averaging the values of each
+    statistic over a bucket.
+    """
+    channel = Channel(resolution, names)
+    for timestamp, values in points:
+        channel.add(timestamp, values)
+    channel.close_bucket()
+    return channel.pending
+
+
+class Channel:
+    """Decimated view of a series, shared by every subscriber
+    asking for the same statistics at the same resolution so
+    each message is aggregated and encoded only once.
+    """
+
+    def __init__(self, resolution, names):
+        self.resolution = resolution
+        self.names = names
+        self.subscribers = set()
+        self.pending = {'time': []}
+        self.bucket_start = None
+        self.bucket_opened = None
+        self.last_timestamp = None
+        self.sums = {}
+        self.counts = {}
+
+    def add(self, timestamp, values):
+        if self.bucket_start is not None and timestamp >= self.bucket_start + self.resolution:
+            self.close_bucket()
+        if self.bucket_start is None:
+            self.bucket_start = timestamp
+            self.bucket_opened = time.monotonic()
+        self.last_timestamp = timestamp
+
+        sums = self.sums
+        counts = self.counts
+        names = self.names or values
+        for name in names:
+            value = values.get(name)
+            if value is not None:
+                sums[name] = sums.get(name, 0) + value
+                counts[name] = counts.get(name, 0) + 1
+
+    def close_bucket(self):
+        if self.bucket_start is None:
+            return
+        if not self.sums:
+            # None of the requested statistics in this bucket
+            self.bucket_start = None
+            return
+
+        pending = self.pending
+        length = len(pending['time'])
+        pending['time'].append(self.last_timestamp)
+        counts = self.counts
+        for name, total in self.sums.items():
+            try:
+                column = pending[name]
+            except KeyError:
+                column = pending[name] = [None] * length
+            column.append(total / counts[name])
+        for column in pending.values():
+            if len(column) == length:
+                column.append(None)
+
+        self.bucket_start = None
+        self.sums = {}
+        self.counts = {}
+
+    def flush(self, now, max_buffer):
+        """Send the points aggregated since the last flush to the
+        subscribers; a bucket is closed without waiting for the next
+        point once it has been open for resolution milliseconds.
+        """
+        if self.bucket_start is not None and (now - self.bucket_opened) * 1000 >= self.resolution:
+            self.close_bucket()
+        if not self.pending['time']:
+            return
+
+        message = 'data: {}\n\n'.format(json.dumps(self.pending)).encode()
+        self.pending = {'time': []}
+        for subscriber in list(self.subscribers):
+            subscriber.send(message, max_buffer)
+
+
+class Series:
+    def __init__(self, size):
+        self.points = deque(maxlen=size)
+        self.channels = {}
+        self.updated = time.monotonic()
+
+
+class Subscriber:
+    def __init__(self, writer):
+        self.writer = writer
+        self.closed = asyncio.Event()
+
+    def send(self, message, max_buffer):
+        if self.closed.is_set():
+            return
+        transport = self.writer.transport
+        if transport.is_closing() or transport.get_write_buffer_size() > max_buffer:
+            # Too slow to keep up: the EventSource reconnects
+            # and resynchronizes from the history instead
+            self.close()
+        else:
+            self.writer.write(message)
+
+    def close(self):
+        self.closed.set()
+        self.writer.close()
+
+
+class LiveStatisticsHub:
+    def __init__(self, buffer_size=1000, flush_interval=0.1, expiry=600, max_buffer=2**20):
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.expiry = expiry
+        self.max_buffer = max_buffer
+        self.series = {}
+        self.received = 0
+
+    def handle(self, event):
+        try:
+            job_instance_id = int(event['@job_instance_id'])
+            timestamp = parse_timestamp(event['@timestamp'])
+        except (KeyError, TypeError, ValueError):
+            # Broadcast logs and malformed events
+            return
+
+        values = {
+                name: value for name, value in event.items()
+                if not name.startswith('@')
+                and isinstance(value, (int, float))
+                and not isinstance(value, bool)
+        }
+        if not values:
+            return
+
+        key = (job_instance_id, event.get('@suffix', ''))
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = Series(self.buffer_size)
+        series.points.append((timestamp, values))
+        series.updated = time.monotonic()
+        for channel in series.channels.values():
+            channel.add(timestamp, values)
+        self.received += 1
+
+    def subscribe(self, subscriber, job_instance_id, suffix, resolution, names):
+        key = (job_instance_id, suffix)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = Series(self.buffer_size)
+
+        channel_key = (resolution, names)
+        channel = series.channels.get(channel_key)
+        if channel is None:
+            channel = series.channels[channel_key] = Channel(resolution, names)
+        channel.subscribers.add(subscriber)
+
+        history = decimate(series.points, resolution, names)
+        return 'event: history\ndata: {}\n\n'.format(json.dumps(history)).encode()
+
+    def unsubscribe(self, subscriber, job_instance_id, suffix, resolution, names):
+        series = self.series.get((job_instance_id, suffix))
+        if series is None:
+            return
+        channel_key = (resolution, names)
+        channel = series.channels.get(channel_key)
+        if channel is None:
+            return
+        channel.subscribers.discard(subscriber)
+        if not channel.subscribers:
+            del series.channels[channel_key]
+
+    @property
+    def subscribers(self):
+        return sum(
+                len(channel.subscribers)
+                for series in self.series.values()
+                for channel in series.channels.values())
+
+    async def run(self):
+        last_expiry = last_keepalive = time.monotonic()
+        keepalive = b': keepalive\n\n'
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            now = time.monotonic()
+            for series in self.series.values():
+                for channel in series.channels.values():
+                    channel.flush(now, self.max_buffer)
+
+            if now - last_keepalive >= KEEPALIVE_INTERVAL:
+                last_keepalive = now
+                for series in self.series.values():
+                    for channel in series.channels.values():
+                        for subscriber in list(channel.subscribers):
+                            subscriber.send(keepalive, self.max_buffer)
+
+            if now - last_expiry >= self.expiry:
+                last_expiry = now
+                self.series = {
+                        key: series
+                        for key, series in self.series.items()
+                        if series.channels or now - series.updated < self.expiry
+                }
+
+
+class BroadcastProtocol(asyncio.DatagramProtocol):
+    def __init__(self, hub):
+        self.hub = hub
+
+    def datagram_received(self, data, address):
+        try:
+            event = json.loads(data)
+        except ValueError:
+            return
+        if isinstance(event, dict):
+            self.hub.handle(event)
+
+
+async def serve_broadcast(hub, reader, writer):
+    """Handle a Logstash TCP output, which may or may not
+    delimit the JSON documents with newlines.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    try:
+        while True:
+            data = await reader.read(2**16)
+            if not data:
+                break
+            buffer += data.decode(errors='replace')
+            position = 0
+            while True:
+                while position < len(buffer) and buffer[position].isspace():
+                    position += 1
+                try:
+                    event, position = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    break
+                if isinstance(event, dict):
+                    hub.handle(event)
+            buffer = buffer[position:]
+            if len(buffer) > MAX_PENDING_BROADCAST:
+                syslog.syslog(
+                        syslog.LOG_WARNING,
+                        'Dropping {} characters of undecodable broadcast'.format(len(buffer)))
+                buffer = ''
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+def _http_error(writer, status):
+    writer.write('HTTP/1.1 {}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'.format(status).encode())
+    writer.close()
+
+
+async def serve_subscriber(hub, reader, writer):
+    try:
+        request = await reader.readline()
+        while (await reader.readline()).strip():
+            # Headers are not needed
+            pass
+        method, target, _ = request.decode('latin-1').split()
+    except (ConnectionError, ValueError, asyncio.LimitOverrunError):
+        writer.close()
+        return
+
+    url = urllib.parse.urlsplit(target)
+    path = url.path.strip('/').split('/')
+    if method != 'GET':
+        return _http_error(writer, '405 Method Not Allowed')
+    if path == ['status']:
+        body = json.dumps({
+            'series': len(hub.series),
+            'subscribers': hub.subscribers,
+            'received': hub.received,
+        }).encode()
+        writer.write(
+                b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                b'Content-Length: ' + str(len(body)).encode() +
+                b'\r\nConnection: close\r\n\r\n' + body)
+        writer.close()
+        return
+    if len(path) != 2 or path[0] != 'statistics':
+        return _http_error(writer, '404 Not Found')
+
+    query = urllib.parse.parse_qs(url.query)
+    try:
+        job_instance_id = int(path[1])
+        resolution = max(int(query.get('resolution', [DEFAULT_RESOLUTION])[0]), MIN_RESOLUTION)
+    except ValueError:
+        return _http_error(writer, '400 Bad Request')
+    suffix = query.get('suffix', [''])[0]
+    names = tuple(sorted(set(query.get('name', []))))
+
+    subscriber = Subscriber(writer)
+    history = hub.subscribe(subscriber, job_instance_id, suffix, resolution, names)
+    try:
+        writer.write(
+                b'HTTP/1.1 200 OK\r\n'
+                b'Content-Type: text/event-stream\r\n'
+                b'Cache-Control: no-cache\r\n'
+                b'X-Accel-Buffering: no\r\n'
+                b'Connection: keep-alive\r\n\r\n'
+                b'retry: 2000\n\n' + history)
+        # Nothing is expected from the client: wait for it to
+        # go away or for the hub to drop it for being too slow
+        disconnected = asyncio.ensure_future(reader.read())
+        closed = asyncio.ensure_future(subscriber.closed.wait())
+        await asyncio.wait((disconnected, closed), return_when=asyncio.FIRST_COMPLETED)
+        disconnected.cancel()
+        closed.cancel()
+    except ConnectionError:
+        pass
+    finally:
+        hub.unsubscribe(subscriber, job_instance_id, suffix, resolution, names)
+        subscriber.close()
+
+
+async def main(args):
+    hub = LiveStatisticsHub(args.buffer_size, args.flush_interval)
+
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+            lambda: BroadcastProtocol(hub),
+            local_addr=('0.0.0.0', args.broadcast_port))
+    broadcast = await asyncio.start_server(
+            lambda reader, writer: serve_broadcast(hub, reader, writer),
+            '0.0.0.0', args.broadcast_port)
+    subscribers = await asyncio.start_server(
+            lambda reader, writer: serve_subscriber(hub, reader, writer),
+            args.address, args.port)
+    try:
+        async with broadcast, subscribers:
+            await hub.run()
+    finally:
+        transport.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+            '-b', '--broadcast-port', type=int, default=2223,
+            help='port on which the collector broadcasts statistics (TCP and UDP)')
+    parser.add_argument(
+            '-a', '--address', default='127.0.0.1',
+            help='address to serve subscribers on')
+    parser.add_argument(
+            '-p', '--port', type=int, default=2224,
+            help='port to serve subscribers on')
+    parser.add_argument(
+            '-s', '--buffer-size', type=int, default=1000,
+            help='amount of points kept in memory for each series')
+    parser.add_argument(
+            '-f', '--flush-interval', type=float, default=0.1,
+            help='interval in seconds between two messages sent to subscribers')
+    args = parser.parse_args()
+
+    syslog.openlog('openbach_live_statistics', syslog.LOG_PID, syslog.LOG_USER)
+    asyncio.run(main(args))
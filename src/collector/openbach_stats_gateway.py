@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Statistics ingestion gateway
+
+Lightweight replacement for the statistics part of the Logstash
+pipeline of the collector. It accepts the statistics sent by rstats
+on the same TCP and UDP port, writes the stored ones to InfluxDB as
+gzip'd batches of line protocol and forwards the broadcast ones to
+the Auditorium, using the same measurements, tags and fields than
+the Logstash pipeline.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import gzip
+import math
+import functools
+import time
+import socket
+import syslog
+import asyncio
+import argparse
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import deque
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+import yaml
+
+
+DEFAULT_CONFIG_FILE = '/opt/openbach/collector/stats_gateway.yml'
+TAGS = (
+        'owner_scenario_instance_id',
+        'scenario_instance_id',
+        'job_instance_id',
+        'agent_name',
+        'is_file',
+        'suffix',
+)
+TAG_NAMES = {
+        'owner_scenario_instance_id': '@owner_scenario_instance_id',
+        'scenario_instance_id': '@scenario_instance_id',
+        'job_instance_id': '@job_instance_id',
+        'agent_name': '@agent_name',
+        'is_file': '@stored_file',
+        'suffix': '@suffix',
+}
+PRECISIONS = {'ns': 10**6, 'u': 10**3, 'ms': 1, 's': 10**-3, 'm': 1 / 60000, 'h': 1 / 3600000}
+
+
+def _escape(text, characters=',= '):
+    text = str(text).replace('\\', '\\\\')
+    for character in characters:
+        text = text.replace(character, '\\' + character)
+    return text.replace('\n', '\\n')
+
+
+def _tag_value(value):
+    """Format tags the way Logstash sprintf does"""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def _field_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return '{}i'.format(value)
+    if isinstance(value, float):
+        # InfluxDB refuses the whole batch on non-finite values
+        return repr(value) if math.isfinite(value) else None
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        value = json.dumps(value)
+    return '"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+@functools.lru_cache(maxsize=4096)
+def _series_key(job_name, *tag_values):
+    """Measurement and tags part of a line, identical for every
+    statistic of a given series and thus computed once.
+    """
+    tags = ''.join(
+            ',{}={}'.format(_escape(TAG_NAMES[tag]), _escape(_tag_value(value)))
+            for tag, value in sorted(zip(TAGS, tag_values), key=lambda t: TAG_NAMES[t[0]])
+            if value != ''
+    )
+    return _escape(job_name, ', ') + tags
+
+
+@functools.lru_cache(maxsize=4096)
+def _field_key(name):
+    return _escape(name)
+
+
+def to_line_protocol(statistics, metadata, precision='ms'):
+    """Convert a statistic record into an InfluxDB line protocol line;
+    return None if there is no field to write.
+    """
+    fields = ','.join(
+            _field_key(name) + '=' + value
+            for name, value in ((name, _field_value(value)) for name, value in statistics.items())
+            if value is not None
+    )
+    if not fields:
+        return None
+
+    series = _series_key(metadata['job_name'], *(metadata.get(tag, '') for tag in TAGS))
+    timestamp = int(metadata['time'] * PRECISIONS[precision])
+    return '{} {} {}'.format(series, fields, timestamp)
+
+
+def to_broadcast_event(statistics, metadata):
+    """Build the event the Logstash pipeline would broadcast"""
+    event = dict(statistics)
+    event.update(
+            ('@' + tag, _tag_value(metadata[tag]))
+            for tag in ('owner_scenario_instance_id', 'scenario_instance_id', 'job_instance_id', 'agent_name', 'job_name')
+    )
+    event['@stored_file'] = _tag_value(metadata.get('is_file', False))
+    if metadata.get('suffix'):
+        event['@suffix'] = _tag_value(metadata['suffix'])
+    timestamp = datetime.fromtimestamp(metadata['time'] / 1000, timezone.utc)
+    event['@timestamp'] = timestamp.strftime('%Y-%m-%dT%H:%M:%S.') + '{:03d}Z'.format(timestamp.microsecond // 1000)
+    event['@version'] = '1'
+    return event
+
+
+class InfluxDBWriter:
+    """Accumulate line protocol lines and write them in gzip'd
+    batches to InfluxDB, in order, from a dedicated thread.
+
+    Failed batches are retried every second; when
+    InfluxDB is unreachable for too long, the oldest lines are
+    dropped past max_pending lines.
+    """
+
+    def __init__(self, host='localhost', port=8086, database='openbach',
+                 precision='ms', retention_policy=None, batch_size=5000,
+                 flush_interval=1.0, max_pending=1000000, timeout=10):
+        query = {'db': database, 'precision': precision}
+        if retention_policy:
+            query['rp'] = retention_policy
+        self.url = 'http://{}:{}/write?{}'.format(host, port, urllib.parse.urlencode(query))
+        self.precision = precision
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = deque()
+        self.dropped = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._flushing = None
+
+    def add(self, line):
+        self.pending.append(line)
+        if len(self.pending) > self.max_pending:
+            self.pending.popleft()
+            self.dropped += 1
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._flushing is not None and not self._flushing.done():
+            return
+        if not self.pending:
+            return
+        count = min(len(self.pending), self.batch_size)
+        batch = [self.pending.popleft() for _ in range(count)]
+        loop = asyncio.get_event_loop()
+        self._flushing = loop.run_in_executor(self._executor, self._write, batch)
+        self._flushing.add_done_callback(self._written)
+
+    def _written(self, future):
+        if future.result() is not None:
+            # Put the batch back in front for a later retry
+            self.pending.extendleft(reversed(future.result()))
+        elif len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def _write(self, batch):
+        payload = gzip.compress('\n'.join(batch).encode(), compresslevel=1)
+        request = urllib.request.Request(
+                self.url, data=payload, method='POST',
+                headers={'Content-Encoding': 'gzip', 'Content-Type': 'text/plain'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                pass
+        except urllib.error.HTTPError as error:
+            body = error.read().decode(errors='replace')
+            syslog.syslog(syslog.LOG_ERR, 'InfluxDB refused a batch: {} {}'.format(error.code, body))
+            if error.code < 500:
+                # Malformed points or type conflicts would be refused forever
+                return None
+            time.sleep(1)
+            return batch
+        except OSError as error:
+            syslog.syslog(syslog.LOG_WARNING, 'Cannot reach InfluxDB: {}'.format(error))
+            time.sleep(1)
+            return batch
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self.dropped:
+                syslog.syslog(syslog.LOG_ERR, 'Dropped {} statistics while InfluxDB was unreachable'.format(self.dropped))
+                self.dropped = 0
+            self.flush()
+
+
+class Broadcaster:
+    """Forward broadcast-flagged statistics to the Auditorium"""
+
+    def __init__(self, mode='udp', host='localhost', port=2223):
+        self.mode = mode
+        self.address = (host, port)
+        self.sock = None
+
+    def send(self, event):
+        data = json.dumps(event).encode()
+        try:
+            if self.mode == 'tcp':
+                if self.sock is None:
+                    self.sock = socket.create_connection(self.address, timeout=1)
+                self.sock.sendall(data + b'\n')
+            else:
+                if self.sock is None:
+                    self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    self.sock.setblocking(False)
+                self.sock.sendto(data, self.address)
+        except OSError:
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+
+
+class StatisticsGateway:
+    def __init__(self, writer, broadcaster):
+        self.writer = writer
+        self.broadcaster = broadcaster
+
+    def handle(self, message):
+        try:
+            statistics = json.loads(message)
+            metadata = statistics.pop('_metadata')
+            flag = int(metadata['flag'])
+        except (ValueError, TypeError, KeyError, AttributeError):
+            # Same behaviour than Logstash: malformed or unflagged statistics are dropped
+            return
+
+        try:
+            if flag & 1:
+                line = to_line_protocol(statistics, metadata, self.writer.precision)
+                if line is not None:
+                    self.writer.add(line)
+            if flag & 2 and self.broadcaster is not None:
+                self.broadcaster.send(to_broadcast_event(statistics, metadata))
+        except (KeyError, TypeError, ValueError) as error:
+            syslog.syslog(syslog.LOG_WARNING, 'Dropping malformed statistic: {}'.format(error))
+
+
+class DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, gateway):
+        self.gateway = gateway
+
+    def datagram_received(self, data, address):
+        self.gateway.handle(data)
+
+
+async def serve_stream(gateway, reader, writer):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.strip():
+                gateway.handle(line)
+    except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def main(config):
+    influxdb = InfluxDBWriter(**config.get('influxdb', {}), **config.get('batch', {}))
+    broadcast = config.get('broadcast')
+    broadcaster = Broadcaster(**broadcast) if broadcast else None
+    gateway = StatisticsGateway(influxdb, broadcaster)
+
+    port = config['stats']['port']
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+            lambda: DatagramProtocol(gateway),
+            local_addr=('0.0.0.0', port))
+    # Absorb bursts of datagrams, kernel limits permitting
+    transport.get_extra_info('socket').setsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF,
+            config['stats'].get('receive_buffer_bytes', 2**23))
+    server = await asyncio.start_server(
+            lambda reader, writer: serve_stream(gateway, reader, writer),
+            '0.0.0.0', port, limit=2**22)
+    try:
+        async with server:
+            await influxdb.run()
+    finally:
+        transport.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+            '-c', '--config', default=DEFAULT_CONFIG_FILE,
+            help='path to the configuration file of the gateway')
+    args = parser.parse_args()
+
+    syslog.openlog('openbach_stats_gateway', syslog.LOG_PID, syslog.LOG_USER)
+    with open(args.config, encoding='utf-8') as stream:
+        configuration = yaml.safe_load(stream)
+    asyncio.run(main(configuration))
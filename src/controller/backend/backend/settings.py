@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -123,6 +124,23 @@ STATICFILES_DIRS = []
 STATIC_ROOT = os.path.join(BASE_DIR, 'static_root')
 
 
+# Folder holding the sockets through which backend workers
+# are notified of the changes made by other processes
+
+NOTIFICATIONS_FOLDER = os.path.join(tempfile.gettempdir(), 'openbach_notifications')
+
+
+# Content-addressed storage of the files uploaded to the controller
+
+FILE_STORE_FOLDER = '/opt/openbach/controller/file_store'
+
+
+# How long InfluxDB keeps the rollups of the statistics of finished
+# scenarios, as an InfluxDB duration (INF keeps them forever)
+
+STATISTICS_ROLLUPS_DURATION = '52w'
+
+
 try:
     from .local_settings import *
 except ImportError:
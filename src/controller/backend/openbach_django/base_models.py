@@ -39,6 +39,7 @@ import json
 import shlex
 import string
 import ipaddress
+from functools import lru_cache
 
 from django.db import models
 from django.core.exceptions import ValidationError
@@ -59,6 +60,68 @@ class ValuesType(enum.Enum):
         return tuple((t.value, t.name) for t in cls)
 
 
+class CompiledTemplate:
+    """Placeholders template parsed once into a substitution plan
+    behaving like `string.Template.substitute`: a sequence of
+    literal texts, of parameter names and of invalid placeholders.
+    """
+
+    LITERAL, NAME, INVALID = range(3)
+
+    def __init__(self, template):
+        self.plan = []
+        position = 0
+        for match in string.Template.pattern.finditer(template):
+            escaped, named, braced, invalid = match.groups()
+            literal = template[position:match.start()]
+            if escaped is not None:
+                literal += string.Template.delimiter
+            if literal:
+                self.plan.append((self.LITERAL, literal))
+            if invalid is not None:
+                self.plan.append((self.INVALID, None))
+            elif escaped is None:
+                self.plan.append((self.NAME, named or braced))
+            position = match.end()
+        if position < len(template):
+            self.plan.append((self.LITERAL, template[position:]))
+
+    def placeholders(self):
+        for kind, name in self.plan:
+            if kind == self.INVALID:
+                raise ValidationError(
+                        'value uses the placeholder escape '
+                        'symbol ($) but does not provide a '
+                        'valid identifier', code='invalid_template')
+            if kind == self.NAME:
+                yield name
+
+    def substitute(self, parameters):
+        """Replace placeholders by their value in parameters.
+
+        Raise KeyError if a placeholder is not found in the
+        parameters and ValueError on invalid placeholders.
+        """
+        chunks = []
+        for kind, text in self.plan:
+            if kind == self.LITERAL:
+                chunks.append(text)
+            elif kind == self.NAME:
+                chunks.append(str(parameters[text]))
+            else:
+                raise ValueError('Invalid placeholder in template')
+        return ''.join(chunks)
+
+
+@lru_cache(maxsize=4096)
+def compile_template(template):
+    """Compile a template, reusing previous compilations
+    of the same text since most of them are loaded many
+    times from the database.
+    """
+    return CompiledTemplate(template)
+
+
 class OpenbachFunctionParameter(models.TextField):
     """Custom field type to ease usage of placeholders in parameters values"""
 
@@ -81,6 +144,8 @@ class OpenbachFunctionParameter(models.TextField):
             (ipaddress.IPv4Interface, ipaddress.IPv6Interface): ipaddress.ip_interface,
     }
 
+    _CHECKERS = {}
+
     def __init__(self, *args, **kwargs):
         type_ = kwargs.pop('type', type(None))
 
@@ -108,25 +173,20 @@ class OpenbachFunctionParameter(models.TextField):
 
     @classmethod
     def from_type(cls, kind):
-        return cls(type=cls._TYPES[ValuesType(kind)])
+        # Checkers are stateless, share them rather than
+        # building a new field each time a value is checked
+        try:
+            return cls._CHECKERS[kind]
+        except KeyError:
+            checker = cls._CHECKERS[kind] = cls(type=cls._TYPES[ValuesType(kind)])
+            return checker
 
     @staticmethod
     def placeholders(value):
         if not isinstance(value, str):
             return
 
-        templated = string.Template(value)
-        for match in templated.pattern.finditer(templated.template):
-            escaped, named, braced, invalid = match.groups()
-            if invalid is not None:
-                raise ValidationError(
-                        'value uses the placeholder escape '
-                        'symbol ($) but does not provide a '
-                        'valid identifier', code='invalid_template')
-            if named is not None:
-                yield named
-            if braced is not None:
-                yield braced
+        yield from compile_template(value).placeholders()
 
     @staticmethod
     def has_placeholders(value):
@@ -142,7 +202,7 @@ class OpenbachFunctionParameter(models.TextField):
         if parameters is None:
             return self._convert_from_db_value(value, loose=True)
 
-        templated = string.Template(self.get_prep_value(value))
+        templated = compile_template(self.get_prep_value(value))
         try:
             value = templated.substitute(parameters)
         except KeyError as e:
@@ -165,29 +225,30 @@ class OpenbachFunctionParameter(models.TextField):
 
         return self._convert_from_db_value(value, self.has_placeholders(value))
 
-    def _convert_from_db_value(self, value, loose=False):
+    def _convert_from_db_value(self, value, loose=False, type_=None):
         """Helper function that perform the actual convertion between
         database values and Python values.
         """
-        if isinstance(self.type, list):
-            self.type, = self.type
-            try:
-                return [
-                        self._convert_from_db_value(v, loose)
-                        for v in self._CONVERTER[list](value)
-                ]
-            finally:
-                self.type = [self.type]
+        if type_ is None:
+            type_ = self.type
+
+        if isinstance(type_, list):
+            # Do not alter self.type as fields are shared between threads
+            inner_type, = type_
+            return [
+                    self._convert_from_db_value(v, loose, inner_type)
+                    for v in self._CONVERTER[list](value)
+            ]
 
         try:
-            return self._CONVERTER.get(self.type, self.type)(value)
+            return self._CONVERTER.get(type_, type_)(value)
         except (ValueError, KeyError):
             if loose:
                 return value
-            if isinstance(self.type, tuple):
-                expected = ' or '.join(t.__name__ for t in self.type)
+            if isinstance(type_, tuple):
+                expected = ' or '.join(t.__name__ for t in type_)
             else:
-                expected = self.type.__name__
+                expected = type_.__name__
             raise ValidationError(
                     'value has an invalid type \'%(real_type)s\' '
                     'should be \'%(expected_type)s\'',
@@ -0,0 +1,260 @@
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Management of the connections to the controller database.
+
+Django opens one connection per thread and the conductor and director
+spawn a lot of short-lived threads. Database engines using the
+PooledDatabaseWrapperMixin hand the raw connections back to a process
+wide pool instead of closing them, so they can be reused by the next
+thread rather than established again. The pool is bounded: threads
+asking for a connection while all of them are in use wait for one to
+be released.
+
+Threads that do not go through Django's request cycle must delimit
+their use of the database with database_boundary (or call
+release_connections before waiting on something else), otherwise
+their connection is kept out of the pool until they die.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import time
+import threading
+from functools import wraps
+
+from django.db import connections, close_old_connections
+from django.db.utils import OperationalError
+
+
+DEFAULT_POOL_SIZE = 64
+DEFAULT_POOL_TIMEOUT = 60
+DEFAULT_CHECK_INTERVAL = 30
+
+
+def is_usable(connection):
+    """Check that a raw DB-API connection still answers"""
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute('SELECT 1')
+        finally:
+            cursor.close()
+    except Exception:
+        return False
+    return True
+
+
+def _close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool:
+    """Thread-safe and bounded pool of raw DB-API connections.
+
+    At most `size` connections are opened at any given time; acquiring
+    a connection when they are all in use blocks for at most `timeout`
+    seconds. Idle connections that were not used for more than
+    `check_interval` seconds are checked before being handed out again.
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_POOL_TIMEOUT,
+                 check_interval=DEFAULT_CHECK_INTERVAL, check=is_usable):
+        self.size = size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.check = check
+        self._condition = threading.Condition()
+        self._idle = []
+        self._opened = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._peak = 0
+
+    def acquire(self, connect):
+        """Retrieve an idle connection or open a new one using
+        the connect callable if the pool is not full yet.
+        """
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._condition:
+            while not self._idle and self._opened >= self.size:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise OperationalError(
+                            'No database connection became available in '
+                            'the pool of {} connections after {} seconds'
+                            .format(self.size, self.timeout))
+                self._waiting += 1
+                try:
+                    self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            self._in_use += 1
+            self._peak = max(self._peak, self._in_use)
+            if self._idle:
+                connection, released = self._idle.pop()
+            else:
+                connection, released = None, None
+                self._opened += 1
+
+        if connection is not None and time.monotonic() - released > self.check_interval:
+            if not self.check(connection):
+                _close_quietly(connection)
+                connection = None
+
+        if connection is None:
+            try:
+                connection = connect()
+            except BaseException:
+                with self._condition:
+                    self._opened -= 1
+                    self._in_use -= 1
+                    self._condition.notify()
+                raise
+        return connection
+
+    def release(self, connection, reusable=True):
+        """Hand a connection back to the pool; connections that
+        can not be reused are closed, making room for a new one.
+        """
+        with self._condition:
+            self._in_use -= 1
+            if reusable:
+                # Most recently used connections are handed out first
+                self._idle.append((connection, time.monotonic()))
+            else:
+                self._opened -= 1
+            self._condition.notify()
+
+        if not reusable:
+            _close_quietly(connection)
+
+    def close(self):
+        """Close all idle connections"""
+        with self._condition:
+            idle = [connection for connection, _ in self._idle]
+            self._opened -= len(idle)
+            self._idle.clear()
+            self._condition.notify_all()
+
+        for connection in idle:
+            _close_quietly(connection)
+
+    def statistics(self):
+        with self._condition:
+            return {
+                    'size': self.size,
+                    'opened': self._opened,
+                    'in_use': self._in_use,
+                    'idle': len(self._idle),
+                    'waiting': self._waiting,
+                    'peak': self._peak,
+            }
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(alias, settings_dict):
+    """Retrieve the pool of connections of the given database alias,
+    creating it out of the POOL entry of its settings if need be.
+    """
+    with _POOLS_LOCK:
+        try:
+            return _POOLS[alias]
+        except KeyError:
+            options = settings_dict.get('POOL', {})
+            pool = _POOLS[alias] = ConnectionPool(
+                    options.get('SIZE', DEFAULT_POOL_SIZE),
+                    options.get('TIMEOUT', DEFAULT_POOL_TIMEOUT),
+                    options.get('CHECK_INTERVAL', DEFAULT_CHECK_INTERVAL))
+            return pool
+
+
+def statistics():
+    """Usage of the connection pools of the current process"""
+    with _POOLS_LOCK:
+        pools = dict(_POOLS)
+    return {alias: pool.statistics() for alias, pool in pools.items()}
+
+
+class PooledDatabaseWrapperMixin:
+    """Mixin for Django's DatabaseWrapper that acquires
+    its connections from a pool instead of opening them
+    and hands them back instead of closing them.
+    """
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias, self.settings_dict)
+        connect = super().get_new_connection
+        return pool.acquire(lambda: connect(conn_params))
+
+    def _close(self):
+        pool = get_pool(self.alias, self.settings_dict)
+        connection = self.connection
+        try:
+            # Do not leak an unfinished transaction to the next user
+            connection.rollback()
+        except Exception:
+            reusable = False
+        else:
+            reusable = not self.errors_occurred or pool.check(connection)
+        pool.release(connection, reusable)
+
+
+def release_connections():
+    """Hand the connections of the current thread back to their
+    pool, unless they are in the middle of a transaction.
+    """
+    for connection in connections.all():
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+def database_boundary(function):
+    """Decorate a function so it runs as a self-contained unit of
+    database work: unusable or obsolete connections are dropped before
+    calling it and the connections of the current thread are released
+    afterwards.
+    """
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            release_connections()
+    return wrapper
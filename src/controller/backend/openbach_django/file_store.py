@@ -0,0 +1,166 @@
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Content-addressed storage of the files uploaded to the controller.
+
+Files are stored read-only in the FILE_STORE_FOLDER under the SHA-256
+of their content. Uploads handled by the HashingUploadHandler are
+written once, in a staging area of the store, and hashed while they
+are received; adding them to the store is then a matter of creating a
+hard link. Keeping them at a path of the controller's files makes a
+copy, so that rewriting the kept file in place leaves the blob intact.
+
+Blobs are never modified, so they can be handed to the conductor and
+pushed to agents as-is; the ones that were not used for a while are
+removed by systemd-tmpfiles on the controller.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import os
+import shutil
+import hashlib
+import pathlib
+import tempfile
+from contextlib import suppress
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _root():
+    return pathlib.Path(settings.FILE_STORE_FOLDER)
+
+
+def _staging_file():
+    staging = _root() / 'staging'
+    staging.mkdir(parents=True, exist_ok=True)
+    return tempfile.NamedTemporaryFile(suffix='.upload', dir=str(staging))
+
+
+def blob_path(digest):
+    """Path of the file holding the content of the given hash"""
+    return _root() / digest[:2] / digest
+
+
+def _publish(staged_path, digest):
+    path = blob_path(digest)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    os.chmod(staged_path, 0o444)
+    try:
+        os.link(staged_path, str(path))
+    except FileExistsError:
+        # Same content already stored, mark it as recently used
+        os.utime(str(path))
+    return path
+
+
+class HashedUploadedFile(UploadedFile):
+    """A file uploaded into the staging area of the store
+    whose SHA-256 is computed as it is written.
+    """
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        super().__init__(_staging_file(), name, content_type, size, charset, content_type_extra)
+        self.hasher = hashlib.sha256()
+        self.digest = None
+
+    def write(self, data):
+        self.hasher.update(data)
+        return self.file.write(data)
+
+    def temporary_file_path(self):
+        return self.file.name
+
+    def close(self):
+        with suppress(FileNotFoundError):
+            return self.file.close()
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """Upload handler streaming the files into the staging
+    area of the store, hashing them on the fly.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = HashedUploadedFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.flush()
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.digest = self.file.hasher.hexdigest()
+        return self.file
+
+
+def add(uploaded_file):
+    """Add the content of an uploaded file to the store
+    and return its hash.
+
+    Files received through the HashingUploadHandler are linked
+    into the store, others are copied there chunk by chunk.
+    """
+    digest = getattr(uploaded_file, 'digest', None)
+    if digest is not None:
+        _publish(uploaded_file.temporary_file_path(), digest)
+        return digest
+
+    hasher = hashlib.sha256()
+    with _staging_file() as staged:
+        for chunk in uploaded_file.chunks(CHUNK_SIZE):
+            hasher.update(chunk)
+            staged.write(chunk)
+        staged.flush()
+        digest = hasher.hexdigest()
+        _publish(staged.name, digest)
+    return digest
+
+
+def materialize(digest, destination):
+    """Copy the content of the given hash at the destination
+    path, replacing any existing file there.
+    """
+    destination = pathlib.Path(destination)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    temporary = destination.with_name('.{}.{}'.format(destination.name, digest))
+    with suppress(FileNotFoundError):
+        temporary.unlink()
+    # A hard link would let in-place rewrites of the kept file alter the blob
+    shutil.copyfile(str(blob_path(digest)), str(temporary))
+    os.replace(str(temporary), str(destination))
@@ -43,7 +43,7 @@ __credits__ = '''Contributors:
 from itertools import chain
 from datetime import datetime
 
-from django.db import models, IntegrityError
+from django.db import models, transaction, IntegrityError
 from django.utils import timezone
 from django.contrib.auth.models import User
 
@@ -72,6 +72,7 @@ class Job(models.Model):
     description = models.TextField(null=True, blank=True)
     keywords = models.ManyToManyField(Keyword, related_name='jobs')
     persistent = models.BooleanField(default=False)
+    checksum = models.CharField(max_length=64, null=True, blank=True)
 
     def __str__(self):
         return self.name
@@ -283,7 +284,8 @@ class JobInstance(models.Model):
         elif status not in {self.Status.UNKNOWN, self.Status.AGENT_UNREACHABLE}:
             if self.stop_date is None:
                 self.stop_date = now
-        self.save()
+        with transaction.atomic():
+            self.save()
 
     @property
     def last_status(self):
@@ -0,0 +1,65 @@
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+
+"""Compute the summaries of the Scenario instances that
+were run before summaries were introduced.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+from django.db import transaction
+from django.core.management.base import BaseCommand
+
+from openbach_django.models import ScenarioInstance, ScenarioInstanceSummary
+
+
+class Command(BaseCommand):
+    help = 'Compute the summaries of existing Scenario instances'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+                '--all', action='store_true',
+                help='recompute every summary instead of only the missing ones')
+
+    def handle(self, *args, **options):
+        roots = ScenarioInstance.objects.filter(openbach_function_instance__isnull=True)
+        if not options['all']:
+            roots = roots.filter(summary__isnull=True)
+
+        count = 0
+        for scenario_instance in roots.order_by('id').iterator():
+            with transaction.atomic():
+                ScenarioInstanceSummary.rebuild(scenario_instance)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            'Computed summaries of {} Scenario instances trees'.format(count)))
@@ -0,0 +1,26 @@
+# Generated by Django 3.0.14 on 2026-10-19 11:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openbach_django', '0019_status_retry_openbach_function_instance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScenarioInstanceSummary',
+            fields=[
+                ('scenario_instance', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='openbach_django.ScenarioInstance')),
+                ('start_date', models.DateTimeField(blank=True, null=True)),
+                ('stop_date', models.DateTimeField(blank=True, null=True)),
+                ('openbach_functions_statuses', models.TextField(default='{}')),
+                ('job_instances_statuses', models.TextField(default='{}')),
+                ('job_instance_ids', models.TextField(default='[]')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='owned_summaries', to='openbach_django.ScenarioInstance')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-19 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openbach_django', '0021_resource_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='checksum',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.0.14 on 2026-10-19 15:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('openbach_django', '0022_job_checksum'),
+    ]
+
+    operations = [
+        # Do not roll up the whole history of the existing
+        # scenario instances on the next start of the director
+        migrations.AddField(
+            model_name='scenarioinstance',
+            name='statistics_rolled_up',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name='scenarioinstance',
+            name='statistics_rolled_up',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -47,3 +47,4 @@ from .job_models import *
 from .openbach_function_models import *
 from .scenario_models import *
 from .project_models import *
+from .version_models import *
@@ -0,0 +1,165 @@
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Notification of resources changes between controller processes.
+
+Each backend process waiting for changes binds a Unix datagram socket
+named after its PID in the NOTIFICATIONS_FOLDER. Whenever versions of
+resources are bumped, in whichever process (conductor, director or
+backend), the name of these resources is broadcasted to every socket
+found in this folder so waiting requests can be woken up right away.
+
+Notifications are a best effort: a missed notification only delays
+an answer until the waiting request times out.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import os
+import json
+import time
+import socket
+import pathlib
+import threading
+from contextlib import suppress
+from collections import Counter
+
+from django.conf import settings
+
+
+MAX_DATAGRAM_SIZE = 65536
+
+
+def _folder():
+    return pathlib.Path(settings.NOTIFICATIONS_FOLDER)
+
+
+def notify(names):
+    """Broadcast the names of the changed resources to every
+    process waiting for changes; never blocks.
+    """
+    try:
+        listeners = list(_folder().glob('*.sock'))
+    except OSError:
+        return
+    if not listeners:
+        return
+
+    payload = json.dumps(sorted(names)).encode()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+        sender.setblocking(False)
+        for path in listeners:
+            try:
+                sender.sendto(payload, str(path))
+            except ConnectionRefusedError:
+                # Left behind by a process that died
+                with suppress(OSError):
+                    path.unlink()
+            except OSError:
+                # Listener busy or gone, it will time out
+                pass
+
+
+class Listener:
+    """Receive the notifications sent to the current process
+    and wake up the threads waiting for them.
+    """
+
+    def __init__(self, folder):
+        folder.mkdir(parents=True, exist_ok=True)
+        self.pid = os.getpid()
+        self.path = folder / '{}.sock'.format(self.pid)
+        with suppress(OSError):
+            self.path.unlink()
+
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(str(self.path))
+        self._condition = threading.Condition()
+        self._changes = Counter()
+
+        thread = threading.Thread(target=self._receive, daemon=True)
+        thread.start()
+
+    def _receive(self):
+        while True:
+            try:
+                payload = self._socket.recv(MAX_DATAGRAM_SIZE)
+                names = json.loads(payload.decode())
+            except OSError:
+                return
+            except ValueError:
+                continue
+
+            with self._condition:
+                self._changes.update(names)
+                self._condition.notify_all()
+
+    def snapshot(self, names):
+        """Count of notifications received so far for the
+        given resources, to be provided to wait.
+        """
+        with self._condition:
+            return [self._changes[name] for name in names]
+
+    def wait(self, names, snapshot, timeout):
+        """Wait until a notification is received for any of the given
+        resources since the snapshot was taken. Return whether one
+        was received before the timeout expired.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while [self._changes[name] for name in names] == snapshot:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self):
+        self._socket.close()
+        with suppress(OSError):
+            self.path.unlink()
+
+
+_LISTENER = None
+_LISTENER_LOCK = threading.Lock()
+
+
+def listener():
+    """Retrieve the Listener of the current process, creating it on
+    first use (and after a fork, as forked workers do not inherit the
+    receiving thread).
+    """
+    global _LISTENER
+    with _LISTENER_LOCK:
+        if _LISTENER is None or _LISTENER.pid != os.getpid():
+            _LISTENER = Listener(_folder())
+        return _LISTENER
@@ -42,7 +42,7 @@ __credits__ = '''Contributors:
 
 from contextlib import suppress
 
-from django.db import models, IntegrityError
+from django.db import models, transaction, IntegrityError
 from django.utils import timezone
 
 from .utils import build_storage_path
@@ -191,14 +191,16 @@ class OpenbachFunctionInstance(models.Model):
     def start(self):
         self.status = self.Status.RUNNING
         self.launch_date = timezone.now()
-        self.save()
+        with transaction.atomic():
+            self.save()
 
     def get_status(self):
         return self.Status(self.status)
 
     def set_status(self, status):
         self.status = status
-        self.save()
+        with transaction.atomic():
+            self.save()
 
     def save(self, *args, **kwargs):
         if self.scenario_instance.scenario != self.openbach_function.scenario:
@@ -40,14 +40,17 @@ __credits__ = '''Contributors:
 '''
 
 
-from django.db import models, IntegrityError, DataError
+import json
+from collections import Counter
+
+from django.db import models, transaction, IntegrityError, DataError
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
 
 from .base_models import Argument, ArgumentValue, ValuesType, OpenbachFunctionParameter
-from .job_models import Job, JobArgument, SubcommandJobArgument
+from .job_models import Job, JobArgument, SubcommandJobArgument, JobInstance
 from .utils import subcommand_names
 from . import openbach_function_models  # So we can getattr from this module
 from .openbach_function_models import (  # Shortcuts
@@ -490,6 +493,7 @@ class ScenarioInstance(models.Model):
             models.CASCADE,
             null=True, blank=True,
             related_name='started_scenario')
+    statistics_rolled_up = models.BooleanField(default=False)
 
     def get_status(self):
         return self.Status(self.status)
@@ -509,7 +513,8 @@ class ScenarioInstance(models.Model):
         if self.stop_date is None or stop_status is not None:
             self.status = self.Status.STOPPED if stop_status is None else stop_status
             self.stop_date = timezone.now()
-            self.save()
+            with transaction.atomic():
+                self.save()
 
     @cached_property
     def parameters(self):
@@ -523,6 +528,19 @@ class ScenarioInstance(models.Model):
         )
         return constants
 
+    @property
+    def lineage(self):
+        """Ids of this Scenario instance and of all its
+        owners, from the innermost to the root.
+        """
+        lineage = []
+        scenario_instance = self
+        while scenario_instance is not None:
+            lineage.append(scenario_instance.id)
+            function = scenario_instance.openbach_function_instance
+            scenario_instance = None if function is None else function.scenario_instance
+        return lineage
+
     @property
     def sub_scenario_ids(self):
         return [
@@ -565,15 +583,191 @@ class ScenarioInstance(models.Model):
 
     @property
     def limited_json(self):
+        try:
+            summary = self.summary.json
+        except ScenarioInstanceSummary.DoesNotExist:
+            summary = None
+
         return {
                 'scenario_name': self.scenario.name,
                 'scenario_instance_id': self.id,
                 'status': self.get_status().label,
                 'start_date': self.start_date,
                 'sub_scenario_instance_ids': sorted(self.sub_scenario_ids),
+                'summary': summary,
         }
 
 
+class ScenarioInstanceSummary(models.Model):
+    """Denormalized state of a Scenario instance and of all its
+    sub-scenarios, updated each time the status or the dates of
+    one of their openbach functions or job instances change.
+    """
+
+    scenario_instance = models.OneToOneField(
+            ScenarioInstance, models.CASCADE,
+            primary_key=True, related_name='summary')
+    owner = models.ForeignKey(
+            ScenarioInstance, models.CASCADE,
+            related_name='owned_summaries')
+    start_date = models.DateTimeField(null=True, blank=True)
+    stop_date = models.DateTimeField(null=True, blank=True)
+    # JSON encoded counters and list
+    openbach_functions_statuses = models.TextField(default='{}')
+    job_instances_statuses = models.TextField(default='{}')
+    job_instance_ids = models.TextField(default='[]')
+
+    def __str__(self):
+        return 'Summary of {}'.format(self.scenario_instance)
+
+    @property
+    def job_instances(self):
+        return json.loads(self.job_instance_ids)
+
+    @property
+    def json(self):
+        return {
+                'owner_scenario_instance_id': self.owner_id,
+                'start_date': self.start_date,
+                'stop_date': self.stop_date,
+                'openbach_functions': json.loads(self.openbach_functions_statuses),
+                'job_instances': json.loads(self.job_instances_statuses),
+                'job_instance_ids': self.job_instances,
+        }
+
+    @classmethod
+    def refresh(cls, scenario_instance):
+        """Recompute the summary of the given Scenario instance
+        and of all its owners, from the innermost to the root.
+        """
+        lineage = scenario_instance.lineage
+        with transaction.atomic():
+            # Lock the whole lineage, always in the same order, so
+            # concurrent refreshes of a tree cannot interleave
+            instances = ScenarioInstance.objects.select_for_update().in_bulk(sorted(lineage))
+            for instance_id in lineage:
+                cls._refresh(instances[instance_id], owner_id=lineage[-1])
+
+    @classmethod
+    def update(
+            cls, lineage, functions=None, jobs=None, job_instance_id=None,
+            start_dates=(None, None), stop_dates=(None, None)):
+        """Apply a change that happened in the first Scenario instance
+        of the lineage to its summary and to the ones of its owners,
+        without recomputing them.
+
+        functions and jobs are Counters of the statuses to add (or
+        remove, for negative counts); start_dates and stop_dates are
+        the dates before and after the change. Summaries are fully
+        recomputed instead when they are missing or when the change
+        removes their earliest start date or their latest stop date.
+        """
+        functions = Counter() if functions is None else functions
+        jobs = Counter() if jobs is None else jobs
+        old_start, new_start = start_dates
+        old_stop, new_stop = stop_dates
+
+        with transaction.atomic():
+            # Lock the whole lineage, always in the same order, so
+            # concurrent updates of a tree cannot interleave
+            summaries = cls.objects.select_for_update().in_bulk(sorted(lineage))
+            if len(summaries) != len(lineage):
+                return cls.refresh(ScenarioInstance.objects.get(pk=lineage[0]))
+            stopped = set(ScenarioInstance.objects.filter(
+                    pk__in=lineage, stop_date__isnull=False,
+            ).values_list('pk', flat=True))
+
+            propagate_stop = True
+            for instance_id in lineage:
+                summary = summaries[instance_id]
+                if old_start is not None and old_start == summary.start_date and (new_start is None or new_start > old_start):
+                    return cls.refresh(ScenarioInstance.objects.get(pk=lineage[0]))
+                if new_start is not None and (summary.start_date is None or new_start < summary.start_date):
+                    summary.start_date = new_start
+
+                # Stop dates only reach the summaries of stopped scenarios
+                propagate_stop = propagate_stop and instance_id in stopped
+                if propagate_stop:
+                    if old_stop is not None and old_stop == summary.stop_date and (new_stop is None or new_stop < old_stop):
+                        return cls.refresh(ScenarioInstance.objects.get(pk=lineage[0]))
+                    if new_stop is not None and (summary.stop_date is None or new_stop > summary.stop_date):
+                        summary.stop_date = new_stop
+
+                summary.openbach_functions_statuses = cls._apply(summary.openbach_functions_statuses, functions)
+                summary.job_instances_statuses = cls._apply(summary.job_instances_statuses, jobs)
+                if job_instance_id is not None:
+                    summary.job_instance_ids = json.dumps(sorted(summary.job_instances + [job_instance_id]))
+
+            for summary in summaries.values():
+                summary.save()
+
+    @staticmethod
+    def _apply(statuses, changes):
+        if not changes:
+            return statuses
+        statuses = Counter(json.loads(statuses))
+        statuses.update(changes)
+        return json.dumps({status: count for status, count in statuses.items() if count > 0}, sort_keys=True)
+
+    @classmethod
+    def rebuild(cls, scenario_instance, owner_id=None):
+        """Recompute the summaries of a whole tree of Scenario
+        instances, from its leaves up to the given instance.
+        """
+        if owner_id is None:
+            owner_id = scenario_instance.id
+
+        sub_scenarios = ScenarioInstance.objects.filter(
+                openbach_function_instance__scenario_instance=scenario_instance)
+        for sub_scenario in sub_scenarios:
+            cls.rebuild(sub_scenario, owner_id)
+        cls._refresh(scenario_instance, owner_id)
+
+    @classmethod
+    def _refresh(cls, scenario_instance, owner_id):
+        functions_statuses = Counter()
+        jobs_statuses = Counter()
+        job_instance_ids = []
+        start_dates = [scenario_instance.start_date]
+        stop_dates = [scenario_instance.stop_date]
+
+        openbach_functions = OpenbachFunctionInstance.objects.filter(
+                scenario_instance=scenario_instance,
+        ).values_list(
+                'status', 'started_job__id', 'started_job__status',
+                'started_job__start_date', 'started_job__stop_date')
+        for status, job_id, job_status, job_start, job_stop in openbach_functions:
+            functions_statuses[OpenbachFunctionInstance.Status(status).label] += 1
+            if job_id is not None:
+                jobs_statuses[JobInstance.Status(job_status).label] += 1
+                job_instance_ids.append(job_id)
+                start_dates.append(job_start)
+                stop_dates.append(job_stop)
+
+        sub_scenarios = cls.objects.filter(
+                scenario_instance__openbach_function_instance__scenario_instance=scenario_instance)
+        for summary in sub_scenarios:
+            functions_statuses.update(json.loads(summary.openbach_functions_statuses))
+            jobs_statuses.update(json.loads(summary.job_instances_statuses))
+            job_instance_ids.extend(summary.job_instances)
+            start_dates.append(summary.start_date)
+            stop_dates.append(summary.stop_date)
+
+        start_dates = [date for date in start_dates if date is not None]
+        stop_dates = [date for date in stop_dates if date is not None]
+        cls.objects.update_or_create(
+                scenario_instance=scenario_instance,
+                defaults={
+                    'owner_id': owner_id,
+                    'start_date': min(start_dates, default=None),
+                    # Still running as long as the scenario itself is
+                    'stop_date': max(stop_dates) if scenario_instance.is_stopped else None,
+                    'openbach_functions_statuses': json.dumps(functions_statuses, sort_keys=True),
+                    'job_instances_statuses': json.dumps(jobs_statuses, sort_keys=True),
+                    'job_instance_ids': json.dumps(sorted(job_instance_ids)),
+                })
+
+
 class ScenarioArgument(Argument):
     """Data associated to an Argument for a Scenario"""
 
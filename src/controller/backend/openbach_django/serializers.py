@@ -0,0 +1,278 @@
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+
+"""Bulk serialization of scenario instances.
+
+Walking the `json` property of each scenario instance lazily fetches
+its owners, openbach functions, job instances and sub-scenarios one
+row at a time. The serializer in this module rather loads every
+scenario instance in the tree of a whole page one depth level at a
+time and fetches the associated rows with a handful of queries; the
+JSON produced is the same than the one of the models properties.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+from itertools import chain
+from collections import defaultdict
+
+from django.db.models import Max
+from django.utils import timezone
+
+from .utils import subcommand_names
+from .job_models import RequiredJobArgumentValue, OptionalJobArgumentValue
+from .scenario_models import ScenarioInstance, ScenarioVersion, ScenarioConstant, ScenarioArgumentValue
+from .openbach_function_models import OpenbachFunctionInstance
+
+
+class ScenarioInstancesSerializer:
+    """Serialize a page of scenario instances in a number of
+    queries that only depends on the depth of their trees of
+    sub-scenarios and on the amount of distinct openbach
+    functions involved; not on the amount of instances.
+    """
+
+    def __init__(self, scenario_instances):
+        self.scenario_instances = list(scenario_instances.select_related(
+                'scenario_version__scenario__project', 'summary'))
+        self._openbach_functions = {}
+        self._subcommands = {}
+
+    def limited_json(self):
+        sub_scenarios = defaultdict(list)
+        started = OpenbachFunctionInstance.objects.filter(
+                scenario_instance__in=self.scenario_instances,
+                started_scenario__isnull=False,
+        ).values_list('scenario_instance', 'started_scenario')
+        for scenario_instance_id, sub_scenario_id in started:
+            sub_scenarios[scenario_instance_id].append(sub_scenario_id)
+
+        return [{
+                'scenario_name': instance.scenario.name,
+                'scenario_instance_id': instance.id,
+                'status': instance.get_status().label,
+                'start_date': instance.start_date,
+                'sub_scenario_instance_ids': sorted(sub_scenarios[instance.id]),
+                'summary': self._summary_json(instance),
+        } for instance in self.scenario_instances]
+
+    def json(self):
+        functions = {}
+        owners = {}
+        job_instances = []
+        instances = self.scenario_instances
+        visited = {instance.id for instance in instances}
+        while instances:
+            instances_functions = OpenbachFunctionInstance.objects.filter(
+                    scenario_instance__in=instances,
+            ).select_related(
+                    'openbach_function',
+                    'started_scenario__scenario_version__scenario__project',
+                    'started_job__agent',
+            ).order_by('launch_date', 'id')
+
+            instances = []
+            for function in instances_functions:
+                functions.setdefault(function.scenario_instance_id, []).append(function)
+                scenario = self._related(function, 'started_scenario')
+                if scenario is not None:
+                    owners[scenario.id] = function.scenario_instance_id
+                    if scenario.id not in visited:
+                        # Sub-scenarios may also be part of the page
+                        visited.add(scenario.id)
+                        instances.append(scenario)
+                job_instance = self._related(function, 'started_job')
+                if job_instance is not None:
+                    job_instances.append(job_instance)
+
+        summaries_owners = {
+                instance.id: instance.summary.owner_id
+                for instance in self.scenario_instances
+                if self._related(instance, 'summary') is not None
+        }
+        self._retrieve_owners(owners, summaries_owners)
+        parameters = self._retrieve_parameters(self._tree(functions))
+        arguments = self._retrieve_job_arguments(job_instances)
+
+        def serialize(instance):
+            owner_id = instance.id
+            while owner_id not in summaries_owners and owner_id in owners:
+                owner_id = owners[owner_id]
+            owner_id = summaries_owners.get(owner_id, owner_id)
+
+            openbach_functions = []
+            for function in functions.get(instance.id, []):
+                json_data = self._openbach_function_json(function.openbach_function)
+                json_data['status'] = function.get_status().label
+                json_data['launch_date'] = function.launch_date
+                scenario = self._related(function, 'started_scenario')
+                if scenario is not None:
+                    json_data['scenario'] = serialize(scenario)
+                job_instance = self._related(function, 'started_job')
+                if job_instance is not None:
+                    json_data['job'] = self._job_instance_json(job_instance, arguments[job_instance.id])
+                openbach_functions.append(json_data)
+
+            return {
+                    'project_name': instance.scenario.project.name,
+                    'scenario_name': instance.scenario.name,
+                    'scenario_instance_id': instance.id,
+                    'owner_scenario_instance_id': owner_id,
+                    'sub_scenario_instance_ids': sorted(
+                        function.started_scenario.id
+                        for function in functions.get(instance.id, [])
+                        if self._related(function, 'started_scenario') is not None),
+                    'status': instance.get_status().label,
+                    'start_date': instance.start_date,
+                    'stop_date': instance.stop_date,
+                    'arguments': [
+                        {'name': key, 'value': value}
+                        for key, value in parameters[instance.id].items()
+                    ],
+                    'openbach_functions': openbach_functions,
+            }
+
+        return [serialize(instance) for instance in self.scenario_instances]
+
+    @staticmethod
+    def _related(instance, relation):
+        # Missing reverse one-to-one relations raise a
+        # DoesNotExist that is also an AttributeError
+        return getattr(instance, relation, None)
+
+    def _summary_json(self, instance):
+        summary = self._related(instance, 'summary')
+        return None if summary is None else summary.json
+
+    def _tree(self, functions):
+        instances = {instance.id: instance for instance in self.scenario_instances}
+        for openbach_functions in functions.values():
+            for function in openbach_functions:
+                scenario = self._related(function, 'started_scenario')
+                if scenario is not None:
+                    instances[scenario.id] = scenario
+        return instances
+
+    def _retrieve_owners(self, owners, known_owners):
+        """Complete the owners mapping with the ancestors of the
+        scenario instances of the page whose owner is not known.
+        """
+        orphans = {
+                instance.id for instance in self.scenario_instances
+                if instance.openbach_function_instance_id is not None
+                and instance.id not in owners
+                and instance.id not in known_owners
+        }
+        while orphans:
+            parents = ScenarioInstance.objects.filter(id__in=orphans).values_list(
+                    'id', 'openbach_function_instance__scenario_instance')
+            orphans = set()
+            for instance_id, owner_id in parents:
+                if owner_id is not None:
+                    owners[instance_id] = owner_id
+                    if owner_id not in owners:
+                        orphans.add(owner_id)
+
+    def _retrieve_parameters(self, instances):
+        scenarios = {instance.scenario_version.scenario_id for instance in instances.values()}
+        last_versions = ScenarioVersion.objects.filter(scenario__in=scenarios).values(
+                'scenario').annotate(last_version=Max('id')).values_list('scenario', 'last_version')
+        constants = defaultdict(dict)
+        for scenario_id, name, value in ScenarioConstant.objects.filter(
+                scenario_version__in=[version for _, version in last_versions]
+        ).values_list('scenario_version__scenario', 'name', 'value'):
+            constants[scenario_id][name] = value
+
+        parameters = {
+                instance.id: dict(constants[instance.scenario_version.scenario_id])
+                for instance in instances.values()
+        }
+        arguments = ScenarioArgumentValue.objects.filter(
+                scenario_instance__in=list(instances)
+        ).order_by('pk').values_list('scenario_instance', 'argument__name', 'value')
+        for instance_id, name, value in arguments:
+            parameters[instance_id][name] = value
+        return parameters
+
+    def _retrieve_job_arguments(self, job_instances):
+        arguments = defaultdict(list)
+        for model in (RequiredJobArgumentValue, OptionalJobArgumentValue):
+            values = model.objects.filter(
+                    job_instance__in=job_instances,
+            ).select_related('argument__subcommand').order_by('pk')
+            for value in values:
+                arguments[value.job_instance_id].append(value)
+        return arguments
+
+    def _openbach_function_json(self, openbach_function):
+        try:
+            json_data = self._openbach_functions[openbach_function.id]
+        except KeyError:
+            json_data = self._openbach_functions[openbach_function.id] = openbach_function.json
+        return dict(json_data)
+
+    def _subcommand_names(self, subcommand):
+        try:
+            return self._subcommands[subcommand.id]
+        except KeyError:
+            names = self._subcommands[subcommand.id] = list(subcommand_names(subcommand))
+            return names
+
+    def _job_instance_json(self, job_instance, arguments_values):
+        arguments = {}
+        for argument in arguments_values:
+            storage = arguments
+            for name in self._subcommand_names(argument.argument.subcommand):
+                storage = storage.setdefault(name, {})
+            storage.setdefault(argument.argument.name, []).append(argument.value)
+
+        tz = timezone.get_current_timezone()
+        stop_date = 'Not programmed yet'
+        if job_instance.stop_date is not None:
+            stop_date = job_instance.stop_date.astimezone(tz)
+
+        agent_address = None
+        if job_instance.agent:
+            agent_address = job_instance.agent.address
+
+        return {
+                'name': job_instance.job_name,
+                'agent': agent_address,
+                'agent_name': job_instance.agent_name,
+                'entity': job_instance.entity_name,
+                'id': job_instance.id,
+                'arguments': arguments,
+                'update_status': job_instance.update_status.astimezone(tz),
+                'status': job_instance.get_status().label,
+                'start_date': job_instance.start_date.astimezone(tz),
+                'stop_date': stop_date,
+        }
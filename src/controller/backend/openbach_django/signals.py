@@ -23,11 +23,22 @@
 # You should have received a copy of the GNU General Public License along with
 # this program. If not, see http://www.gnu.org/licenses/.
 
+from contextlib import suppress
+from collections import Counter
+
 from django.dispatch import receiver
-from django.db.models.signals import pre_delete, post_init, post_save
+from django.db.models.signals import pre_delete, post_init, post_save, post_delete, m2m_changed
+from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth.models import User
 
-from .models import StartJobInstanceArgument, Job
+from .models import (
+        StartJobInstanceArgument, Job, JobInstance,
+        ScenarioInstance, ScenarioInstanceSummary,
+        OpenbachFunctionInstance, ResourceVersion,
+        Collector, Agent, Project, Entity,
+        CommandResult, CollectorCommandResult, AgentCommandResult,
+        FileCommandResult, InstalledJobCommandResult, JobInstanceCommandResult,
+)
 
 
 @receiver(pre_delete, sender=User)
@@ -44,3 +55,195 @@ def assign_private_project_to_superuser(sender, instance, **kwargs):
 @receiver(post_save, sender=Job)
 def ensure_default_subcommand_exist_on_jobs(sender, instance, **kwargs):
     instance.subcommands.get_or_create(group=None)
+
+
+SUMMARY_FIELDS = {
+        ScenarioInstance: ('start_date', 'stop_date'),
+        OpenbachFunctionInstance: ('status',),
+        JobInstance: ('openbach_function_instance_id', 'status', 'start_date', 'stop_date'),
+}
+# Value of the fields that were deferred when the instance was loaded
+UNKNOWN = object()
+
+
+def summary_fields(instance):
+    return tuple(instance.__dict__.get(field, UNKNOWN) for field in SUMMARY_FIELDS[type(instance)])
+
+
+@receiver(post_init, sender=ScenarioInstance)
+@receiver(post_init, sender=OpenbachFunctionInstance)
+@receiver(post_init, sender=JobInstance)
+def remember_summary_fields(sender, instance, **kwargs):
+    instance._summary_fields = summary_fields(instance)
+
+
+def changed_summary_fields(instance, created):
+    """Return the values of the fields of the instance that matter to
+    summaries, as of their last save, or None if they did not change.
+    """
+    previous = instance._summary_fields
+    current = instance._summary_fields = summary_fields(instance)
+    if created:
+        return tuple(None for _ in current)
+    if previous != current:
+        return previous
+
+
+@receiver(post_save, sender=ScenarioInstance)
+def update_scenario_instance_summary(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+
+    previous = changed_summary_fields(instance, created)
+    if previous is None:
+        return
+
+    old_start, old_stop = previous
+    lineage = instance.lineage
+    if created:
+        # Nothing started in this instance yet, only its own dates matter
+        ScenarioInstanceSummary._refresh(instance, owner_id=lineage[-1])
+        ScenarioInstanceSummary.update(
+                lineage,
+                start_dates=(None, instance.start_date),
+                stop_dates=(None, instance.stop_date))
+    elif UNKNOWN in previous:
+        ScenarioInstanceSummary.refresh(instance)
+    elif old_stop != instance.stop_date:
+        # Once stopped, the summary takes the latest stop date of the whole tree
+        ScenarioInstanceSummary._refresh(instance, owner_id=lineage[-1])
+        summary = ScenarioInstanceSummary.objects.get(scenario_instance=instance)
+        if len(lineage) > 1:
+            ScenarioInstanceSummary.update(
+                    lineage[1:],
+                    start_dates=(old_start, instance.start_date),
+                    stop_dates=(None, summary.stop_date))
+    elif old_start != instance.start_date:
+        ScenarioInstanceSummary.update(lineage, start_dates=(old_start, instance.start_date))
+
+
+@receiver(post_save, sender=OpenbachFunctionInstance)
+def update_summary_on_openbach_function_change(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+
+    previous = changed_summary_fields(instance, created)
+    if previous is None:
+        return
+
+    old_status, = previous
+    if old_status is UNKNOWN:
+        ScenarioInstanceSummary.refresh(instance.scenario_instance)
+        return
+
+    functions = Counter({OpenbachFunctionInstance.Status(instance.status).label: 1})
+    if old_status is not None:
+        functions[OpenbachFunctionInstance.Status(old_status).label] -= 1
+    ScenarioInstanceSummary.update(instance.scenario_instance.lineage, functions=functions)
+
+
+@receiver(post_save, sender=JobInstance)
+def update_summary_on_job_instance_change(sender, instance, created, raw=False, **kwargs):
+    if raw or instance.openbach_function_instance_id is None:
+        return
+
+    previous = changed_summary_fields(instance, created)
+    if previous is None:
+        return
+
+    scenario_instance = instance.openbach_function_instance.scenario_instance
+    function_id, old_status, old_start, old_stop = previous
+    if UNKNOWN in previous or function_id not in (None, instance.openbach_function_instance_id):
+        ScenarioInstanceSummary.refresh(scenario_instance)
+        return
+
+    jobs = Counter({JobInstance.Status(instance.status).label: 1})
+    if function_id is None:
+        # Newly attached to this scenario
+        old_start = old_stop = None
+    else:
+        jobs[JobInstance.Status(old_status).label] -= 1
+    ScenarioInstanceSummary.update(
+            scenario_instance.lineage,
+            jobs=jobs,
+            job_instance_id=instance.id if function_id is None else None,
+            start_dates=(old_start, instance.start_date),
+            stop_dates=(old_stop, instance.stop_date))
+
+
+def scenario_instance_resources(scenario_instance):
+    try:
+        lineage = scenario_instance.lineage
+    except ObjectDoesNotExist:
+        # Owner already deleted along with this instance
+        lineage = [scenario_instance.id]
+    return ['scenario_instance:{}'.format(instance_id) for instance_id in lineage]
+
+
+@receiver([post_save, post_delete], sender=ScenarioInstance)
+def bump_scenario_instance_version(sender, instance, raw=False, **kwargs):
+    if not raw:
+        ResourceVersion.bump(*scenario_instance_resources(instance))
+
+
+@receiver([post_save, post_delete], sender=OpenbachFunctionInstance)
+def bump_version_on_openbach_function_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        with suppress(ObjectDoesNotExist):
+            ResourceVersion.bump(*scenario_instance_resources(instance.scenario_instance))
+
+
+@receiver([post_save, post_delete], sender=JobInstance)
+def bump_version_on_job_instance_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    resources = ['job_instances']
+    with suppress(ObjectDoesNotExist):
+        function = instance.openbach_function_instance
+        if function is not None:
+            resources.extend(scenario_instance_resources(function.scenario_instance))
+    ResourceVersion.bump(*resources)
+
+
+@receiver([post_save, post_delete], sender=Agent)
+@receiver([post_save, post_delete], sender=Collector)
+@receiver([post_save, post_delete], sender=Entity)
+def bump_agents_version(sender, instance, raw=False, **kwargs):
+    if not raw:
+        ResourceVersion.bump('agents')
+
+
+@receiver([post_save, post_delete], sender=Job)
+def bump_jobs_version(sender, instance, raw=False, **kwargs):
+    if not raw:
+        ResourceVersion.bump('jobs')
+
+
+@receiver(m2m_changed, sender=Job.keywords.through)
+def bump_jobs_version_on_keywords_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        ResourceVersion.bump('jobs')
+
+
+@receiver([post_save, post_delete], sender=Project)
+def bump_projects_version(sender, instance, raw=False, **kwargs):
+    if not raw:
+        ResourceVersion.bump('agents', 'projects')
+
+
+@receiver(m2m_changed, sender=Project.owners.through)
+def bump_projects_version_on_owners_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        ResourceVersion.bump('agents', 'projects')
+
+
+@receiver([post_save, post_delete], sender=CommandResult)
+@receiver([post_save, post_delete], sender=CollectorCommandResult)
+@receiver([post_save, post_delete], sender=AgentCommandResult)
+@receiver([post_save, post_delete], sender=FileCommandResult)
+@receiver([post_save, post_delete], sender=InstalledJobCommandResult)
+@receiver([post_save, post_delete], sender=JobInstanceCommandResult)
+def bump_command_results_version(sender, instance, raw=False, **kwargs):
+    if not raw:
+        ResourceVersion.bump('command_results')
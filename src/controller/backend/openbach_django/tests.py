@@ -23,15 +23,52 @@
 # You should have received a copy of the GNU General Public License along with
 # this program. If not, see http://www.gnu.org/licenses/.
 
-from django.test import TestCase
+import os
+import re
+import grp
+import pwd
+import sys
+import json
+import time
+import random
+import hashlib
+import string
+import tempfile
+import timeit
+import threading
+import subprocess
+import tracemalloc
+import importlib.util
+from io import StringIO
+from pathlib import Path
+from datetime import timedelta
+from unittest import mock, skipIf
+from collections import Counter
+
+from django.db import connection
+from django.db.utils import OperationalError
+from django.db.backends.sqlite3 import base as sqlite3_base
+from django.core.exceptions import ValidationError
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from .models import (
-        Collector, Agent, Project, Job,
+        Collector, Agent, Project, Job, Keyword,
         InstalledJob, RequiredJobArgument,
         OptionalJobArgument, JobInstance,
+        Scenario, ScenarioVersion, ScenarioInstance, ScenarioInstanceSummary,
+        ScenarioArgument, ScenarioConstant, ScenarioArgumentValue,
+        StartJobInstance, StartScenarioInstance,
+        OpenbachFunction, OpenbachFunctionInstance,
+        AgentCommandResult, CommandResult, ResourceVersion,
 )
-from .base_models import ValuesType, OpenbachFunctionParameter
+from .base_models import ValuesType, OpenbachFunctionParameter, compile_template
+from .serializers import ScenarioInstancesSerializer
+from . import connections, notifications, file_store
 
 
 class ProjectCheckerMixin:
@@ -145,6 +182,59 @@ class OpenbachFunctionArgumentTestCase(TestCase):
             self._check_interpolation(field, '$test', True, test=3)
 
 
+class CompiledTemplateTestCase(TestCase):
+    TEMPLATES = {
+            str: ('$host:${port}/$$path', {'host': 'localhost', 'port': 80}),
+            int: ('${count}', {'count': 7}),
+            float: ('$delay', {'delay': 0.5}),
+            bool: ('$flag', {'flag': 'True'}),
+            list: ('$first ${second} last', {'first': 'a b', 'second': 'c'}),
+            dict: ('{"key": "$value", "$$": 1}', {'value': 'v'}),
+    }
+
+    def _reference_substitution(self, field, value, parameters):
+        templated = string.Template(field.get_prep_value(value))
+        return field._convert_from_db_value(templated.substitute(parameters))
+
+    def test_substitution_equivalence(self):
+        checked = set()
+        for function_type in OpenbachFunction.__subclasses__():
+            for field in function_type._meta.get_fields():
+                if not isinstance(field, OpenbachFunctionParameter):
+                    continue
+                if isinstance(field.type, list):
+                    template, parameters = '1 $id 3', {'id': 2}
+                else:
+                    template, parameters = self.TEMPLATES[field.type]
+                with self.subTest(function=function_type.__name__, field=field.name):
+                    value = field.from_db_value(template)
+                    self.assertEqual(
+                            field.validate_openbach_value(value, parameters),
+                            self._reference_substitution(field, value, parameters))
+                    if field.has_placeholders(field.get_prep_value(value)):
+                        # Booleans swallow placeholders when loaded
+                        with self.assertRaises(ValidationError) as cm:
+                            field.validate_openbach_value(value, {})
+                        self.assertEqual(cm.exception.code, 'invalid_placeholder')
+                checked.add(function_type)
+        self.assertGreater(len(checked), 15)
+
+    def test_placeholders(self):
+        self.assertEqual(list(OpenbachFunctionParameter.placeholders('$a ${b} $$c $a')), ['a', 'b', 'a'])
+        self.assertFalse(OpenbachFunctionParameter.has_placeholders('$$escaped'))
+        with self.assertRaises(ValidationError) as cm:
+            list(OpenbachFunctionParameter.placeholders('$a $'))
+        self.assertEqual(cm.exception.code, 'invalid_template')
+        self.assertEqual(compile_template('$a $$ ${b}').substitute({'a': 1, 'b': None}), '1 $ None')
+        self.assertIs(compile_template('$a'), compile_template('$a'))
+
+    def test_shared_checkers(self):
+        checker = OpenbachFunctionParameter.from_type(ValuesType.JOB_INSTANCE_ID.value)
+        self.assertIs(checker, OpenbachFunctionParameter.from_type(ValuesType.JOB_INSTANCE_ID.value))
+        self.assertEqual(checker.validate_openbach_value('1 $id', {'id': 2}), [1, 2])
+        self.assertEqual(checker.type, [int])
+
+
 class JobTestCase(TestCase):
     def setUp(self):
         Job.objects.create(name='test_job')
@@ -596,3 +686,1491 @@ class ProjectTestCase(ProjectCheckerMixin, TestCase):
         project = Project.objects.create(name=name, description=description)
         project.load_from_json(self.project_json)
         self.assertProjectCompliant(self.project_json, project.json)
+
+
+class ScenarioTreeMixin:
+    def setUp(self):
+        job = Job.objects.create(name='test_job')
+        collector = Collector.objects.create(address='172.20.34.45')
+        self.agent = Agent.objects.create(
+                address='172.20.34.45', name='Openbach_Agent',
+                reachable=True, collector=collector)
+        RequiredJobArgument.objects.create(
+                name='first', type='int',
+                subcommand=job.subcommands.get(name=None),
+                count='1', rank=0)
+        OptionalJobArgument.objects.create(
+                name='optional', type='ip',
+                subcommand=job.subcommands.get(name=None),
+                count='*', flag='-o')
+
+        self.project = Project.objects.create(name='Serialization')
+        # Each scenario starts a job and the next scenario
+        # in the list, building a tree of depth 4
+        self.scenarios = []
+        for depth in range(4):
+            scenario = Scenario.objects.create(name='depth {}'.format(depth), project=self.project)
+            version = ScenarioVersion.objects.create(scenario=scenario)
+            ScenarioConstant.objects.create(name='constant', value=str(depth), scenario_version=version)
+            ScenarioArgument.objects.create(name='argument', scenario_version=version)
+            StartJobInstance.objects.create(
+                    function_id=1, label='job', scenario_version=version,
+                    wait_time=0, entity_name='entity', job_name='test_job')
+            if depth:
+                StartScenarioInstance.objects.create(
+                        function_id=2, label='sub-scenario',
+                        scenario_version=self.scenarios[-1].last_version,
+                        wait_time=0, scenario_name=scenario.name, arguments={})
+            self.scenarios.append(scenario)
+
+    def _start_scenario_instance(self, depth=0, owner=None):
+        scenario = self.scenarios[depth]
+        instance = ScenarioInstance.objects.create(
+                scenario_version=scenario.last_version,
+                status=ScenarioInstance.Status.RUNNING,
+                start_date=timezone.now(),
+                openbach_function_instance=owner)
+        ScenarioArgumentValue.objects.create(
+                argument=scenario.arguments.get(),
+                scenario_instance=instance,
+                value='instance {}'.format(depth))
+
+        for openbach_function in scenario.openbach_functions.all():
+            function = OpenbachFunctionInstance.objects.create(
+                    openbach_function=openbach_function,
+                    scenario_instance=instance,
+                    status=OpenbachFunctionInstance.Status.FINISHED,
+                    launch_date=timezone.now())
+            if isinstance(openbach_function.get_content_model(), StartScenarioInstance):
+                self._start_scenario_instance(depth + 1, function)
+            else:
+                job_instance = JobInstance.objects.create(
+                        job_name='test_job',
+                        agent_name=self.agent.name,
+                        entity_name='entity',
+                        agent=self.agent,
+                        collector=self.agent.collector,
+                        update_status=timezone.now(),
+                        start_date=timezone.now(),
+                        periodic=False,
+                        openbach_function_instance=function)
+                job_instance.configure({'first': depth, 'optional': ['127.0.0.1', '8.8.8.8']})
+                job_instance.save()
+        return instance
+
+
+class ScenarioInstancesSerializerTestCase(ScenarioTreeMixin, TestCase):
+    def _page(self, size):
+        instances = ScenarioInstance.objects.filter(
+                scenario_version__scenario__project=self.project,
+                openbach_function_instance__isnull=True)
+        return instances.order_by('-id')[:size]
+
+    def test_same_as_models(self):
+        for _ in range(3):
+            self._start_scenario_instance()
+        # Include sub-scenarios so their owners are resolved too
+        page = ScenarioInstance.objects.order_by('-id')
+
+        serializer = ScenarioInstancesSerializer(page)
+        self.assertEqual(serializer.json(), [instance.json for instance in page])
+        self.assertEqual(serializer.limited_json(), [instance.limited_json for instance in page])
+
+    def test_constant_queries_count(self):
+        for _ in range(8):
+            self._start_scenario_instance()
+
+        with CaptureQueriesContext(connection) as small_page:
+            ScenarioInstancesSerializer(self._page(2)).json()
+
+        with self.assertNumQueries(len(small_page)):
+            ScenarioInstancesSerializer(self._page(8)).json()
+
+    def test_constant_queries_count_limited(self):
+        for _ in range(8):
+            self._start_scenario_instance()
+
+        for size in (2, 8):
+            with self.assertNumQueries(2):
+                ScenarioInstancesSerializer(self._page(size)).limited_json()
+
+
+class ScenarioInstanceSummaryTestCase(ScenarioTreeMixin, TestCase):
+    def _recursive_summary(self, scenario_instance):
+        functions = Counter()
+        jobs = Counter()
+        job_instances = []
+        start_dates = [scenario_instance.start_date]
+        stop_dates = [scenario_instance.stop_date]
+        for function in scenario_instance.openbach_functions_instances.all():
+            functions[function.get_status().label] += 1
+            try:
+                job_instance = function.started_job
+            except JobInstance.DoesNotExist:
+                pass
+            else:
+                jobs[job_instance.get_status().label] += 1
+                job_instances.append(job_instance.id)
+                start_dates.append(job_instance.start_date)
+                stop_dates.append(job_instance.stop_date)
+            try:
+                sub_scenario = function.started_scenario
+            except ScenarioInstance.DoesNotExist:
+                pass
+            else:
+                summary = self._recursive_summary(sub_scenario)
+                functions.update(summary['openbach_functions'])
+                jobs.update(summary['job_instances'])
+                job_instances.extend(summary['job_instance_ids'])
+                start_dates.append(summary['start_date'])
+                stop_dates.append(summary['stop_date'])
+
+        owner = scenario_instance
+        while owner.openbach_function_instance is not None:
+            owner = owner.openbach_function_instance.scenario_instance
+
+        stop_dates = [date for date in stop_dates if date is not None]
+        return {
+                'owner_scenario_instance_id': owner.id,
+                'start_date': min(date for date in start_dates if date is not None),
+                'stop_date': max(stop_dates) if scenario_instance.is_stopped else None,
+                'openbach_functions': dict(functions),
+                'job_instances': dict(jobs),
+                'job_instance_ids': sorted(job_instances),
+        }
+
+    def assertSummariesConsistent(self):
+        instances = ScenarioInstance.objects.all()
+        self.assertEqual(ScenarioInstanceSummary.objects.count(), instances.count())
+        for instance in instances:
+            summary = ScenarioInstanceSummary.objects.get(scenario_instance=instance)
+            self.assertEqual(summary.json, self._recursive_summary(instance))
+
+    def test_summaries_follow_creation(self):
+        for _ in range(2):
+            self._start_scenario_instance()
+        self.assertSummariesConsistent()
+        root = ScenarioInstance.objects.filter(openbach_function_instance__isnull=True).first()
+        self.assertEqual(len(root.summary.job_instances), len(self.scenarios))
+        self.assertEqual(root.summary.json['openbach_functions'], {'Finished': 2 * len(self.scenarios) - 1})
+
+    def test_summaries_follow_status_changes(self):
+        root = self._start_scenario_instance()
+        job_instance = JobInstance.objects.order_by('-id').first()
+        job_instance.set_status(JobInstance.Status.RUNNING)
+        job_instance.openbach_function_instance.set_status(OpenbachFunctionInstance.Status.RUNNING)
+        self.assertSummariesConsistent()
+        self.assertEqual(ScenarioInstanceSummary.objects.get(scenario_instance=root).json['job_instances']['Running'], 1)
+
+        job_instance.set_status(JobInstance.Status.STOPPED)
+        for instance in ScenarioInstance.objects.order_by('-id'):
+            instance.stop(stop_status=ScenarioInstance.Status.FINISHED_OK)
+        self.assertSummariesConsistent()
+        self.assertIsNotNone(ScenarioInstanceSummary.objects.get(scenario_instance=root).stop_date)
+
+    def test_summaries_follow_date_changes(self):
+        root = self._start_scenario_instance()
+        job_instance = JobInstance.objects.order_by('-id').first()
+        job_instance.start_date = root.start_date - timedelta(hours=1)
+        job_instance.save()
+        self.assertSummariesConsistent()
+        self.assertEqual(ScenarioInstanceSummary.objects.get(scenario_instance=root).start_date, job_instance.start_date)
+
+        # Removing the earliest date requires recomputing the summaries
+        job_instance.start_date = timezone.now()
+        job_instance.save()
+        self.assertSummariesConsistent()
+
+        for instance in ScenarioInstance.objects.order_by('-id'):
+            instance.stop(stop_status=ScenarioInstance.Status.FINISHED_OK)
+        job_instance.set_status(JobInstance.Status.STOPPED)
+        self.assertSummariesConsistent()
+        job_instance.set_status(JobInstance.Status.RUNNING)
+        self.assertSummariesConsistent()
+
+    def _summary_queries(self, function):
+        with CaptureQueriesContext(connection) as queries:
+            function()
+        return [query for query in queries if 'scenarioinstancesummary' in query['sql']]
+
+    def test_unchanged_saves_skip_summaries(self):
+        root = self._start_scenario_instance()
+        job_instance = JobInstance.objects.order_by('-id').first()
+        self.assertEqual(self._summary_queries(job_instance.save), [])
+        self.assertEqual(self._summary_queries(job_instance.openbach_function_instance.save), [])
+        self.assertEqual(self._summary_queries(root.save), [])
+
+        job_instance.update_status = timezone.now()
+        self.assertEqual(self._summary_queries(job_instance.save), [])
+        self.assertNotEqual(self._summary_queries(lambda: job_instance.set_status(JobInstance.Status.RUNNING)), [])
+
+    def test_updates_do_not_scan_the_tree(self):
+        root = self._start_scenario_instance()
+        job_instance = JobInstance.objects.order_by('-id').first()
+        small_tree = self._summary_queries(lambda: job_instance.set_status(JobInstance.Status.RUNNING))
+
+        start_job = root.openbach_functions_instances.first().openbach_function
+        for _ in range(20):
+            OpenbachFunctionInstance.objects.create(
+                    openbach_function=start_job, scenario_instance=root,
+                    status=OpenbachFunctionInstance.Status.FINISHED,
+                    launch_date=timezone.now())
+        large_tree = self._summary_queries(lambda: job_instance.set_status(JobInstance.Status.STOPPED))
+        self.assertEqual(len(large_tree), len(small_tree))
+        self.assertSummariesConsistent()
+
+    def test_backfill(self):
+        for _ in range(3):
+            self._start_scenario_instance()
+        ScenarioInstanceSummary.objects.all().delete()
+
+        call_command('backfill_scenario_summaries', stdout=StringIO())
+        self.assertSummariesConsistent()
+
+
+class PooledSQLiteDatabaseWrapper(connections.PooledDatabaseWrapperMixin, sqlite3_base.DatabaseWrapper):
+    pass
+
+
+class ConnectionPoolTestCase(TestCase):
+    POOL_SIZE = 8
+    CONCURRENT_ACTIONS = 500
+
+    def setUp(self):
+        self.alias = 'pooled_{}'.format(self.id())
+        self.database = tempfile.NamedTemporaryFile(suffix='.sqlite3')
+        self.settings_dict = dict(
+                connection.settings_dict, NAME=self.database.name,
+                POOL={'SIZE': self.POOL_SIZE, 'TIMEOUT': 30})
+
+    def tearDown(self):
+        pool = connections._POOLS.pop(self.alias, None)
+        if pool is not None:
+            pool.close()
+        self.database.close()
+
+    def _run_concurrently(self, action):
+        failures = []
+        start = threading.Barrier(self.CONCURRENT_ACTIONS)
+
+        def run():
+            start.wait()
+            try:
+                action()
+            except Exception as e:
+                failures.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(self.CONCURRENT_ACTIONS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(failures, [])
+
+    def test_concurrent_acquisitions_stay_within_pool_size(self):
+        pool = connections.ConnectionPool(self.POOL_SIZE, timeout=30)
+        connect = mock.Mock(side_effect=lambda: mock.Mock(name='psycopg2.connection'))
+
+        def action():
+            raw_connection = pool.acquire(connect)
+            try:
+                raw_connection.cursor().execute('SELECT 1')
+                time.sleep(0.001)
+            finally:
+                pool.release(raw_connection)
+
+        self._run_concurrently(action)
+        statistics = pool.statistics()
+        self.assertLessEqual(connect.call_count, self.POOL_SIZE)
+        self.assertLessEqual(statistics['peak'], self.POOL_SIZE)
+        self.assertEqual(statistics['in_use'], 0)
+        self.assertEqual(statistics['waiting'], 0)
+        self.assertEqual(statistics['opened'], statistics['idle'])
+
+    def test_concurrent_database_wrappers_share_the_pool(self):
+        connected = []
+
+        def action():
+            wrapper = PooledSQLiteDatabaseWrapper(self.settings_dict, self.alias)
+            try:
+                with wrapper.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                    self.assertEqual(cursor.fetchone(), (1,))
+                connected.append(id(wrapper.connection))
+            finally:
+                wrapper.close()
+
+        with mock.patch.object(
+                sqlite3_base.DatabaseWrapper, 'get_new_connection',
+                autospec=True, side_effect=sqlite3_base.DatabaseWrapper.get_new_connection) as connect:
+            self._run_concurrently(action)
+
+        statistics = connections.statistics()[self.alias]
+        self.assertEqual(len(connected), self.CONCURRENT_ACTIONS)
+        self.assertLessEqual(len(set(connected)), self.POOL_SIZE)
+        self.assertLessEqual(connect.call_count, self.POOL_SIZE)
+        self.assertLessEqual(statistics['peak'], self.POOL_SIZE)
+        self.assertEqual(statistics['in_use'], 0)
+
+    def test_exhausted_pool_times_out(self):
+        pool = connections.ConnectionPool(1, timeout=0.05)
+        raw_connection = pool.acquire(mock.Mock)
+        with self.assertRaises(OperationalError):
+            pool.acquire(mock.Mock)
+        self.assertEqual(pool.statistics()['waiting'], 0)
+
+        pool.release(raw_connection)
+        self.assertIs(pool.acquire(mock.Mock), raw_connection)
+
+    def test_unhealthy_connections_are_replaced(self):
+        pool = connections.ConnectionPool(1, check_interval=0, check=lambda raw_connection: False)
+        stale = pool.acquire(mock.Mock)
+        pool.release(stale)
+        time.sleep(0.001)
+
+        fresh = pool.acquire(mock.Mock)
+        self.assertIsNot(fresh, stale)
+        stale.close.assert_called_once_with()
+        self.assertEqual(pool.statistics()['opened'], 1)
+
+    def test_broken_connections_are_not_reused(self):
+        pool = connections.ConnectionPool(1)
+        broken = pool.acquire(mock.Mock)
+        pool.release(broken, reusable=False)
+        broken.close.assert_called_once_with()
+        self.assertEqual(pool.statistics()['opened'], 0)
+        self.assertIsNot(pool.acquire(mock.Mock), broken)
+
+    def test_database_boundary_releases_connections(self):
+        with mock.patch.object(connections, 'close_old_connections') as close_old_connections, \
+                mock.patch.object(connections, 'release_connections') as release_connections:
+            @connections.database_boundary
+            def failing_action():
+                close_old_connections.assert_called_once_with()
+                release_connections.assert_not_called()
+                raise ValueError
+
+            with self.assertRaises(ValueError):
+                failing_action()
+        release_connections.assert_called_once_with()
+
+
+class ConditionalRequestsTestCase(ScenarioTreeMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.client.force_login(User.objects.create(username='reader'))
+        self.root = self._start_scenario_instance()
+        self.url = '/scenario_instance/{}/'.format(self.root.id)
+        patcher = mock.patch(
+                'openbach_django.views.send_fifo',
+                return_value=json.dumps({'response': {'conductor': 'reply'}, 'returncode': 200}))
+        self.conductor = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unchanged_resources_do_not_reach_the_conductor(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        etag = response['ETag']
+
+        for _ in range(10):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.conductor.call_count, 1)
+
+        # Changes deep inside the tree invalidate the root
+        deepest = ScenarioInstance.objects.order_by('-id').first()
+        JobInstance.objects.filter(openbach_function_instance__scenario_instance=deepest).get().set_status(JobInstance.Status.RUNNING)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.conductor.call_count, 2)
+
+    def test_last_modified(self):
+        response = self.client.get(self.url)
+        last_modified = response['Last-Modified']
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.conductor.call_count, 1)
+
+        ResourceVersion.objects.filter(name='scenario_instance:{}'.format(self.root.id)).update(
+                modified=timezone.now() + timedelta(seconds=2))
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+
+    def test_representations_have_their_own_tag(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url + '?quiet', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_live_queries_always_reach_the_conductor(self):
+        for url in ('/agent/?update', '/job_instance/?update', self.url + '?files_count'):
+            response = self.client.get(url)
+            self.assertNotIn('ETag', response)
+            self.client.get(url, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(self.conductor.call_count, 6)
+
+    def test_jobs_follow_keywords_changes(self):
+        job = Job.objects.create(name='fping')
+        etag = self.client.get('/job/?string_to_search=ping')['ETag']
+        response = self.client.get('/job/?string_to_search=ping', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        job.keywords.add(Keyword.objects.create(name='latency'))
+        response = self.client.get('/job/?string_to_search=ping', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', self.client.get('/job/?external'))
+
+    def test_errors_are_not_tagged(self):
+        self.conductor.return_value = json.dumps({'response': {'error': 'not found'}, 'returncode': 404})
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('ETag', response)
+
+    def test_states_follow_command_results(self):
+        url = '/agent/{}/state/'.format(self.agent.address)
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        AgentCommandResult.objects.create(address=self.agent.address)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_agents_follow_projects_ownership(self):
+        etag = self.client.get('/agent/')['ETag']
+        self.assertEqual(self.client.get('/agent/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.project.owners.add(User.objects.create(username='owner'))
+        self.assertEqual(self.client.get('/agent/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_anonymous_requests_always_reach_the_conductor(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.logout()
+        for _ in range(3):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('ETag', response)
+            self.assertNotIn('Last-Modified', response)
+        self.assertEqual(self.conductor.call_count, 4)
+
+
+class ChangesNotificationsTestCase(TransactionTestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        settings = override_settings(NOTIFICATIONS_FOLDER=folder.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(self._close_listener)
+
+        self.address = '172.20.34.45'
+        self.url = '/agent/{}/state/'.format(self.address)
+        self.state = AgentCommandResult.objects.create(address=self.address)
+        self.client = Client()
+        self.client.force_login(User.objects.create(username='reader'))
+        patcher = mock.patch('openbach_django.views.send_fifo', side_effect=self._conductor)
+        self.conductor = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def _close_listener():
+        if notifications._LISTENER is not None:
+            notifications._LISTENER.close()
+            notifications._LISTENER = None
+
+    def _conductor(self, command):
+        state = AgentCommandResult.objects.get(address=command['address'])
+        return json.dumps({'response': state.json, 'returncode': 200}, default=str)
+
+    def _long_running_action(self, duration):
+        """Mimic a ThreadedAction of the conductor"""
+        changes = []
+
+        def action():
+            status = CommandResult.objects.create()
+            self.state.status_install = status
+            self.state.save()
+            time.sleep(duration)
+            changes.append(time.monotonic())
+            status.update(None, 204)
+            connections.release_connections()
+
+        thread = threading.Thread(target=action)
+        thread.start()
+        self.addCleanup(thread.join)
+        return changes
+
+    def test_long_poll_answers_as_soon_as_the_state_changes(self):
+        etag = self.client.get(self.url)['ETag']
+        changes = self._long_running_action(0.5)
+
+        while True:
+            response = self.client.get(self.url + '?wait=10', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            install = response.json()['install']
+            if install is not None and install['returncode'] != 202:
+                break
+            etag = response['ETag']
+        answered = time.monotonic()
+
+        self.assertEqual(install['returncode'], 204)
+        self.assertLess(answered - changes[0], 0.1)
+        # Initial request then at most one per change made by the action
+        self.assertLessEqual(self.conductor.call_count, 4)
+
+    def test_long_poll_times_out_on_unchanged_resources(self):
+        etag = self.client.get(self.url)['ETag']
+        start = time.monotonic()
+        response = self.client.get(self.url + '?wait=0.3', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+        self.assertEqual(self.conductor.call_count, 1)
+
+    def test_invalid_wait(self):
+        response = self.client.get(self.url + '?wait=soon')
+        self.assertEqual(response.status_code, 400)
+
+    def test_server_sent_events(self):
+        response = self.client.get(self.url + '?events')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = iter(response.streaming_content)
+
+        first = next(events).decode()
+        self.assertIn('event: change', first)
+        changes = self._long_running_action(0.3)
+
+        for event in map(bytes.decode, events):
+            if event.startswith(':'):
+                continue
+            install = json.loads(event.split('data: ')[1])['install']
+            if install is not None and install['returncode'] != 202:
+                answered = time.monotonic()
+                break
+        response.close()
+
+        self.assertEqual(install['returncode'], 204)
+        self.assertLess(answered - changes[0], 0.1)
+
+    def test_server_sent_events_resume(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url + '?events', HTTP_LAST_EVENT_ID=etag)
+        events = iter(response.streaming_content)
+        self._long_running_action(0)
+
+        event = next(events).decode()
+        self.assertNotIn(etag, event)
+        response.close()
+        self.assertEqual(self.conductor.call_count, 2)
+
+    def test_idle_requests_are_limited(self):
+        etag = self.client.get(self.url)['ETag']
+        idle_requests = threading.BoundedSemaphore(1)
+        with mock.patch('openbach_django.views.IDLE_REQUESTS', idle_requests):
+            response = self.client.get(self.url + '?events')
+            next(iter(response.streaming_content))
+
+            self.assertEqual(self.client.get(self.url + '?events').status_code, 503)
+            start = time.monotonic()
+            waited = self.client.get(self.url + '?wait=10', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(waited.status_code, 304)
+            self.assertLess(time.monotonic() - start, 1)
+
+            # Closing the stream frees its slot
+            response.close()
+            self.assertTrue(idle_requests.acquire(blocking=False))
+
+
+class PushFileTestCase(TestCase):
+    def setUp(self):
+        store = tempfile.TemporaryDirectory()
+        self.addCleanup(store.cleanup)
+        settings = override_settings(FILE_STORE_FOLDER=store.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.store = Path(store.name)
+
+        files = tempfile.TemporaryDirectory()
+        self.addCleanup(files.cleanup)
+        self.files = Path(files.name)
+        patcher = mock.patch('openbach_django.views.build_storage_path', side_effect=self.files.joinpath)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch(
+                'openbach_django.views.send_fifo',
+                return_value=json.dumps({'response': None, 'returncode': 204}))
+        self.conductor = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.client = Client()
+        # Large enough not to be kept in memory by the default upload handlers
+        self.content = bytes(range(256)) * 64 * 1024
+        self.digest = hashlib.sha256(self.content).hexdigest()
+
+    def _upload(self, content=None, **data):
+        upload = SimpleUploadedFile('payload.bin', self.content if content is None else content)
+        written = []
+        write = file_store.HashedUploadedFile.write
+
+        def counting_write(uploaded_file, chunk):
+            written.append(len(chunk))
+            return write(uploaded_file, chunk)
+
+        with mock.patch.object(file_store.HashedUploadedFile, 'write', counting_write):
+            response = self.client.post('/file/', {'file': upload, **data})
+        return response, sum(written)
+
+    def _blobs(self):
+        return [path for path in self.store.glob('*/*') if path.parent.name != 'staging']
+
+    def test_push_to_several_agents(self):
+        response, written = self._upload(
+                path=['first/payload', 'second/payload'],
+                keep_file='', agent_ip=['172.20.34.45', '172.20.34.46'])
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(written, len(self.content))
+
+        (command,), _ = self.conductor.call_args
+        self.assertEqual(self.conductor.call_count, 1)
+        self.assertEqual(command['command'], 'push_file')
+        self.assertEqual(command['address'], ['172.20.34.45', '172.20.34.46'])
+        self.assertEqual(command['checksums'], [self.digest, self.digest])
+        blob, = self._blobs()
+        self.assertEqual(command['local_path'], [str(blob), str(blob)])
+        self.assertEqual(blob.name, self.digest)
+        self.assertEqual(blob.read_bytes(), self.content)
+        self.assertEqual(list(self.store.glob('staging/*')), [])
+
+    def test_same_content_is_stored_once(self):
+        for address in ('172.20.34.45', '172.20.34.46'):
+            response, _ = self._upload(path='payload', keep_file='', agent_ip=address)
+            self.assertEqual(response.status_code, 204)
+        self.assertEqual(len(self._blobs()), 1)
+
+        self._upload(b'other content', path='payload', keep_file='', agent_ip=address)
+        self.assertEqual(len(self._blobs()), 2)
+
+    def test_kept_files_are_copies_of_the_blobs(self):
+        response, written = self._upload(path='kept/payload', keep_file='True')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(written, len(self.content))
+        self.conductor.assert_not_called()
+
+        blob, = self._blobs()
+        kept = self.files / 'kept' / 'payload'
+        self.assertFalse(os.path.samefile(str(blob), str(kept)))
+        self.assertEqual(kept.read_bytes(), self.content)
+
+        # Rewriting the kept file in place leaves the blob untouched
+        with kept.open('r+b') as f:
+            f.write(b'rewritten')
+        self.assertEqual(blob.read_bytes(), self.content)
+
+        # And so does keeping another content at the same path
+        self._upload(b'other content', path='kept/payload', keep_file='True')
+        self.assertEqual(kept.read_bytes(), b'other content')
+        self.assertEqual(blob.read_bytes(), self.content)
+
+
+class AddJobsTestCase(TestCase):
+    def setUp(self):
+        patcher = mock.patch(
+                'openbach_django.views.send_fifo',
+                return_value=json.dumps({'response': {'added': ['fping'], 'unchanged': ['iperf3']}, 'returncode': 200}))
+        self.conductor = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = Client()
+
+    def test_jobs_are_sent_at_once(self):
+        jobs = [
+                {'name': 'fping', 'path': '/opt/openbach/controller/src/jobs/fping'},
+                {'name': 'iperf3', 'path': '/opt/openbach/controller/src/jobs/iperf3'},
+        ]
+        response = self.client.post('/job/', {'jobs': jobs}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'added': ['fping'], 'unchanged': ['iperf3']})
+
+        (command,), _ = self.conductor.call_args
+        self.assertEqual(self.conductor.call_count, 1)
+        self.assertEqual(command['command'], 'add_jobs')
+        self.assertEqual(command['jobs'], jobs)
+
+    def test_single_job(self):
+        response = self.client.post('/job/', {'name': 'fping', 'path': '/opt/fping'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        (command,), _ = self.conductor.call_args
+        self.assertEqual(command['command'], 'add_job')
+
+
+class LiveStatisticsAccessTestCase(TestCase):
+    def test_access_is_checked_by_the_conductor(self):
+        with mock.patch(
+                'openbach_django.views.send_fifo',
+                return_value=json.dumps({'response': None, 'returncode': 204})) as conductor:
+            response = Client().get('/statistic/42/?live')
+        self.assertEqual(response.status_code, 204)
+        (command,), _ = conductor.call_args
+        self.assertEqual(command['command'], 'statistics_access')
+        self.assertEqual(command['instance_id'], 42)
+
+
+class JobsSearchTestCase(TestCase):
+    def test_malformed_ratio(self):
+        with mock.patch('openbach_django.views.send_fifo') as conductor:
+            for query in ('?string_to_search=ping&ratio=high', '?external&ratio=high'):
+                with self.subTest(query=query):
+                    response = Client().get('/job/' + query)
+                    self.assertEqual(response.status_code, 400)
+        conductor.assert_not_called()
+
+
+def load_conductor_module(name):
+    controller = Path(__file__).resolve().parents[2]
+    for conductor in ('openbach-conductor', 'conductor'):
+        path = controller / conductor / 'lib' / '{}.py'.format(name)
+        if path.exists():
+            spec = importlib.util.spec_from_file_location(name, str(path))
+            module = importlib.util.module_from_spec(spec)
+            try:
+                spec.loader.exec_module(module)
+            except ImportError:
+                return None
+            return module
+
+
+statistics_query = load_conductor_module('statistics_query')
+
+
+class FakeInfluxDBConnection:
+    """Answer the statements of StatisticsQuery out of
+    a single series of points and of its rollups.
+    """
+
+    STATEMENT = re.compile(r'SELECT (?:(\w+)\()?"([^"]+)"\)? FROM (\S+) WHERE (.*)$')
+
+    def __init__(self, points, rollups=False):
+        self.points = points
+        self.rollups = {}
+        if rollups:
+            for resolution, duration in statistics_query.ROLLUPS:
+                buckets = {}
+                for timestamp, value in points:
+                    buckets.setdefault(timestamp - timestamp % duration, []).append(value)
+                self.rollups[resolution] = {
+                        'mean_value': [(t, sum(v) / len(v)) for t, v in sorted(buckets.items())],
+                        'count_value': [(t, len(v)) for t, v in sorted(buckets.items())],
+                }
+
+    def _execute(self, statement):
+        function, field, measurement, condition = self.STATEMENT.match(statement).groups()
+        if statistics_query.ROLLUP_RETENTION_POLICY in measurement:
+            resolution = measurement.rsplit('.', 1)[-1].strip('"')
+            points = self.rollups.get(resolution, {}).get(field, [])
+        else:
+            points = self.points
+
+        period = re.search(r'time >= (\d+)ms AND time <= (\d+)ms', condition)
+        if period is not None:
+            first, last = map(int, period.groups())
+            points = [(t, v) for t, v in points if first <= t <= last]
+        if not points:
+            return {}
+
+        group = re.search(r'GROUP BY time\((\d+)ms, (\d+)ms\)', condition)
+        if group is not None:
+            interval, offset = map(int, group.groups())
+            buckets = {}
+            for timestamp, value in points:
+                bucket = (timestamp - offset) // interval * interval + offset
+                buckets.setdefault(bucket, []).append(value)
+            values = [[t, sum(v) / len(v)] for t, v in sorted(buckets.items())]
+        elif function == 'COUNT':
+            values = [[0, len(points)]]
+        elif function == 'SUM':
+            values = [[0, sum(v for _, v in points)]]
+        elif function == 'FIRST':
+            values = [list(points[0])]
+        elif function == 'LAST':
+            values = [list(points[-1])]
+        else:
+            values = [list(point) for point in points]
+        return {'series': [{'columns': ['time', field], 'values': values}]}
+
+    def sql_query(self, query):
+        return {'results': [self._execute(statement) for statement in query.split('; ')]}
+
+
+@skipIf(statistics_query is None, 'the conductor is not available')
+class StatisticsQueryTestCase(TestCase):
+    def setUp(self):
+        # Ten minutes of points every 100ms, not aligned on any rollup
+        self.start = 1600000012345
+        self.points = [(self.start + 100 * i, i % 60) for i in range(6000)]
+        # Full resolution series of data_access start at their first point
+        self.full_resolution = [t - self.start for t, _ in self.points]
+
+    def _values(self, max_points, **kwargs):
+        connection = FakeInfluxDBConnection(self.points, rollups='database' in kwargs)
+        query = statistics_query.StatisticsQuery(connection, 'ms', 'job', 42, **kwargs)
+        return query.values('value', max_points)
+
+    def assertSameReference(self, times):
+        self.assertLessEqual(len(times), 50)
+        self.assertEqual(times, sorted(times))
+        self.assertGreaterEqual(times[-1], self.full_resolution[-1] - 60000)
+        self.assertLessEqual(times[-1], self.full_resolution[-1])
+
+    def test_raw_series_starts_at_its_first_point(self):
+        statistics = self._values(10000)
+        self.assertEqual(statistics['time'], self.full_resolution)
+
+    def test_downsampled_series_starts_at_its_first_point(self):
+        times = self._values(50)['time']
+        self.assertEqual(times[0], self.full_resolution[0])
+        self.assertSameReference(times)
+
+    def test_rolled_up_series_starts_at_its_first_point(self):
+        times = self._values(50, database='openbach')['time']
+        self.assertEqual(times[0], self.full_resolution[0])
+        self.assertSameReference(times)
+
+
+job_index = load_conductor_module('job_index')
+try:
+    from fuzzywuzzy import fuzz
+except ImportError:
+    fuzz = None
+else:
+    # Scores of fuzzywuzzy differ when it falls back on difflib
+    if fuzz.SequenceMatcher.__module__ == 'difflib':
+        fuzz = None
+
+
+@skipIf(job_index is None, 'the conductor is not available')
+class JobIndexTestCase(TestCase):
+    JOBS = {
+            'fping': ['ping', 'network', 'rtt'],
+            'hping': ['ping', 'network', 'rtt'],
+            'iperf3': ['throughput', 'bandwidth', 'network'],
+            'tcpdump_pcap': ['capture', 'packets'],
+            'rate_monitoring': ['latency', 'rate', 'iptables'],
+            'ip_route': ['route', 'routing', 'network'],
+    }
+
+    def setUp(self):
+        self.index = job_index.JobIndex(self.JOBS.items())
+
+    def test_misspelled_searches(self):
+        for search, job in (
+                ('latancy', 'rate_monitoring'),
+                ('ipref', 'iperf3'),
+                ('tcp', 'tcpdump_pcap'),
+                ('pign', 'fping'),
+                ('iperf 3', 'iperf3'),
+                ('Route', 'ip_route')):
+            with self.subTest(search=search):
+                self.assertIn(job, self.index.search(search, 60))
+
+    def test_ratio_limits_results(self):
+        self.assertEqual(self.index.search('ping', 100), {'fping', 'hping'})
+        self.assertEqual(self.index.search('', 0), set())
+        self.assertEqual(self.index.search('zzzz', 60), set())
+
+    def test_ratios(self):
+        for first, second, ratio in (
+                ('latancy', 'latency', 86),
+                ('ipref', 'iperf3', 73),
+                ('tcp', 'tcpdump', 60),
+                ('pign', 'fping', 67),
+                ('abcd', 'dcba', 25),
+                ('network tools', 'tools', 100),
+                ('a-b', 'B A', 100),
+                ('', 'ping', 0)):
+            with self.subTest(first=first, second=second):
+                self.assertEqual(job_index.token_set_ratio(first, second), ratio)
+
+    @skipIf(fuzz is None, 'fuzzywuzzy and python-Levenshtein are not installed')
+    def test_same_scores_as_fuzzywuzzy(self):
+        generator = random.Random(42)
+        alphabet = 'abcdef _-1\xe9'
+        for _ in range(20000):
+            first = ''.join(generator.choice(alphabet) for _ in range(generator.randint(0, 12)))
+            second = ''.join(generator.choice(alphabet) for _ in range(generator.randint(0, 12)))
+            self.assertEqual(
+                    job_index.token_set_ratio(first, second),
+                    fuzz.token_set_ratio(first, second),
+                    (first, second))
+
+    @skipIf(fuzz is None, 'fuzzywuzzy and python-Levenshtein are not installed')
+    def test_same_results_as_fuzzywuzzy(self):
+        delimiters = re.compile(r'\W|_')
+        for search in ('ping', 'latancy', 'ipref', 'tcp', 'pign', 'network rtt', 'rout', 'cap'):
+            for ratio in (40, 60, 80):
+                expected = {
+                        name for name, keywords in self.JOBS.items()
+                        if any(fuzz.token_set_ratio(word, search) >= ratio
+                               for word in (*delimiters.split(name), *keywords))
+                }
+                with self.subTest(search=search, ratio=ratio):
+                    self.assertEqual(self.index.search(search, ratio), expected)
+
+
+file_transfer = load_conductor_module('file_transfer')
+
+
+class LocalTransport:
+    """Run the commands meant for agents on the local machine,
+    optionally failing the first ones.
+    """
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.commands = []
+
+    def run(self, address, remote_command):
+        self.commands.append(remote_command)
+        if len(self.commands) <= self.failures:
+            remote_command = 'cat > /dev/null; echo "Connection refused" >&2; exit 255'
+        return subprocess.Popen(
+                ['sh', '-c', remote_command],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+
+
+@skipIf(file_transfer is None, 'the conductor is not available')
+class FileTransferTestCase(TestCase):
+    FILES = 500
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.agent = Path(directory.name, 'agent')
+        self.controller = Path(directory.name, 'controller')
+        self.agent.mkdir()
+        for i in range(self.FILES):
+            self.agent.joinpath('file{}.txt'.format(i)).write_text('content {}\n'.format(i) * (i % 7))
+
+    def transfers(self, address='agent', **kwargs):
+        return [
+                file_transfer.FileTransfer(
+                    address, str(self.agent / 'file{}.txt'.format(i)),
+                    str(self.controller / address / 'file{}.txt'.format(i)), **kwargs)
+                for i in range(self.FILES)
+        ]
+
+    def retrieve(self, transfers, transport=None, **kwargs):
+        kwargs.setdefault('delay', 0)
+        return file_transfer.retrieve_files(transfers, transport or LocalTransport(), **kwargs)
+
+    def test_many_small_files(self):
+        transport = LocalTransport()
+        reports = self.retrieve(self.transfers('first') + self.transfers('second'), transport)
+        self.assertEqual(reports, {
+                'first': {'transferred': self.FILES, 'skipped': 0, 'missing': []},
+                'second': {'transferred': self.FILES, 'skipped': 0, 'missing': []},
+        })
+        # A listing and a single tar stream per agent
+        self.assertEqual(len(transport.commands), 4)
+        for address in ('first', 'second'):
+            for i in range(self.FILES):
+                source = self.agent / 'file{}.txt'.format(i)
+                copy = self.controller / address / 'file{}.txt'.format(i)
+                self.assertEqual(copy.read_text(), source.read_text())
+                self.assertEqual(int(copy.stat().st_mtime), int(source.stat().st_mtime))
+
+    def test_up_to_date_files_are_skipped(self):
+        self.retrieve(self.transfers())
+        changed = self.agent / 'file3.txt'
+        changed.write_text('changed')
+        os.utime(str(changed), (1000, 1000))
+
+        report = self.retrieve(self.transfers())['agent']
+        self.assertEqual(report, {'transferred': 1, 'skipped': self.FILES - 1, 'missing': []})
+        self.assertEqual((self.controller / 'agent' / 'file3.txt').read_text(), 'changed')
+
+    def test_missing_and_removed_files(self):
+        transfers = self.transfers(remove=True)
+        transfers.append(file_transfer.FileTransfer('agent', str(self.agent / 'absent'), str(self.controller / 'absent')))
+        report = self.retrieve(transfers)['agent']
+        self.assertEqual(report, {'transferred': self.FILES, 'skipped': 0, 'missing': [str(self.agent / 'absent')]})
+        self.assertEqual(list(self.agent.iterdir()), [])
+
+    def test_failures_are_retried(self):
+        transport = LocalTransport(failures=3)
+        report = self.retrieve(self.transfers(), transport)['agent']
+        self.assertEqual(report['transferred'], self.FILES)
+
+        transport = LocalTransport(failures=3)
+        report = self.retrieve(self.transfers('other'), transport, attempts=3)['other']
+        self.assertIn('Connection refused', report['error'])
+        self.assertEqual(len(transport.commands), 3)
+
+    def test_ownership(self):
+        user = pwd.getpwuid(os.getuid()).pw_name
+        group = grp.getgrgid(os.getgid()).gr_name
+        report = self.retrieve(self.transfers(user=user, group=group))['agent']
+        self.assertEqual(report['transferred'], self.FILES)
+        stat = (self.controller / 'agent' / 'file0.txt').stat()
+        self.assertEqual((stat.st_uid, stat.st_gid), (os.getuid(), os.getgid()))
+
+        report = self.retrieve(self.transfers('other', user='no-such-user-for-openbach'))['other']
+        self.assertIn('cannot change owner', report['error'])
+
+
+logs_query = load_conductor_module('logs_query')
+
+
+class FakeElasticSearch:
+    """Answer the searches of LogsQuery out of a list of logs"""
+
+    def __init__(self, logs, failing_instances=()):
+        self.logs = sorted(logs, key=lambda log: log['sort'])
+        self.failing_instances = set(failing_instances)
+        self.requests = []
+
+    @staticmethod
+    def _matches(log, query):
+        source = log['_source']
+        for condition in query.get('filter', []):
+            (kind, clause), = condition.items()
+            (field, value), = clause.items()
+            if kind == 'range':
+                if 'lte' in value and source[field] > value['lte']:
+                    return False
+                if 'gte' in value and source[field] < value['gte']:
+                    return False
+            elif kind == 'terms' and source.get(field) not in value:
+                return False
+            elif kind == 'term' and source.get(field) != value:
+                return False
+        for condition in query.get('must_not', []):
+            if condition['exists']['field'] in source:
+                return False
+        return True
+
+    def _search(self, body):
+        logs = [log for log in self.logs if self._matches(log, body['query']['bool'])]
+        if 'aggs' in body:
+            aggregation = body['aggs']['instances']['composite']
+            counts = Counter(log['_source']['job_instance_id'] for log in logs)
+            after = aggregation.get('after', {}).get('job_instance_id')
+            keys = [key for key in sorted(counts) if after is None or key > after]
+            buckets = [
+                    {'key': {'job_instance_id': key}, 'doc_count': counts[key]}
+                    for key in keys[:aggregation['size']]
+            ]
+            instances = {'buckets': buckets}
+            if buckets:
+                instances['after_key'] = buckets[-1]['key']
+            return {'aggregations': {'instances': instances}}
+
+        search_after = body.get('search_after')
+        if search_after is not None:
+            logs = [log for log in logs if log['sort'] > search_after]
+        return {'hits': {'hits': logs[:body['size']]}}
+
+    def post(self, route, *bodies):
+        self.requests.append((route, bodies))
+        if route.endswith('_search'):
+            body, = bodies
+            return self._search(body)
+
+        responses = []
+        for body in bodies[1::2]:
+            instance, = [
+                    condition['term']['job_instance_id']
+                    for condition in body['query']['bool']['filter']
+                    if 'term' in condition
+            ]
+            if instance in self.failing_instances:
+                responses.append({'error': {'type': 'search_phase_execution_exception'}})
+            else:
+                responses.append(self._search(body))
+        return {'responses': responses}
+
+
+def fake_log(identifier, timestamp, job_instance_id=None, severity=6):
+    source = {'@timestamp': timestamp, 'severity': severity, 'message': 'log {}'.format(identifier)}
+    if job_instance_id is not None:
+        source['job_instance_id'] = job_instance_id
+    return {'_id': '{:08}'.format(identifier), '_source': source, 'sort': [timestamp, '{:08}'.format(identifier)]}
+
+
+@skipIf(logs_query is None, 'the conductor is not available')
+class LogsQueryTestCase(TestCase):
+    def setUp(self):
+        self.logs = [fake_log(i, 1000 + i // 3) for i in range(2500)]
+        self.instances = {1: 5, 2: 2300, 3: 1000, 4: 0, 5: 1}
+        identifier = len(self.logs)
+        for instance, amount in self.instances.items():
+            for i in range(amount):
+                self.logs.append(fake_log(identifier, 1000 + i % 700, instance, severity=3 + i % 5))
+                identifier += 1
+
+    def query(self, logs=None, **kwargs):
+        elasticsearch = FakeElasticSearch(self.logs if logs is None else logs, **kwargs)
+        query = logs_query.LogsQuery('127.0.0.1', 9200, page_size=1000, batch_size=2)
+        query._post = elasticsearch.post
+        return query, elasticsearch
+
+    def test_orphans_paging(self):
+        query, elasticsearch = self.query()
+        orphans = list(query.orphans())
+        self.assertEqual(orphans, [log for log in elasticsearch.logs if 'job_instance_id' not in log['_source']])
+        self.assertEqual(len(elasticsearch.requests), 3)
+
+        # A last empty page is requested when the logs fill every page
+        query, elasticsearch = self.query(self.logs[:2000])
+        self.assertEqual(len(list(query.orphans())), 2000)
+        self.assertEqual(len(elasticsearch.requests), 3)
+
+    def test_orphans_filters(self):
+        query, elasticsearch = self.query()
+        orphans = list(query.orphans(level=6, timestamps=(1100, 1199)))
+        self.assertEqual(len(orphans), 300)
+        self.assertEqual(list(query.orphans(level=5)), [])
+
+    def test_instances_logs_paging(self):
+        query, elasticsearch = self.query()
+        logs = list(query.instances_logs(self.instances))
+        self.assertEqual(len(logs), sum(self.instances.values()))
+        self.assertEqual(len({log['_id'] for log in logs}), len(logs))
+        for instance in self.instances:
+            instance_logs = [log for log in logs if log['_source']['job_instance_id'] == instance]
+            self.assertEqual(instance_logs, sorted(instance_logs, key=lambda log: log['sort']))
+
+        # Only instances that produced logs are searched, by batches,
+        # and only the ones with a full page get a subsequent search
+        routes = [route for route, _ in elasticsearch.requests]
+        self.assertEqual(routes.count('logstash-*/_search'), 1)
+        searches = [len(bodies) // 2 for route, bodies in elasticsearch.requests if route == '_msearch']
+        self.assertEqual(searches, [2, 2, 2, 1])
+
+    def test_instances_logs_filters(self):
+        query, _ = self.query()
+        logs = list(query.instances_logs([2, 5], level=4, timestamps=(1000, 1099)))
+        expected = [
+                log for log in self.logs
+                if log['_source'].get('job_instance_id') in (2, 5)
+                and log['_source']['severity'] <= 4
+                and log['_source']['@timestamp'] < 1100
+        ]
+        self.assertEqual(sorted(log['_id'] for log in logs), sorted(log['_id'] for log in expected))
+
+    def test_instances_counts_paging(self):
+        query, elasticsearch = self.query()
+        query.page_size = 2
+        self.assertEqual(query.count_by_instance(self.instances), {1: 5, 2: 2300, 3: 1000, 5: 1})
+        self.assertEqual(len(elasticsearch.requests), 3)
+
+    def test_instances_logs_error(self):
+        query, _ = self.query(failing_instances=[3])
+        with self.assertRaises(logs_query.LogsQueryError):
+            list(query.instances_logs(self.instances))
+
+    def test_parallel_errors_are_isolated(self):
+        queries = {name: self.query(failing_instances=[3] if name == 'failing' else [])[0] for name in ('first', 'failing', 'second')}
+        errors = []
+        logs = list(logs_query.iterate_in_parallel(
+                lambda name: queries[name].instances_logs(self.instances),
+                queries, lambda name, error: errors.append((name, type(error)))))
+        self.assertEqual(errors, [('failing', logs_query.LogsQueryError)])
+        # Other collectors are unaffected and logs yielded before the error are kept
+        self.assertGreaterEqual(len(logs), 2 * sum(self.instances.values()))
+        self.assertLess(len(logs), 3 * sum(self.instances.values()))
+
+    def test_parallel_consumer_can_stop(self):
+        def endless(argument):
+            while True:
+                yield argument
+
+        before = threading.active_count()
+        items = logs_query.iterate_in_parallel(endless, range(4), buffer_size=10)
+        self.assertEqual(len([item for _, item in zip(range(100), items)]), 100)
+        items.close()
+        deadline = time.monotonic() + 5
+        while threading.active_count() > before and time.monotonic() < deadline:
+            time.sleep(0.1)
+        self.assertEqual(threading.active_count(), before)
+
+
+def load_job_module(name):
+    jobs = Path(__file__).resolve().parents[3] / 'jobs'
+    for path in jobs.glob('**/{0}/files/{0}.py'.format(name)):
+        spec = importlib.util.spec_from_file_location(name, str(path))
+        module = importlib.util.module_from_spec(spec)
+        # Jobs report through the collect-agent library of the agents
+        with mock.patch.dict(sys.modules, collect_agent=mock.MagicMock()):
+            try:
+                spec.loader.exec_module(module)
+            except ImportError:
+                return None
+        return module
+
+
+link_profile = load_job_module('link_profile')
+
+
+class RecordingTcBackend:
+    """Record the steps of a link profile along
+    with the time they are applied at.
+    """
+
+    def __init__(self, clock, cost=0.0):
+        self.clock = clock
+        self.cost = cost
+        self.applied = []
+
+    def change(self, step):
+        if self.cost:
+            self.clock.advance(self.cost)
+        self.applied.append((step, self.clock()))
+
+
+class FakeClock:
+    """Monotonic clock whose sleeps overshoot by a random amount"""
+
+    def __init__(self, overshoot, seed=42):
+        self.now = 1000.0
+        self.overshoot = overshoot
+        self.random = random.Random(seed)
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, duration):
+        self.now += duration
+
+    def sleep(self, duration):
+        self.advance(duration + self.random.uniform(0, self.overshoot))
+
+
+@skipIf(link_profile is None, 'the link_profile job is not available')
+class LinkProfileTestCase(TestCase):
+    STEPS = 10000
+
+    def trace(self, interval):
+        return link_profile.parse_trace(
+                '{:.4f} {} 0 {} 10M'.format(i * interval, 250 + i % 50, i % 3)
+                for i in range(self.STEPS))
+
+    def test_drift_does_not_accumulate(self):
+        steps = self.trace(0.01)
+        clock = FakeClock(overshoot=0.002)
+        backend = RecordingTcBackend(clock, cost=0.0003)
+        drifts = []
+        start = clock()
+        link_profile.replay(
+                steps, backend, loops=2,
+                report=lambda step, drift: drifts.append(drift),
+                clock=clock, sleep=clock.sleep)
+
+        self.assertEqual(len(backend.applied), 2 * self.STEPS)
+        self.assertEqual([step for step, _ in backend.applied], steps + steps)
+        # Each step is late by at most one sleep overshoot and one tc change
+        self.assertLessEqual(max(drifts), 0.0023 + 1e-9)
+        self.assertGreaterEqual(min(drifts), 0.0003 - 1e-9)
+        period = 2 * self.STEPS * 0.01
+        self.assertLessEqual(clock() - start - period, 0.002 + 1e-9)
+
+    def test_drift_with_a_real_clock(self):
+        steps = self.trace(0.0001)
+        backend = RecordingTcBackend(time.monotonic)
+        drifts = []
+        link_profile.replay(steps, backend, report=lambda step, drift: drifts.append(drift))
+
+        self.assertEqual(len(backend.applied), self.STEPS)
+        self.assertLess(sorted(drifts)[self.STEPS // 2], 0.005)
+        self.assertLess(drifts[-1], 0.05)
+
+    def test_netem_location(self):
+        default = [{'kind': 'fq_codel', 'handle': '0:', 'root': True}]
+        ingress = [{'kind': 'ingress', 'handle': 'ffff:', 'parent': 'ffff:fff1'}]
+        shaped = [
+                {'kind': 'htb', 'handle': '1:', 'root': True},
+                {'kind': 'netem', 'handle': '10:', 'parent': '1:11'},
+        ]
+        delayed = [{'kind': 'netem', 'handle': '1:', 'root': True}]
+        self.assertEqual(link_profile.find_netem([]), ('root', '1:', False))
+        self.assertEqual(link_profile.find_netem(default + ingress), ('root', '1:', False))
+        self.assertEqual(link_profile.find_netem(shaped + ingress), ('1:11', '10:', True))
+        self.assertEqual(link_profile.find_netem(delayed), ('root', '1:', True))
+        with self.assertRaises(ValueError):
+            link_profile.find_netem(shaped[:1])
+
+
+def load_post_processing_module(name):
+    path = Path(__file__).resolve().parents[3] / 'jobs' / 'core_jobs' / 'post_processing' / '{}.py'.format(name)
+    spec = importlib.util.spec_from_file_location(name, str(path))
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except ImportError:
+        return None
+    return module
+
+
+streaming_aggregation = load_post_processing_module('streaming_aggregation')
+if streaming_aggregation is not None:
+    numpy, pandas = streaming_aggregation.np, streaming_aggregation.pd
+
+
+@skipIf(streaming_aggregation is None, 'the post-processing dependencies are not available')
+class StreamingAggregationTestCase(TestCase):
+    START = 1600000000000
+
+    def chunks(self, amount, size=10000):
+        generator = numpy.random.default_rng(42)
+        for number in range(amount):
+            times = self.START + numpy.arange(number * size, (number + 1) * size) * 7
+            values = generator.uniform(0, 10000, size)
+            yield pandas.DataFrame({'time': times, 'rate': values})
+
+    def test_same_statistic_with_several_parameters(self):
+        figures = [(100, 1), (2, 1000), (500, 1)]
+        accumulators = {}
+        scale_factors = {}
+        for index, (bin_size, scale_factor) in enumerate(figures):
+            key = 'rate', 'second', index
+            bins = streaming_aggregation.histogram_bins(bin_size, 0, 10000 / scale_factor)
+            accumulators[key] = streaming_aggregation.BinnedHistogram(bins)
+            scale_factors[key] = scale_factor
+        streaming_aggregation.accumulate(self.chunks(3), accumulators, scale_factors)
+        plot = streaming_aggregation.AccumulatedPlot(accumulators)
+
+        data = pandas.concat(list(self.chunks(3)))
+        seconds = pandas.DatetimeIndex(pandas.to_datetime(data['time'], unit='ms')).second
+        for index, (bin_size, scale_factor) in enumerate(figures):
+            bins = streaming_aggregation.histogram_bins(bin_size, 0, 10000 / scale_factor)
+            frame, = plot.temporal_binning_histogram('rate', index, time_aggregation='second')
+            self.assertEqual(list(frame.columns), list(bins[1:]))
+            for second in numpy.unique(seconds):
+                expected, _ = numpy.histogram(data['rate'][seconds == second] / scale_factor, bins)
+                row = frame.loc['{}-{}'.format(second, second + 1)]
+                numpy.testing.assert_allclose(row.to_numpy(), expected / expected.sum() * 100)
+
+    def test_memory_does_not_grow_with_the_series(self):
+        def peak(amount):
+            bins = streaming_aggregation.histogram_bins(100, 0, 10000)
+            accumulators = {('rate', 'minute'): streaming_aggregation.BinnedHistogram(bins)}
+            tracemalloc.start()
+            try:
+                streaming_aggregation.accumulate(self.chunks(amount), accumulators)
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        short = peak(5)
+        # Ten times more points but the same amount of temporal bins
+        self.assertLess(peak(50), 1.5 * short)
+
+
+def load_agent_module(name):
+    path = Path(__file__).resolve().parents[3] / 'agent' / name / '{}.py'.format(name)
+    spec = importlib.util.spec_from_file_location(name, str(path))
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except ImportError:
+        return None
+    return module
+
+
+rstats = load_agent_module('rstats')
+
+
+@skipIf(rstats is None or rstats.msgpack is None, 'msgpack is not available')
+class RstatsBinaryFrameTestCase(TestCase):
+    """Check the decoding of the binary frames of collect-agent,
+    built here using the same MessagePack layout.
+    """
+
+    def frame(self, command_id, parameters):
+        header = rstats.BINARY_MAGIC + bytes([rstats.BINARY_VERSION, command_id])
+        return header + rstats.msgpack.packb(parameters)
+
+    def parse(self, data):
+        return rstats.RstatsRequestHandler.parse_request(None, data)
+
+    def random_value(self, generator, depth=0):
+        kind = generator.randrange(7 if depth < 3 else 5)
+        if kind == 0:
+            return generator.choice([None, True, False])
+        if kind == 1:
+            return generator.choice([0, 127, 128, -32, -33, 2**31, -2**31 - 1, 2**63 - 1, -2**63])
+        if kind == 2:
+            return generator.uniform(-1e12, 1e12)
+        if kind == 3:
+            return generator.choice([0.0, 1e-300, float('inf'), -float('inf')])
+        if kind == 4:
+            size = generator.choice([0, 1, 31, 32, 255, 256, 65536])
+            pattern = ''.join(generator.choice('abc_-é€ ') for _ in range(8))
+            return (pattern * size)[:size]
+        size = generator.choice([0, 1, 15, 16])
+        if kind == 5:
+            return [self.random_value(generator, depth + 1) for _ in range(size)]
+        return {'key{}'.format(i): self.random_value(generator, depth + 1) for i in range(size)}
+
+    def statistics_request(self):
+        return {
+                'connection_id': 42,
+                'timestamp': 1600000000000,
+                'suffix': None,
+                'statistics': {'statistic_{}'.format(i): i * 1.5 for i in range(20)},
+        }
+
+    def test_round_trip(self):
+        generator = random.Random(33)
+        for _ in range(2000):
+            command_id = generator.randint(1, 7)
+            parameters = {
+                    'connection_id': generator.randint(0, 2**31),
+                    'statistics': {
+                        'statistic_{}'.format(i): self.random_value(generator)
+                        for i in range(generator.randint(0, 20))
+                    },
+                    'suffix': self.random_value(generator),
+            }
+            self.assertEqual(self.parse(self.frame(command_id, parameters)), (command_id, parameters))
+
+    def test_corrupted_frames_are_rejected(self):
+        generator = random.Random(33)
+        frame = self.frame(2, self.statistics_request())
+        for _ in range(50000):
+            corrupted = bytearray(frame)
+            mutation = generator.randrange(3)
+            if mutation == 0:
+                del corrupted[generator.randrange(3, len(corrupted)):]
+            elif mutation == 1:
+                corrupted[generator.randrange(3, len(corrupted))] = generator.randrange(256)
+            else:
+                corrupted.insert(generator.randrange(3, len(corrupted)), generator.randrange(256))
+            try:
+                command_id, parameters = self.parse(bytes(corrupted))
+            except rstats.BadRequest:
+                continue
+            self.assertIsInstance(parameters, dict)
+
+    def test_unsupported_frames(self):
+        frame = self.frame(2, self.statistics_request())
+        with self.assertRaises(rstats.BadRequest):
+            self.parse(frame[:3] + bytes([rstats.BINARY_VERSION - 1]) + frame[4:])
+        with self.assertRaises(rstats.BadRequest):
+            self.parse(rstats.BINARY_MAGIC + bytes([rstats.BINARY_VERSION, 2]) + rstats.msgpack.packb([1, 2]))
+        # Old collect-agent clients then fall back to JSON
+        with mock.patch.object(rstats, 'msgpack', None), self.assertRaises(rstats.BadRequest):
+            self.parse(frame)
+
+    def test_decoding_throughput(self):
+        parameters = self.statistics_request()
+        binary = self.frame(2, parameters)
+        text = json.dumps({'command_id': 2, 'command_parameters': parameters}).encode()
+        self.assertEqual(self.parse(binary), self.parse(text))
+
+        def throughput(data, amount=20000):
+            elapsed = min(timeit.repeat(lambda: self.parse(data), number=amount, repeat=5))
+            return amount / elapsed
+
+        self.assertGreater(throughput(binary), throughput(text))
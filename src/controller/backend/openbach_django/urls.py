@@ -44,6 +44,7 @@ urlpatterns = [
     url(r'^login/users/?$', views.UsersView.as_view(), name='users_view'),
     url(r'^logs/?$', views.LogsView.as_view(), name='logs_view'),
     url(r'^version/?$', views.VersionView.as_view(), name='version_view'),
+    url(r'^connections/?$', views.ConnectionsView.as_view(), name='connections_view'),
 
     url(r'^statistic/(?P<job_instance_id>\d+)/?$',
         views.StatisticView.as_view(),
@@ -0,0 +1,104 @@
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Table descriptions relatives to the versioning of the
+resources exposed by the backend.
+
+Each class in this module describe a table with its associated
+columns in the backend's database. These classes are used by
+the Django's ORM to convert results from databases queries into
+Python objects.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import hashlib
+from functools import partial
+
+from django.db import models, transaction, IntegrityError
+from django.utils import timezone
+
+from .notifications import notify
+
+
+class ResourceVersion(models.Model):
+    """Counter of the changes of a resource exposed by the backend.
+
+    Counters are bumped whenever one of the models a resource is
+    built from is saved or deleted, so clients polling it can be
+    told that it did not change without computing it again.
+    """
+
+    name = models.CharField(max_length=500, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    modified = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return '{} (version {})'.format(self.name, self.version)
+
+    @classmethod
+    def bump(cls, *names):
+        """Increment the version of the given resources and notify
+        processes waiting for their changes once committed.
+        """
+        now = timezone.now()
+        # Always lock rows in the same order to avoid deadlocks
+        for name in sorted(set(names)):
+            bumped = cls.objects.filter(name=name)
+            if not bumped.update(version=models.F('version') + 1, modified=now):
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(name=name, version=1, modified=now)
+                except IntegrityError:
+                    # Created concurrently in the meantime
+                    bumped.update(version=models.F('version') + 1, modified=now)
+        transaction.on_commit(partial(notify, names))
+
+    @classmethod
+    def tag(cls, names, *discriminants):
+        """Compute an entity tag out of the current version of the
+        given resources and of any additional discriminant of the
+        representation (user, query string…). Return it along with
+        the date of the last modification of these resources, if any.
+        """
+        versions = {name: (0, None) for name in names}
+        versions.update(
+                (name, (version, modified))
+                for name, version, modified in cls.objects
+                .filter(name__in=versions)
+                .values_list('name', 'version', 'modified'))
+
+        digest = hashlib.sha1(repr((
+            sorted((name, version) for name, (version, _) in versions.items()),
+            discriminants,
+        )).encode())
+        dates = [modified for _, modified in versions.values() if modified is not None]
+        return '"{}"'.format(digest.hexdigest()), max(dates, default=None)
@@ -35,10 +35,11 @@ __credits__ = '''Contributors:
 '''
 
 import os
+import time
 import base64
 import tempfile
+import threading
 import traceback
-from pathlib import Path
 from contextlib import suppress
 try:
     # Try to use a better implementation if it is installed
@@ -50,21 +51,42 @@ from django.views.generic import base
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout
-from django.http import JsonResponse, FileResponse, HttpResponse, Http404
+from django.http import JsonResponse, FileResponse, HttpResponse, StreamingHttpResponse, Http404
 from django.db.utils import IntegrityError
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 
 import yaml
 
+from . import connections, notifications, file_store
+from .models import ResourceVersion
 from .utils import send_fifo, extract_integer, user_to_json, build_storage_path
 
+
+# Longest time, in seconds, a request may wait for a resource to change
+MAX_WAIT = 60
+# Interval, in seconds, between two comments on idle events streams
+KEEP_ALIVE = 15
+# Most requests of a process allowed to wait for changes or to stream
+# them at once, so that some of its uWSGI threads stay available
+MAX_IDLE_REQUESTS = 4
+IDLE_REQUESTS = threading.BoundedSemaphore(MAX_IDLE_REQUESTS)
+
+
 class GenericView(base.View):
     """Base class for our own class-based views"""
 
+    # Upload handlers classes to use instead of the default ones
+    upload_handlers = None
+
     def _dispatch(self, request, *args, **kwargs):
         """Wraps every response from the various calls into a
         JSON response.
         """
 
+        if self.upload_handlers is not None:
+            request.upload_handlers = [handler(request) for handler in self.upload_handlers]
+
         if request.FILES:
             request.JSON = request.POST
         else:
@@ -83,6 +105,46 @@ class GenericView(base.View):
                         status=400,
                         data={'error': 'API error: data should be sent as JSON in the request body'})
 
+        etag = last_modified = None
+        if request.method in ('GET', 'HEAD') and request.user.is_authenticated:
+            # Validators tell whether and when resources changed, so
+            # anonymous users are left to the checks of the conductor
+            resources = self.versioned_resources(request, *args, **kwargs)
+            if resources is not None:
+                if 'events' in request.GET:
+                    if not IDLE_REQUESTS.acquire(blocking=False):
+                        response = JsonResponse(
+                                status=503,
+                                data={'msg': 'Too many clients following changes, try again later'})
+                        response['Retry-After'] = KEEP_ALIVE
+                        return response
+                    response = StreamingHttpResponse(
+                            self._events(request, resources, *args, **kwargs),
+                            content_type='text/event-stream')
+                    response['Cache-Control'] = 'no-cache'
+                    response['X-Accel-Buffering'] = 'no'
+                    return response
+
+                try:
+                    wait = min(float(request.GET.get('wait', 0)), MAX_WAIT)
+                except ValueError:
+                    return JsonResponse(
+                            status=400,
+                            data={'msg': 'GET data malformed: wait should be a number of seconds'})
+
+                idle = wait > 0 and IDLE_REQUESTS.acquire(blocking=False)
+                try:
+                    # Above the limit, answer right away
+                    etag, last_modified, not_modified = self._conditional_response(
+                            request, resources, wait if idle else 0)
+                finally:
+                    if idle:
+                        IDLE_REQUESTS.release()
+                if not_modified is not None:
+                    # Nothing changed since the last request,
+                    # no need to bother the conductor
+                    return not_modified
+
         try:
             response = super().dispatch(request, *args, **kwargs)
         except Exception:
@@ -96,7 +158,13 @@ class GenericView(base.View):
         else:
             if message is None:
                 return HttpResponse(status=status)
-            return JsonResponse(data=message, status=status, safe=False)
+            response = JsonResponse(data=message, status=status, safe=False)
+            if etag is not None and 200 <= status < 300:
+                response['ETag'] = etag
+                response['Cache-Control'] = 'no-cache'
+                if last_modified is not None:
+                    response['Last-Modified'] = http_date(last_modified.timestamp())
+            return response
 
     def dispatch(self, request, *args, **kwargs):
         response = self._dispatch(request, *args, **kwargs)
@@ -108,6 +176,78 @@ class GenericView(base.View):
             response['Access-Control-Allow-Headers'] = requested_headers
         return response
 
+    def versioned_resources(self, request, *args, **kwargs):
+        """Override this in subclasses to return the names of the
+        ResourceVersion that the response to a GET request depends
+        upon, so that authenticated clients can issue conditional
+        requests, wait for changes (?wait=<seconds>) or follow them
+        (?events).
+        """
+        return None
+
+    @staticmethod
+    def _representation(request):
+        """Everything, besides the resources versions, that
+        the response to a GET request depends upon.
+        """
+        query = request.GET.copy()
+        for parameter in ('wait', 'events'):
+            query.pop(parameter, None)
+        user = request.user
+        return user.get_username(), user.is_staff, request.path, query.urlencode()
+
+    def _conditional_response(self, request, resources, wait=0):
+        """Compute the validators of the current representation of
+        the resources and, if the client already has it, the 304
+        response to send; waiting at most `wait` seconds for them
+        to change beforehand.
+        """
+        deadline = time.monotonic() + wait
+        listener = notifications.listener() if wait > 0 else None
+        while True:
+            snapshot = listener and listener.snapshot(resources)
+            etag, last_modified = ResourceVersion.tag(resources, *self._representation(request))
+            not_modified = get_conditional_response(
+                    request, etag=etag, last_modified=last_modified
+                    and int(last_modified.timestamp()))
+            remaining = deadline - time.monotonic()
+            if not_modified is None or remaining <= 0:
+                return etag, last_modified, not_modified
+            # Do not hold a database connection while idling
+            connections.release_connections()
+            listener.wait(resources, snapshot, remaining)
+
+    def _events(self, request, resources, *args, **kwargs):
+        """Generate a server-sent event holding the response
+        to the GET request each time the resources change.
+
+        The caller must have acquired IDLE_REQUESTS, which
+        is released once the stream ends.
+        """
+        try:
+            listener = notifications.listener()
+            last_etag = request.META.get('HTTP_LAST_EVENT_ID')
+            while True:
+                snapshot = listener.snapshot(resources)
+                etag, _ = ResourceVersion.tag(resources, *self._representation(request))
+                if etag != last_etag:
+                    try:
+                        message, status = super().dispatch(request, *args, **kwargs)
+                    except Exception:
+                        message, status = {'error': traceback.format_exc()}, 500
+                    succeeded = 200 <= status < 300
+                    yield 'id: {}\nevent: {}\ndata: {}\n\n'.format(
+                            etag, 'change' if succeeded else 'error', json.dumps(message))
+                    if not succeeded:
+                        return
+                    last_etag = etag
+
+                connections.release_connections()
+                if not listener.wait(resources, snapshot, KEEP_ALIVE):
+                    yield ': keep-alive\n\n'
+        finally:
+            IDLE_REQUESTS.release()
+
     @property
     def allowed_methods(self):
         return ', '.join(
@@ -141,6 +281,9 @@ class GenericView(base.View):
 class StateView(GenericView):
     state_type = None
 
+    def versioned_resources(self, request, **kwargs):
+        return ['command_results']
+
     def get(self, request, id=None, name=None, address=None):
         """compute status of agents or jobs on it"""
 
@@ -280,6 +423,12 @@ class BaseAgentView(GenericView):
 class AgentsView(BaseAgentView):
     """Manage actions for agents without an ID"""
 
+    def versioned_resources(self, request):
+        if 'update' in request.GET or 'services' in request.GET:
+            # Agents are contacted to refresh their status
+            return None
+        return ['agents']
+
     def get(self, request):
         """list all agents"""
         return self.conductor_execute(
@@ -416,14 +565,31 @@ class BaseJobView(GenericView):
 class JobsView(BaseJobView):
     """Manage actions for jobs without an ID"""
 
+    def versioned_resources(self, request):
+        if 'external' in request.GET or 'address' in request.GET:
+            # Repositories or agents are contacted
+            return None
+        return ['jobs']
+
     def get(self, request):
         """Get the list of jobs"""
 
         if 'external' in request.GET:
-            repository = request.GET.get('repository', 'openbach-extra')
-            return self.conductor_execute(
-                    command='list_external_jobs',
-                    repository=repository)
+            data = {
+                    'command': 'list_external_jobs',
+                    'repository': request.GET.get('repository', 'openbach-extra'),
+                    'string_to_search': request.GET.get('string_to_search'),
+                    'update': 'update' in request.GET,
+            }
+            ratio = request.GET.get('ratio')
+            if ratio is not None:
+                try:
+                    data['ratio'] = float(ratio)
+                except ValueError:
+                    return JsonResponse(
+                            status=400,
+                            data={'msg': 'GET data malformed: ratio should be a number'})
+            return self.conductor_execute(**data)
 
         try:
             string_to_search = request.GET['string_to_search']
@@ -445,7 +611,12 @@ class JobsView(BaseJobView):
         """
         data = {'command': 'list_jobs', 'string_to_search': string_to_search}
         if ratio is not None:
-            data['ratio'] = float(ratio)
+            try:
+                data['ratio'] = float(ratio)
+            except ValueError:
+                return JsonResponse(
+                        status=400,
+                        data={'msg': 'GET data malformed: ratio should be a number'})
         return self.conductor_execute(**data)
 
     def _get_installed_jobs(self, address, update):
@@ -459,6 +630,11 @@ class JobsView(BaseJobView):
         try:
             action = request.JSON['action']
         except KeyError:
+            with suppress(KeyError):
+                # Create or update several jobs at once
+                jobs = request.JSON['jobs']
+                return self.conductor_execute(command='add_jobs', jobs=jobs)
+
             # Create a new job
             try:
                 name = request.JSON['name']
@@ -591,6 +767,12 @@ class BaseJobInstanceView(GenericView):
 class JobInstancesView(BaseJobInstanceView):
     """Manage actions on job instances without an ID"""
 
+    def versioned_resources(self, request):
+        if 'update' in request.GET:
+            # Agents are contacted to refresh the job instances status
+            return None
+        return ['job_instances', 'agents']
+
     def get(self, request):
         """list all job instances"""
         return self.conductor_execute(
@@ -760,12 +942,18 @@ class ScenarioInstancesView(GenericView):
         except ValueError:
             limit = None
 
+        try:
+            cursor = extract_integer(request.GET, 'cursor')
+        except ValueError:
+            cursor = None
+
         return self.conductor_execute(
                 command='list_scenario_instances',
                 project=project_name,
                 name=scenario_name,
                 page_offset=offset,
                 max_per_page=limit,
+                cursor=cursor,
                 quiet='quiet' in request.GET)
 
     def post(self, request, project_name, scenario_name=None):
@@ -780,12 +968,28 @@ class ScenarioInstancesView(GenericView):
 class ScenarioInstanceView(GenericView):
     """Manage action on specific scenario"""
 
+    def versioned_resources(self, request, id):
+        if 'files_count' in request.GET or 'logs' in request.GET:
+            # Computed out of the collector's databases
+            return None
+        return ['scenario_instance:{}'.format(id), 'projects']
+
     def get(self, request, id):
         """get infos from a scenario instance"""
         if 'files_count' in request.GET:
             return self.conductor_execute(
                     command='statistics_files_count',
                     instance_id=int(id))
+        if 'logs' in request.GET:
+            try:
+                level = extract_integer(request.GET, 'level', default=7)
+            except ValueError as e:
+                return {'msg': 'GET data malformed: {} '
+                        'should be an integer'.format(e)}, 400
+            return self.conductor_execute(
+                    command='scenario_instance_logs',
+                    instance_id=int(id), level=level,
+                    credentials=request.session.get('elasticsearch'))
         return self.conductor_execute(
                 command='infos_scenario_instance',
                 instance_id=int(id),
@@ -924,6 +1128,12 @@ class StatisticView(GenericView):
 
     def get(self, request, job_instance_id):
         instance_id = int(job_instance_id)
+        if 'live' in request.GET:
+            # Authorization of the live statistics streams of the Auditorium
+            return self.conductor_execute(
+                    command='statistics_access',
+                    instance_id=instance_id)
+
         suffix = request.GET.get('suffix')
         try:
             statistic_name = request.GET['name']
@@ -940,8 +1150,11 @@ class StatisticView(GenericView):
         else:
             try:
                 origin = extract_integer(request.GET, 'origin')
+                max_points = extract_integer(request.GET, 'max_points')
             except ValueError as e:
                 return {'msg': 'GET data malformed: \'{}\' is not an integer'.format(e)}, 400
+            if max_points is not None and max_points < 3:
+                return {'msg': 'GET data malformed: \'max_points\' should be at least 3'}, 400
             histogram = request.GET.get('histogram')
             try:
                 buckets = int(histogram)
@@ -959,7 +1172,8 @@ class StatisticView(GenericView):
                             instance_id=instance_id,
                             name=statistic_name,
                             suffix=suffix,
-                            origin=origin)
+                            origin=origin,
+                            max_points=max_points)
             else:
                 return self.conductor_execute(
                         command='statistics_histogram',
@@ -1098,6 +1312,19 @@ class VersionView(GenericView):
         return {'openbach_version': openbach_infos['version']}, 200
 
 
+class ConnectionsView(GenericView):
+    """Manage actions relative to the connections to the database"""
+
+    def get(self, request):
+        """Return the usage of the connections pools of the
+        conductor and of the backend worker serving the request
+        """
+        response, returncode = self.conductor_execute(command='database_connections')
+        if returncode != 200:
+            return response, returncode
+        return {'conductor': response, 'backend': connections.statistics()}, 200
+
+
 class Reboot(GenericView):
     """Manage actions to reboot an agent"""
 
@@ -1119,8 +1346,10 @@ class Reboot(GenericView):
 class PushFile(GenericView):
     """Manage actions to send files to agents"""
 
+    upload_handlers = [file_store.HashingUploadHandler]
+
     def post(self, request):
-        """Store a file on the controller or send it to an agent"""
+        """Store a file on the controller or send it to agents"""
 
         try:
             remote_path = request.JSON['path']
@@ -1129,6 +1358,13 @@ class PushFile(GenericView):
         except KeyError as e:
             return {'msg': 'POST data malformed: {} missing'.format(e)}, 400
 
+        if request.FILES:
+            # Form fields repeated to send the file to
+            # several paths or to several agents
+            remote_path = request.JSON.getlist('path')
+            if address is not None:
+                address = request.JSON.getlist('agent_ip')
+
         if isinstance(remote_path, str):
             remote_path = [remote_path]
 
@@ -1165,28 +1401,18 @@ class PushFile(GenericView):
             if len(remote_path) != 1:
                 return {'msg': 'POST data malformed: expected a single remote path when storing files'}, 400
 
-            storage = build_storage_path(*remote_path)
-            storage.parent.mkdir(parents=True, exist_ok=True)
-
-            with storage.open('wb') as f:
-                for chunk in uploaded_file.chunks():
-                    f.write(chunk)
-
+            digest = file_store.add(uploaded_file)
+            file_store.materialize(digest, build_storage_path(*remote_path))
             return None, 204
         else:
-            with tempfile.TemporaryDirectory() as folder:
-                storage = Path(folder, uploaded_file.name)
-
-                with storage.open('wb') as f:
-                    for chunk in uploaded_file.chunks():
-                        f.write(chunk)
-
-                return self.conductor_execute(
-                        command='push_file',
-                        address=address,
-                        local_path=[str(storage)] * len(remote_path),
-                        remote_path=remote_path,
-                        users=users, groups=groups)
+            digest = file_store.add(uploaded_file)
+            return self.conductor_execute(
+                    command='push_file',
+                    address=address,
+                    local_path=[str(file_store.blob_path(digest))] * len(remote_path),
+                    remote_path=remote_path,
+                    users=users, groups=groups,
+                    checksums=[digest] * len(remote_path))
 
 class DatabasesView(GenericView):
     def get(self, request):
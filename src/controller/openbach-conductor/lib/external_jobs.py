@@ -23,7 +23,38 @@
 # You should have received a copy of the GNU General Public License along with
 # this program. If not, see http://www.gnu.org/licenses/.
 
+
+"""Mirrors of the repositories providing jobs that are not
+installed on the controller.
+
+The jobs of each repository are retrieved at once, as a tarball, into
+a local mirror along with an index of their names, versions and
+keywords. Listing, searching and adding these jobs are then served
+from this mirror, which is refreshed once its index gets older than
+a configurable time to live.
+
+Repositories can also be populated from a local directory or tarball
+holding a copy of the repository (possibly wrapped in a single top-level
+folder, as the archives provided by GitHub are) by mapping their name
+to this path in the openbach_jobs_repositories variable.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
 import os
+import json
+import time
+import shutil
+import syslog
+import tarfile
+import tempfile
+import threading
+from pathlib import Path
 from contextlib import suppress
 from collections import namedtuple
 
@@ -31,6 +62,7 @@ import yaml
 import requests
 
 from . import errors
+from .job_index import JobIndex
 
 
 ProjectInfos = namedtuple('ProjectInfos', ['id', 'jobs_path', 'dest_dir'])
@@ -49,6 +81,12 @@ REPOSITORIES = {
 }
 
 
+GROUP_VARS = '/opt/openbach/controller/ansible/group_vars/all'
+MIRRORS_FOLDER = '/opt/openbach/controller/jobs_repositories/'
+INDEX_TTL = 3600
+REQUEST_TIMEOUT = 60
+
+
 def _build_headers():
     """Build base header dictionnary to communicate with the GitHub API"""
 
@@ -59,14 +97,21 @@ def _build_headers():
     return headers
 
 
-def _read_proxies(group_vars_file):
-    """Read proxy configuration from the provided Ansible :vars: file"""
+def _read_variables(group_vars_file):
+    """Read the variables defined in the provided Ansible :vars: file"""
+
+    try:
+        with open(group_vars_file, encoding='utf-8') as openbach_variables:
+            return yaml.safe_load(openbach_variables) or {}
+    except FileNotFoundError:
+        return {}
 
-    with open(group_vars_file, encoding='utf-8') as openbach_variables:
-        variables = yaml.safe_load(openbach_variables)
+
+def _read_proxies(variables):
+    """Extract proxy configuration from the provided Ansible variables"""
 
     proxies = {}
-    proxy_configuration = variables.get('openbach_proxy_env', {})
+    proxy_configuration = variables.get('openbach_proxy_env') or {}
     for protocol in ('http', 'https'):
         with suppress(KeyError):
             proxies[protocol] = proxy_configuration['{}_proxy'.format(protocol)]
@@ -74,8 +119,161 @@ def _read_proxies(group_vars_file):
     return proxies
 
 
-def list_jobs_properties(repository):
-    """Retrieve the names and versions of jobs store in the provided :repository:"""
+VARIABLES = _read_variables(GROUP_VARS)
+
+
+class JobRepository:
+    """Local mirror of the jobs of a repository"""
+
+    def __init__(self, name, project_info, source=None, ttl=INDEX_TTL, folder=MIRRORS_FOLDER):
+        self.name = name
+        self.project_info = project_info
+        self.source = source
+        self.ttl = ttl
+        self.folder = Path(folder, name)
+        self.lock = threading.Lock()
+        self._mirror = None
+
+    def _load(self):
+        """Read the index of the current generation of the mirror"""
+        try:
+            generation = (self.folder / 'current').resolve(strict=True)
+            with (generation / 'index.json').open(encoding='utf-8') as index:
+                content = json.load(index)
+        except (OSError, ValueError):
+            return None
+
+        jobs = {job['name']: job for job in content['jobs']}
+        index = JobIndex((name, job['keywords']) for name, job in jobs.items())
+        return [content['refreshed'], generation, jobs, index]
+
+    def lookup(self, update=False):
+        """Return the folder holding the mirrored files along with
+        the description of the jobs found in there and their index,
+        refreshing them beforehand if they are outdated.
+
+        Must be called with the lock held.
+        """
+        if self._mirror is None:
+            self._mirror = self._load()
+
+        if update or self._mirror is None or time.time() - self._mirror[0] > self.ttl:
+            try:
+                self._refresh()
+            except (OSError, ValueError, tarfile.TarError, yaml.YAMLError, requests.RequestException) as e:
+                if self._mirror is None:
+                    raise errors.ConductorError(
+                            'Unable to retrieve the jobs of the repository',
+                            repository=self.name, error_message=str(e))
+                syslog.syslog(
+                        syslog.LOG_WARNING,
+                        'Unable to refresh the jobs of the {} repository, '
+                        'using its outdated mirror: {}'.format(self.name, e))
+                # Do not try again on every lookup
+                self._mirror[0] = time.time()
+            else:
+                self._mirror = self._load()
+
+        _, generation, jobs, index = self._mirror
+        return generation / 'tree', jobs, index
+
+    def _refresh(self):
+        """Populate a new generation of the mirror and make it current"""
+        self.folder.mkdir(parents=True, exist_ok=True)
+        generation = Path(tempfile.mkdtemp(prefix='generation.', dir=str(self.folder)))
+        try:
+            tree = generation / 'tree'
+            if self.source is None:
+                response = _do_request(self.project_info.id, '/tarball/' + REF_NAME, stream=True)
+                with response, tarfile.open(fileobj=response.raw, mode='r|gz') as archive:
+                    self._extract(archive, tree)
+            elif os.path.isdir(self.source):
+                jobs_path = self.project_info.jobs_path
+                shutil.copytree(os.path.join(self.source, jobs_path), str(tree / jobs_path))
+            else:
+                with tarfile.open(self.source) as archive:
+                    self._extract(archive, tree)
+
+            index = {
+                    'refreshed': time.time(),
+                    'source': self.source or BASE_URL_TEMPLATE.format(self.project_info.id, ''),
+                    'jobs': list(self._scan(tree)),
+            }
+            with (generation / 'index.json').open('w', encoding='utf-8') as f:
+                json.dump(index, f)
+            generation.chmod(0o755)
+        except BaseException:
+            shutil.rmtree(str(generation), ignore_errors=True)
+            raise
+
+        link = self.folder / '.{}'.format(generation.name)
+        os.symlink(generation.name, str(link))
+        os.replace(str(link), str(self.folder / 'current'))
+        for previous in self.folder.glob('generation.*'):
+            if previous != generation:
+                shutil.rmtree(str(previous), ignore_errors=True)
+
+    def _extract(self, archive, tree):
+        """Extract the jobs stored in an archive of the repository"""
+        jobs_path = self.project_info.jobs_path
+        for member in archive:
+            parts = os.path.normpath(member.name).lstrip('/').split('/')
+            if '..' in parts:
+                continue
+            for path in ('/'.join(parts), '/'.join(parts[1:])):
+                if path.startswith(jobs_path):
+                    break
+            else:
+                continue
+
+            destination = tree / path
+            if member.isdir():
+                destination.mkdir(parents=True, exist_ok=True)
+            elif member.isfile():
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                with destination.open('wb') as f:
+                    shutil.copyfileobj(archive.extractfile(member), f)
+                destination.chmod(member.mode & 0o755 | 0o644)
+
+    def _scan(self, tree):
+        """Generate the description of the jobs found in the mirrored files"""
+        for root, _, filenames in os.walk(str(tree / self.project_info.jobs_path)):
+            if os.path.basename(root) != 'files':
+                continue
+
+            parent = os.path.dirname(root)
+            for filename in filenames:
+                name, ext = os.path.splitext(filename)
+                if ext != '.yml':
+                    continue
+                install = os.path.join(parent, 'install_{}.yml'.format(name))
+                uninstall = os.path.join(parent, 'uninstall_{}.yml'.format(name))
+                if not os.path.exists(install) or not os.path.exists(uninstall):
+                    continue
+
+                try:
+                    with open(os.path.join(root, filename), encoding='utf-8') as f:
+                        general = yaml.safe_load(f)['general']
+                    version = general['job_version']
+                    keywords = general.get('keywords') or []
+                except (yaml.YAMLError, UnicodeDecodeError, KeyError, TypeError):
+                    version, keywords = None, []
+
+                yield {
+                        'display': ' '.join(map(str.title, name.split('_'))),
+                        'name': name,
+                        'version': version,
+                        'keywords': list(map(str, keywords)),
+                        'path': os.path.relpath(parent, str(tree)),
+                }
+
+
+_REPOSITORIES = {}
+_REPOSITORIES_LOCK = threading.Lock()
+
+
+def _repository(repository):
+    """Retrieve the mirror of the provided :repository:"""
 
     try:
         project_info = REPOSITORIES[repository]
@@ -84,106 +282,52 @@ def list_jobs_properties(repository):
                 'The project does not exist in the repository',
                 project_name=repository)
 
-    files = {
-            f['path']: f['sha']
-            for f in _list_project_files(project_info.id, project_info.jobs_path)
-            if os.path.splitext(f['path'])[1] == '.yml'
-    }
+    with _REPOSITORIES_LOCK:
+        try:
+            return _REPOSITORIES[repository]
+        except KeyError:
+            sources = VARIABLES.get('openbach_jobs_repositories') or {}
+            ttl = VARIABLES.get('openbach_jobs_repositories_ttl', INDEX_TTL)
+            mirror = _REPOSITORIES[repository] = JobRepository(
+                    repository, project_info, sources.get(repository), ttl)
+            return mirror
+
+
+def list_jobs_properties(repository, string_to_search=None, ratio=60, update=False):
+    """Retrieve the names and versions of jobs store in the provided :repository:,
+    optionally limited to the ones whose name or keywords are similar to
+    :string_to_search:.
+    """
+
+    mirror = _repository(repository)
+    with mirror.lock:
+        _, jobs, index = mirror.lookup(update)
+    names = jobs if string_to_search is None else index.search(string_to_search, ratio)
 
     return [
-            {
-                'display': ' '.join(map(str.title, name.split('_'))),
-                'name': name,
-                'version': _fetch_version(project_info.id, sha),
-            } for name, sha in sorted(_filter_jobs(files))
+            {key: jobs[name][key] for key in ('display', 'name', 'version')}
+            for name in sorted(names)
     ]
 
 
 def add_job(name, repository, dest_dir='/opt/openbach/controller'):
     """Add a job from the given :repository: into the :dest_dir: folder of the controller"""
 
-    try:
-        project_info = REPOSITORIES[repository]
-    except KeyError:
-        raise errors.NotFoundError(
-                'The project does not exist in the repository',
-                project_name=repository)
-
-    yaml = '{}.yml'.format(name)
-    project_files = _list_project_files(project_info.id, project_info.jobs_path)
-    try:
-        file_blob = next(
-                f for f in project_files
-                if os.path.basename(f['path']) == yaml
-        )
-    except StopIteration:
-        return
-
-    dest_dir = os.path.join(dest_dir, project_info.dest_dir)
-    base_directory = os.path.dirname(os.path.dirname(file_blob['path']))
-    for blob in _list_project_files(project_info.id, base_directory):
-        destination = os.path.join(dest_dir, blob['path'])
-        _retrieve_file(project_info.id, blob['sha'], destination)
-
-    return os.path.join(dest_dir, base_directory)
-
-
-def _filter_jobs(files):
-    """Generate pairs of jobs names and their associated configuration
-    files from the whole list of :files: inside a repository.
-    """
-
-    for filename, sha in files.items():
-        folder, filename = os.path.split(filename)
-        job_name, _ = os.path.splitext(filename)
-        parent_folder, files_folder = os.path.split(folder)
-        if files_folder != 'files':
-            continue
-        install_filename = 'install_{}.yml'.format(job_name)
-        install = os.path.join(parent_folder, install_filename)
-        uninstall = os.path.join(parent_folder, 'un' + install_filename)
-        if install in files and uninstall in files:
-            yield job_name, sha
-
-
-def _fetch_raw_content(project_id, checksum):
-    """Fetch a file from the repository without wrapping it in a JSON response"""
-
-    return _do_request(project_id, '/git/blobs/' + checksum, 'application/vnd.github.v3.raw').content
-
-
-def _fetch_version(project_id, sha):
-    """Read a job's configuration file and return its version"""
-
-    content = _fetch_raw_content(project_id, sha)
-    try:
-        job = yaml.safe_load(content)
-        return job['general']['job_version']
-    except (yaml.error.YAMLError, KeyError):
-        return None
-
-
-def _retrieve_file(project_id, sha, dest_file):
-    """Download a file from the repository and write it at the provided destination"""
-
-    content = _fetch_raw_content(project_id, sha)
-
-    dest_folder = os.path.dirname(dest_file)
-    os.makedirs(dest_folder, exist_ok=True)
-
-    with open(dest_file, 'wb') as f:
-        f.write(content)
-
+    mirror = _repository(repository)
+    with mirror.lock:
+        tree, jobs, _ = mirror.lookup()
+        try:
+            job = jobs[name]
+        except KeyError:
+            return
 
-def _list_project_files(project_id, path):
-    """Generate all entries in the repository that correspond to a file under the given path"""
+        destination = os.path.join(dest_dir, mirror.project_info.dest_dir, job['path'])
+        shutil.copytree(str(tree / job['path']), destination, dirs_exist_ok=True)
 
-    reference = _do_request(project_id, '/git/ref/heads/' + REF_NAME).json()
-    tree = _do_request(project_id, '/git/trees/' + reference['object']['sha'], recursive=True).json()
-    yield from (entry for entry in tree['tree'] if entry['type'] == 'blob' and entry['path'].startswith(path))
+    return destination
 
 
-def _do_request(project_id, route, accept=None, recursive=False, *, base_headers=_build_headers(), proxies=_read_proxies('/opt/openbach/controller/ansible/group_vars/all'), session=requests.Session()):
+def _do_request(project_id, route, accept=None, recursive=False, stream=False, *, base_headers=_build_headers(), proxies=_read_proxies(VARIABLES), session=requests.Session()):
     """Hit an API endpoint and return the result"""
     params = {'recursive': 1} if recursive else None
 
@@ -191,6 +335,8 @@ def _do_request(project_id, route, accept=None, recursive=False, *, base_headers
             BASE_URL_TEMPLATE.format(project_id, route),
             params=params,
             proxies=proxies,
+            stream=stream,
+            timeout=REQUEST_TIMEOUT,
             headers=base_headers if accept is None else {**base_headers, 'Accept': accept})
     response.raise_for_status()
     return response
@@ -0,0 +1,358 @@
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Bulk retrieval of files stored on agents.
+
+Rather than running a playbook per file, files are grouped by agent
+and each group is transferred as a single tar stream over SSH, reusing
+the multiplexed connection that Ansible keeps opened to the agent when
+there is one. Agents are handled in parallel by a bounded pool of
+threads.
+
+The size and modification time of the requested files are retrieved
+first and files already present locally with the same values are not
+transferred again; retrieved files keep their remote modification
+time for this purpose. Failed steps are attempted again a few times
+before giving up, and local copies can be given to a specific owner.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import os
+import time
+import shlex
+import shutil
+import tarfile
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from contextlib import suppress
+from collections import namedtuple, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+
+MAX_PARALLEL_AGENTS = 8
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 5
+CHUNK_SIZE = 1024 * 1024
+# Same options and control path than the ones Ansible uses, see the
+# ansible.cfg of the configure_backend role, so its connections are reused
+SSH_OPTIONS = (
+        '-C', '-o', 'ControlMaster=auto', '-o', 'ControlPersist=10m',
+        '-o', 'ControlPath=~/.ansible/cp/%C', '-o', 'UserKnownHostsFile=/dev/null',
+        '-o', 'StrictHostKeyChecking=no', '-o', 'ConnectTimeout=5', '-o', 'BatchMode=yes',
+)
+
+
+FileTransfer = namedtuple(
+        'FileTransfer', 'address remote_path local_path remove user group',
+        defaults=(False, None, None))
+
+
+class FileTransferError(Exception):
+    """Files could not be retrieved from an agent"""
+
+
+class SSHTransport:
+    """Run shell commands on agents through SSH"""
+
+    def __init__(self, user='openbach', private_key='/home/openbach/.ssh/id_rsa', become=False):
+        self.user = user
+        self.private_key = private_key
+        self.become = become
+        with suppress(OSError):
+            Path('~/.ansible/cp').expanduser().mkdir(parents=True, exist_ok=True)
+
+    def command(self, address, remote_command):
+        """Build the command line running remote_command on the agent"""
+        if self.become:
+            remote_command = 'sudo -n sh -c {}'.format(shlex.quote(remote_command))
+        return ['ssh', *SSH_OPTIONS, '-i', self.private_key, '-l', self.user, address, remote_command]
+
+    def run(self, address, remote_command):
+        return subprocess.Popen(
+                self.command(address, remote_command),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+
+
+def _member_name(path):
+    """Name under which tar stores a file"""
+    return os.path.normpath(path).lstrip('/')
+
+
+def mirror_path(root, address, remote_path):
+    """Path of the local copy of a file of an agent
+    when mirroring agents files into root
+    """
+    return Path(root, address, _member_name(remote_path))
+
+
+def _null_separated(paths):
+    return b''.join(os.fsencode(path) + b'\0' for path in paths)
+
+
+def _communicate(process, data):
+    _, error = process.communicate(data)
+    return error.decode(errors='replace').strip()
+
+
+def _feed(process, data):
+    """Write data to the input of the process and drain its error
+    output in the background, so reading its output never blocks
+    on either pipe being full. Return the thread draining errors
+    and the list where they will be stored.
+    """
+    errors = []
+
+    def write():
+        try:
+            process.stdin.write(data)
+        except BrokenPipeError:
+            pass
+        finally:
+            with suppress(BrokenPipeError):
+                process.stdin.close()
+
+    def drain():
+        errors.append(process.stderr.read().decode(errors='replace').strip())
+
+    threading.Thread(target=write, daemon=True).start()
+    drainer = threading.Thread(target=drain, daemon=True)
+    drainer.start()
+    return drainer, errors
+
+
+class AgentFiles:
+    """Files to retrieve from a single agent"""
+
+    def __init__(self, address, transport, attempts=MAX_ATTEMPTS, delay=RETRY_DELAY):
+        self.address = address
+        self.transport = transport
+        self.attempts = attempts
+        self.delay = delay
+        self.destinations = defaultdict(list)
+        self.owners = {}
+        self.removes = set()
+
+    def add(self, transfer):
+        destination = Path(transfer.local_path)
+        self.destinations[transfer.remote_path].append(destination)
+        if transfer.user or transfer.group:
+            # Same defaults than the fetch module of Ansible
+            self.owners[destination] = (transfer.user, transfer.group or transfer.user)
+        if transfer.remove:
+            self.removes.add(transfer.remote_path)
+
+    def _attempt(self, function, *args):
+        """Call function until it succeeds, at most self.attempts times"""
+        for _ in range(self.attempts - 1):
+            try:
+                return function(*args)
+            except (OSError, tarfile.TarError, FileTransferError):
+                time.sleep(self.delay)
+        return function(*args)
+
+    def _remote_stats(self):
+        """Retrieve the size and modification time of the requested files"""
+        process = self.transport.run(
+                self.address, "xargs -0 stat -L --printf '%s %Y %n\\0' --")
+        output, error = process.communicate(_null_separated(self.destinations))
+        if process.returncode not in (0, 123):
+            # xargs exits with 123 when stat failed for some files only
+            raise FileTransferError('cannot list files: {}'.format(error.decode(errors='replace').strip()))
+
+        stats = {}
+        for line in output.split(b'\0'):
+            if line:
+                size, mtime, name = line.split(b' ', 2)
+                stats[os.fsdecode(name)] = int(size), int(mtime)
+        return stats
+
+    @staticmethod
+    def _is_up_to_date(path, size, mtime):
+        try:
+            stat = path.stat()
+        except OSError:
+            return False
+        return stat.st_size == size and int(stat.st_mtime) == mtime
+
+    def _transfer(self, remote_paths):
+        """Retrieve the given files as a single tar stream"""
+        destinations = {
+                _member_name(remote_path): self.destinations[remote_path]
+                for remote_path in remote_paths
+        }
+        process = self.transport.run(self.address, 'tar -chf - --null -T -')
+        drainer, errors = _feed(process, _null_separated(remote_paths))
+
+        transferred = set()
+        try:
+            with tarfile.open(fileobj=process.stdout, mode='r|') as archive:
+                for member in archive:
+                    name = os.path.normpath(member.name)
+                    if not member.isfile() or name not in destinations:
+                        continue
+                    first, *others = destinations[name]
+                    _write(archive.extractfile(member), first, member.mtime)
+                    for destination in others:
+                        _duplicate(first, destination)
+                    transferred.add(name)
+        except tarfile.ReadError:
+            # Nothing could be archived at all
+            pass
+        finally:
+            process.stdout.close()
+
+        drainer.join()
+        if process.wait() not in (0, 1) and not transferred:
+            # GNU tar exits with 1 when some files changed while being read
+            raise FileTransferError('cannot retrieve files: {}'.format(*errors))
+        return [path for path in remote_paths if _member_name(path) in transferred]
+
+    def _remove(self, remote_paths):
+        process = self.transport.run(self.address, 'xargs -0 rm -f --')
+        error = _communicate(process, _null_separated(remote_paths))
+        if process.returncode:
+            raise FileTransferError('cannot remove files: {}'.format(error))
+
+    def retrieve(self):
+        """Retrieve the files that are not already present locally
+        and return a report of the transfer.
+        """
+        stats = self._attempt(self._remote_stats)
+        missing = [path for path in self.destinations if path not in stats]
+        outdated = []
+        skipped = 0
+        for remote_path, (size, mtime) in stats.items():
+            for destination in self.destinations[remote_path]:
+                if not self._is_up_to_date(destination, size, mtime):
+                    outdated.append(remote_path)
+                    break
+            else:
+                skipped += 1
+
+        transferred = []
+        remaining = outdated
+        for attempt in range(self.attempts):
+            if not remaining:
+                break
+            if attempt:
+                time.sleep(self.delay)
+            try:
+                transferred.extend(self._transfer(remaining))
+            except (OSError, tarfile.TarError, FileTransferError):
+                if attempt + 1 == self.attempts:
+                    raise
+            remaining = [path for path in outdated if path not in transferred]
+        missing.extend(remaining)
+
+        retrieved = set(stats).difference(missing)
+        self._chown(retrieved)
+        removes = [path for path in self.removes if path in retrieved]
+        if removes:
+            self._attempt(self._remove, removes)
+
+        return {'transferred': len(transferred), 'skipped': skipped, 'missing': missing}
+
+
+    def _chown(self, remote_paths):
+        """Give the local copies of the given files to their owners"""
+        for remote_path in remote_paths:
+            for destination in self.destinations[remote_path]:
+                owner = self.owners.get(destination)
+                if owner is not None:
+                    try:
+                        shutil.chown(str(destination), *owner)
+                    except (OSError, LookupError) as e:
+                        raise FileTransferError('cannot change owner of {}: {}'.format(destination, e))
+
+
+def _temporary_file(destination):
+    """Open a new file next to destination so
+    it can atomically be moved over it
+    """
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    return tempfile.NamedTemporaryFile(
+            dir=str(destination.parent),
+            prefix='.{}.'.format(destination.name),
+            delete=False)
+
+
+def _write(source, destination, mtime):
+    with _temporary_file(destination) as f:
+        shutil.copyfileobj(source, f, CHUNK_SIZE)
+    os.chmod(f.name, 0o644)
+    os.utime(f.name, (mtime, mtime))
+    os.replace(f.name, str(destination))
+
+
+def _duplicate(source, destination):
+    with _temporary_file(destination) as f:
+        pass
+    shutil.copy2(str(source), f.name)
+    os.replace(f.name, str(destination))
+
+
+def retrieve_files(
+        transfers, transport=None, max_parallel=MAX_PARALLEL_AGENTS,
+        attempts=MAX_ATTEMPTS, delay=RETRY_DELAY):
+    """Retrieve the files described by the FileTransfer in transfers,
+    grouped by agent, and return a report of the transfer for each
+    agent: either the amount of files transferred and skipped with the
+    list of remote paths that could not be found, or the error that
+    prevented the transfer. Each step of a transfer is attempted up to
+    attempts times, waiting delay seconds in between.
+    """
+    if transport is None:
+        transport = SSHTransport()
+
+    agents = {}
+    for transfer in transfers:
+        try:
+            agent = agents[transfer.address]
+        except KeyError:
+            agent = agents[transfer.address] = AgentFiles(transfer.address, transport, attempts, delay)
+        agent.add(transfer)
+
+    if not agents:
+        return {}
+
+    def retrieve(agent):
+        try:
+            return agent.retrieve()
+        except (OSError, tarfile.TarError, FileTransferError) as e:
+            return {'error': str(e)}
+
+    with ThreadPoolExecutor(max_workers=min(max_parallel, len(agents))) as executor:
+        return dict(zip(agents, executor.map(retrieve, agents.values())))
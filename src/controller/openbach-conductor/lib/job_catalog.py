@@ -0,0 +1,164 @@
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Incremental reading of the description files of the jobs.
+
+A manifest maps the path of each description file read so far to its
+modification time, size and SHA-256, along with its parsed content.
+Files whose modification time and size did not change are not read
+again, and files whose content did not change are not parsed again.
+
+The SHA-256 of a job is also stored in the database when the job is
+registered, so jobs whose description did not change since then do
+not need to be registered again.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import os
+import json
+import copy
+import hashlib
+import tempfile
+import threading
+from contextlib import suppress
+
+import yaml
+
+
+MANIFEST = '/opt/openbach/controller/jobs_manifest.json'
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _read(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+class JobCatalog:
+    """Cache of the parsed description files of the jobs,
+    backed by a manifest file.
+    """
+
+    def __init__(self, manifest=MANIFEST):
+        self.manifest = manifest
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.parsed = 0
+        try:
+            with open(manifest, encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def describe(self, config_file, help_file):
+        """Return the SHA-256 of the description of a job as well
+        as its parsed configuration and its help, if any.
+
+        Raise FileNotFoundError if the configuration file does
+        not exist and yaml.YAMLError if it can not be parsed.
+        """
+        stats = [_stat(config_file), _stat(help_file)]
+        if stats[0] is None:
+            raise FileNotFoundError(config_file)
+
+        with self._lock:
+            entry = self._entries.get(config_file)
+        if entry is None or entry['stats'] != stats or entry['help_file'] != help_file:
+            config, help_content = _read(config_file), _read(help_file)
+            if config is None:
+                raise FileNotFoundError(config_file)
+            digest = hashlib.sha256(config)
+            if help_content is not None:
+                digest.update(b'\0')
+                digest.update(help_content)
+            checksum = digest.hexdigest()
+
+            if entry is None or entry['checksum'] != checksum:
+                entry = {
+                        'checksum': checksum,
+                        'content': yaml.safe_load(config.decode('utf-8')),
+                        'help': None if help_content is None else help_content.decode('utf-8'),
+                }
+                self.parsed += 1
+            entry = dict(entry, stats=stats, help_file=help_file)
+            with self._lock:
+                self._entries[config_file] = entry
+                self._dirty = True
+
+        # Callers are free to alter the content
+        return entry['checksum'], copy.deepcopy(entry['content']), entry['help']
+
+    def save(self):
+        """Write the manifest back if it changed.
+
+        Entries whose content can not be written as JSON (e.g. dates
+        parsed from YAML) are left out and parsed again next time.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = {}
+            for path, entry in self._entries.items():
+                with suppress(TypeError, ValueError):
+                    entries[path] = json.dumps(entry)
+            manifest = '{{{}}}'.format(', '.join(
+                '{}: {}'.format(json.dumps(path), entry)
+                for path, entry in entries.items()))
+
+            try:
+                f = tempfile.NamedTemporaryFile(
+                        'w', encoding='utf-8', delete=False,
+                        dir=os.path.dirname(self.manifest))
+            except OSError:
+                return
+            try:
+                with f:
+                    f.write(manifest)
+                os.replace(f.name, self.manifest)
+            except OSError:
+                with suppress(OSError):
+                    os.remove(f.name)
+            else:
+                self._dirty = False
+
+
+JOBS_CATALOG = JobCatalog()
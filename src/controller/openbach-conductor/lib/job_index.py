@@ -0,0 +1,157 @@
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Search of jobs by their names and keywords.
+
+The words of the names of the jobs and their keywords are scored
+against the searched text using the same "token set ratio" than the
+fuzzywuzzy package did, with the ratio of python-Levenshtein: each
+string is lowercased and split into a set of tokens; strings made of
+their common tokens, optionally followed by the remaining ones, are
+then compared two by two and the best ratio is kept.
+
+The ratio of two strings is 2 * M / T as a percentage, where T is
+their total length and M the length of their longest common
+subsequence; that is the Levenshtein distance where a substitution
+costs 2, normalised to their total length. The longest common
+subsequence is computed with the bit-parallel algorithm of Hyyrö and
+upper bounds are checked beforehand, so that scoring every word of
+every job stays cheap.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import re
+from collections import defaultdict, Counter
+
+
+DELIMITERS = re.compile(r'\W|_')
+NON_ALPHANUMERIC = re.compile(r'(?ui)\W')
+NON_ASCII = {code: None for code in range(128, 256)}
+
+
+def tokens(text):
+    """Set of the lowercase tokens of a text, the way fuzzywuzzy
+    prepared its strings before comparing them.
+    """
+    text = str(text).translate(NON_ASCII)
+    return frozenset(NON_ALPHANUMERIC.sub(' ', text).lower().split())
+
+
+def _lcs_length(first, second):
+    """Length of the longest common subsequence of two strings"""
+    masks = defaultdict(int)
+    for position, character in enumerate(first):
+        masks[character] |= 1 << position
+    full = (1 << len(first)) - 1
+    vector = full
+    for character in second:
+        matches = vector & masks[character]
+        vector = ((vector + matches) | (vector - matches)) & full
+    return len(first) - bin(vector).count('1')
+
+
+def ratio(first, second):
+    """Similarity of two strings, as a percentage"""
+    if first == second:
+        return 100
+    total = len(first) + len(second)
+    if not first or not second:
+        return 0
+    return int(round(200 * _lcs_length(first, second) / total))
+
+
+def _reaches(first, second, threshold):
+    """Tell whether the ratio of two strings reaches the threshold,
+    checking upper bounds of their common subsequence first.
+    """
+    if first == second:
+        return 100 >= threshold
+    if not first or not second:
+        return False
+    total = len(first) + len(second)
+    if round(200 * min(len(first), len(second)) / total) < threshold:
+        return False
+    common = sum((Counter(first) & Counter(second)).values())
+    if round(200 * common / total) < threshold:
+        return False
+    return round(200 * _lcs_length(first, second) / total) >= threshold
+
+
+def _token_set_strings(first, second):
+    intersection = ' '.join(sorted(first & second))
+    first_only = ' '.join(sorted(first - second))
+    second_only = ' '.join(sorted(second - first))
+    return (
+            intersection,
+            '{} {}'.format(intersection, first_only).strip(),
+            '{} {}'.format(intersection, second_only).strip(),
+    )
+
+
+def token_set_ratio(first, second):
+    """Similarity of the sets of tokens of two texts, as a percentage"""
+    first, second = tokens(first), tokens(second)
+    if not first or not second:
+        return 0
+    intersection, first, second = _token_set_strings(first, second)
+    return max(ratio(intersection, first), ratio(intersection, second), ratio(first, second))
+
+
+class JobIndex:
+    """Words describing a set of jobs and the jobs they describe"""
+
+    def __init__(self, jobs=()):
+        self._jobs = defaultdict(set)
+        for name, keywords in jobs:
+            self.add(name, keywords)
+
+    def add(self, name, keywords):
+        """Index a job under the words of its name and under its keywords"""
+        for word in (*DELIMITERS.split(name), *keywords):
+            self._jobs[tokens(word)].add(name)
+
+    def search(self, text, ratio=60):
+        """Return the names of the jobs having a word or a keyword
+        whose token set ratio with the given text is at least ratio.
+        """
+        searched = tokens(text)
+        found = set()
+        if not searched:
+            return found
+        for word, names in self._jobs.items():
+            if not word or names <= found:
+                continue
+            pairs = _token_set_strings(word, searched)
+            if any(_reaches(a, b, ratio) for a, b in (
+                    (pairs[0], pairs[1]), (pairs[0], pairs[2]), (pairs[1], pairs[2]))):
+                found.update(names)
+        return found
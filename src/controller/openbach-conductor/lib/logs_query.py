@@ -0,0 +1,234 @@
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+
+"""Bulk retrieval of the logs stored in the ElasticSearch of collectors.
+
+Rather than issuing one search per job instance, the instances that
+actually produced logs are first found using a single `composite`
+aggregation and their logs are then fetched by batches of searches
+sent through the `_msearch` API. Every listing is sorted on a unique
+key and paged using `search_after` so arbitrarily large results are
+streamed page by page instead of being loaded at once.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import json
+import queue
+import threading
+from collections import deque
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+
+INDEX = 'logstash-*'
+SORT = [{'@timestamp': 'asc'}, {'_id': 'asc'}]
+FIELDS = ['severity', 'severity_label', 'logsource', 'message', 'job_instance_id']
+
+
+class LogsQueryError(Exception):
+    """ElasticSearch could not be reached or refused a query"""
+
+
+class LogsQuery:
+    """Query the logs of a single collector"""
+
+    def __init__(self, address, port, credentials=None, page_size=1000, batch_size=100, timeout=30):
+        self.url = 'http://{}:{}/'.format(address, port)
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.headers = {}
+        if credentials:
+            # Credentials are already encoded by the backend
+            self.headers['Authorization'] = 'Basic {}'.format(credentials)
+
+    def _post(self, route, *bodies):
+        if len(bodies) == 1:
+            content_type = 'application/json'
+            data = json.dumps(bodies[0])
+        else:
+            content_type = 'application/x-ndjson'
+            data = ''.join(json.dumps(body) + '\n' for body in bodies)
+
+        request = Request(
+                self.url + route, data.encode(), method='POST',
+                headers=dict(self.headers, **{'Content-Type': content_type}))
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read().decode())
+        except HTTPError as e:
+            raise LogsQueryError('{} {}: {}'.format(e.code, e.reason, e.read().decode(errors='replace')))
+        except (OSError, ValueError) as e:
+            raise LogsQueryError(str(e))
+
+    def _search(self, search_after=None, **query):
+        body = {
+                'size': self.page_size,
+                'query': {'bool': query},
+                'sort': SORT,
+                '_source': FIELDS,
+        }
+        if search_after is not None:
+            body['search_after'] = search_after
+        return body
+
+    @staticmethod
+    def _filters(level, timestamps):
+        filters = [{'range': {'severity': {'lte': level}}}]
+        if timestamps is not None:
+            start, stop = timestamps
+            filters.append({'range': {'@timestamp': {'gte': start, 'lte': stop, 'format': 'epoch_millis'}}})
+        return filters
+
+    def orphans(self, level=7, timestamps=None):
+        """Iterate over the logs, of severity at most level, that
+        do not relate to a job instance.
+
+        Timestamps, if provided, is a (start, stop) pair of
+        timestamps in milliseconds to restrict the search to.
+        """
+        query = {
+                'filter': self._filters(level, timestamps),
+                'must_not': [{'exists': {'field': 'job_instance_id'}}],
+        }
+        search_after = None
+        while True:
+            body = self._search(search_after, **query)
+            hits = self._post(INDEX + '/_search', body)['hits']['hits']
+            yield from hits
+            if len(hits) < self.page_size:
+                return
+            search_after = hits[-1]['sort']
+
+    def count_by_instance(self, job_instances, level=7, timestamps=None):
+        """Return the amount of logs of each of the given job
+        instances that produced logs.
+        """
+        filters = self._filters(level, timestamps)
+        filters.append({'terms': {'job_instance_id': list(job_instances)}})
+        aggregation = {
+                'size': self.page_size,
+                'sources': [{'job_instance_id': {'terms': {'field': 'job_instance_id'}}}],
+        }
+        body = {
+                'size': 0,
+                'query': {'bool': {'filter': filters}},
+                'aggs': {'instances': {'composite': aggregation}},
+        }
+
+        counts = {}
+        while True:
+            response = self._post(INDEX + '/_search', body)
+            instances = response['aggregations']['instances']
+            buckets = instances['buckets']
+            for bucket in buckets:
+                counts[bucket['key']['job_instance_id']] = bucket['doc_count']
+            if len(buckets) < self.page_size:
+                return counts
+            aggregation['after'] = instances.get('after_key', buckets[-1]['key'])
+
+    def instances_logs(self, job_instances, level=7, timestamps=None):
+        """Iterate over the logs, of severity at most level,
+        of the given job instances.
+        """
+        filters = self._filters(level, timestamps)
+        counts = self.count_by_instance(job_instances, level, timestamps)
+        pending = deque((job_instance, None) for job_instance in sorted(counts))
+        header = {'index': INDEX}
+
+        while pending:
+            batch = [pending.popleft() for _ in range(min(self.batch_size, len(pending)))]
+            searches = []
+            for job_instance, search_after in batch:
+                query = {'filter': filters + [{'term': {'job_instance_id': job_instance}}]}
+                searches.append(header)
+                searches.append(self._search(search_after, **query))
+
+            responses = self._post('_msearch', *searches)['responses']
+            for (job_instance, _), response in zip(batch, responses):
+                if 'error' in response:
+                    raise LogsQueryError(json.dumps(response['error']))
+                hits = response['hits']['hits']
+                yield from hits
+                if len(hits) == self.page_size:
+                    # Only instances with more logs to
+                    # retrieve need a subsequent search
+                    pending.append((job_instance, hits[-1]['sort']))
+
+
+def iterate_in_parallel(function, arguments, on_error=None, buffer_size=10000):
+    """Iterate over the items produced by calling the generator
+    function on each argument, each of them running in its own
+    thread. Items are yielded as soon as they are available.
+
+    Exceptions raised by a generator are given to on_error,
+    along with its argument, and stop this generator only.
+    """
+    results = queue.Queue(maxsize=buffer_size)
+    stopped = threading.Event()
+    done = object()
+
+    def publish(item):
+        # Do not block forever if the consumer went away
+        while not stopped.is_set():
+            try:
+                results.put(item, timeout=1)
+            except queue.Full:
+                continue
+            return True
+        return False
+
+    def worker(argument):
+        try:
+            for item in function(argument):
+                if not publish(item):
+                    return
+        except Exception as e:
+            if on_error is not None:
+                on_error(argument, e)
+        finally:
+            publish(done)
+
+    workers = [threading.Thread(target=worker, args=(argument,), daemon=True) for argument in arguments]
+    for thread in workers:
+        thread.start()
+
+    running = len(workers)
+    try:
+        while running:
+            item = results.get()
+            if item is done:
+                running -= 1
+            else:
+                yield item
+    finally:
+        stopped.set()
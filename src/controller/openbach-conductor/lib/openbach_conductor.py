@@ -46,12 +46,10 @@ __credits__ = '''Contributors:
 
 
 import os
-import re
 import csv
 import shutil
 import syslog
 import tarfile
-import operator
 import tempfile
 import threading
 import itertools
@@ -67,9 +65,9 @@ from collections import defaultdict, Counter
 
 import yaml
 import numpy
-from fuzzywuzzy import fuzz
 from pkg_resources import parse_version as version
 from django import db
+from django.conf import settings
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User, AnonymousUser
@@ -88,18 +86,30 @@ from openbach_django.models import (
         InstalledJobCommandResult, JobInstance,
         JobInstanceCommandResult, StatisticInstance,
         ScenarioInstance, OpenbachFunctionInstance,
+        ScenarioInstanceSummary,
         Scenario, Project, FileCommandResult,
-        ScenarioArgument, ScenarioArgumentValue,
+        ScenarioArgument, ScenarioArgumentValue, ResourceVersion,
         StartJobInstance as OpenbachFunctionStartJobInstance,
         StartScenarioInstance as OpenbachFunctionStartScenarioInstance,
 )
 from openbach_django.utils import user_to_json
+from openbach_django import connections
+from openbach_django.connections import database_boundary
+from openbach_django.serializers import ScenarioInstancesSerializer
 from . import errors, external_jobs
 from .playbook_builder import start_playbook
+from .file_transfer import FileTransfer, SSHTransport, retrieve_files, mirror_path
+from .job_catalog import JOBS_CATALOG
+from .job_index import JobIndex
+from .logs_query import LogsQuery, iterate_in_parallel
+from .utils import StreamedList
+from .statistics_query import StatisticsQuery, InfluxDBQueryError, RESULTS_CACHE, compute_rollups
 from .openbach_communicator import OpenBachBaton, OpenBachClapperBoard
 
 
 TOPOLOGY_WORKERS = 10
+# Local copies of the files generated on agents, kept to speed up later exports
+GENERATED_FILES_MIRROR = '/opt/openbach/controller/agents_files/'
 _SEVERITY_MAPPING = {
     1: 3,   # Error
     2: 4,   # Warning
@@ -269,7 +279,7 @@ class ThreadedAction(ConductorAction):
     def action(self):
         """Public entry point to execute the required action"""
         real_action = super().action
-        thread = threading.Thread(target=self._threaded_action, args=(real_action,))
+        thread = threading.Thread(target=database_boundary(self._threaded_action), args=(real_action,))
         thread.start()
         return {}, 202
 
@@ -997,42 +1007,45 @@ class AddJob(JobAction):
 
     @require_connected_user(admin=True)
     def _action(self):
+        try:
+            self._register(JOBS_CATALOG)
+        finally:
+            JOBS_CATALOG.save()
+        return InfosJob(self.name).action()
+
+    def _register(self, catalog):
+        """Store the Job into the database unless it is already
+        stored with the same description; return whether it was.
+        """
         config_prefix = os.path.join(self.path, 'files', self.name)
         config_file = '{}.yml'.format(config_prefix)
         config_help = '{}.help'.format(config_prefix)
         try:
-            stream = open(config_file, encoding='utf-8')
+            checksum, content, help_content = catalog.describe(config_file, config_help)
         except FileNotFoundError:
             raise errors.BadRequestError(
                     'The configuration file of the Job is not present',
                     job_name=self.name,
                     configuration_file=config_file)
-        with stream:
-            try:
-                content = yaml.safe_load(stream)
-            except yaml.YAMLError as err:
-                raise errors.BadRequestError(
-                        'The configuration file of the Job does not '
-                        'contain valid YAML data',
-                        job_name=self.name, error_message=str(err),
-                        configuration_file=config_file)
+        except (yaml.YAMLError, UnicodeDecodeError) as err:
+            raise errors.BadRequestError(
+                    'The configuration file of the Job does not '
+                    'contain valid YAML data',
+                    job_name=self.name, error_message=str(err),
+                    configuration_file=config_file)
 
-        # Load the help file
-        try:
-            with open(config_help, encoding='utf-8') as stream:
-                help_content = stream.read()
-        except OSError:
-            help_content = None
+        if Job.objects.filter(name=self.name, path=self.path, checksum=checksum).exists():
+            return False
 
         try:
             with db.transaction.atomic():
-                self._update_job(content, help_content)
+                self._update_job(content, help_content, checksum)
         except KeyError as err:
             raise errors.BadRequestError(
                     'The configuration file of the Job is missing an entry',
                     entry_name=str(err), job_name=self.name,
                     configuration_file=config_file)
-        except (TypeError, db.utils.DataError) as err:
+        except (TypeError, ValueError, db.utils.DataError) as err:
             raise errors.BadRequestError(
                     'The configuration file of the Job contains entries '
                     'whose values are not of the required type',
@@ -1045,9 +1058,9 @@ class AddJob(JobAction):
                     job_name=self.name, error_message=str(err),
                     configuration_file=config_file)
 
-        return InfosJob(self.name).action()
+        return True
 
-    def _update_job(self, content, help_content):
+    def _update_job(self, content, help_content, checksum=None):
         """Update the values stored for a job based on its JSON"""
 
         general_section = content['general']
@@ -1061,80 +1074,60 @@ class AddJob(JobAction):
         job.job_version = general_section['job_version']
         job.persistent = general_section['persistent']
         job.has_uncertain_required_arg = False
+        job.checksum = checksum
         job.save()
 
-        system_list = {}
-
-        # Associate OSes
-        os_commands = content['platform_configuration']
-        for os_description in os_commands:
-            os_system = os_description['ansible_system']
-            os_distribution = os_description['ansible_distribution']
-            os_distribution_version = os_description['ansible_distribution_version']
-            command = os_description['command']
-            command_stop = os_description.get('command_stop')
-            system_list.setdefault(os_system, {}).setdefault(os_distribution, []).append(os_distribution_version)
-            os_command, _ = OsCommand.objects.get_or_create(
-                    job=job, family=os_system, distribution=os_distribution,
-                    version=os_distribution_version,
-                    defaults={
-                        'command': command,
-                        'command_stop': command_stop,
-                    })
-            os_command.command = command
-            os_command.command_stop = command_stop
-            os_command.save()
-        # Remove OSes associated to the previous version of the job
-        for system, system_info in system_list.items():
-            for distribution, versions in system_info.items():
-                job.os.filter(family=os_system, distribution=os_distribution).exclude(version__in=versions).delete()
-
-        # Associate "new" keywords
-        keywords = general_section['keywords']
-        for keyword in keywords:
-            job_keyword, _ = Keyword.objects.get_or_create(name=keyword)
-            job.keywords.add(job_keyword)
-        # Remove keywords associated to the previous version of the job
-        job.keywords.set(Keyword.objects.filter(
-                jobs__name__exact=self.name,
-                name__in=keywords))
-
-        # Associate "new" statistics
+        # Associate OSes and remove the ones of the previous version of the job
+        self._synchronize(job, job.os, ('family', 'distribution', 'version'), {
+            (
+                os_description['ansible_system'],
+                os_description['ansible_distribution'],
+                os_description['ansible_distribution_version'],
+            ): {
+                'command': os_description['command'],
+                'command_stop': os_description.get('command_stop'),
+            }
+            for os_description in content['platform_configuration']
+        })
+
+        # Associate keywords and remove the ones of the previous version of the job
+        keywords = list(dict.fromkeys(general_section['keywords']))
+        Keyword.objects.bulk_create([Keyword(name=keyword) for keyword in keywords], ignore_conflicts=True)
+        job.keywords.set(keywords)
+
+        # Associate statistics and remove the ones of the previous version of the job
         statistics = content.get('statistics')
         # No EAFP here to support entry with empty content
-        if statistics is not None:
-            for statistic in statistics:
-                stat, _ = Statistic.objects.get_or_create(
-                        name=statistic['name'], job=job)
-                stat.description = statistic['description']
-                stat.frequency = statistic['frequency']
-                stat.save()
-            stats_names = {stat['name'] for stat in statistics}
-        else:
-            stats_names = set()
-        # Remove statistics associated to the previous version of the job
-        job.statistics.exclude(name__in=stats_names).delete()
+        self._synchronize(job, job.statistics, ('name',), {
+            (statistic['name'],): {
+                'description': statistic['description'],
+                'frequency': statistic['frequency'],
+            }
+            for statistic in statistics or ()
+        })
 
         # Associate "new" arguments
         job.subcommands.all().delete()
+        choices = []
         self._populate_arguments(
                 job.subcommands.create(group=None, name=None),
-                content.get('arguments', {}), job)
+                content.get('arguments', {}), job, choices)
+        ArgumentChoice.objects.bulk_create(choices)
 
         # Check constraints on arguments counts
-        for subcommand in job.subcommands.all():
-            required = subcommand.arguments.filter(requiredjobargument__isnull=False)
-            if required.filter(count_upper__isnull=True).count() > 1:
+        unbounded = RequiredJobArgument.objects.filter(subcommand__job=job, count_upper__isnull=True)
+        for subcommand, amount in Counter(unbounded.values_list('subcommand', flat=True)).items():
+            if amount > 1:
                 raise errors.BadRequestError(
                         'A Job can only have one required argument with '
                         'an infinite amount of values per subcommand',
-                        job_name=self.name, arguments=list(map(str, required.filter(count_upper__isnull=True))))
+                        job_name=self.name, arguments=list(map(str, unbounded.filter(subcommand=subcommand))))
 
         if created:
             return
 
         # If the job existed already, uninstall on agents if necessary
-        for installed_job in InstalledJob.objects.filter(job=job):
+        for installed_job in InstalledJob.objects.filter(job=job).select_related('agent'):
             installed_version = version(installed_job.job_version)
             current_version = version(job.job_version)
             # In case of rollback or major update, uninstall the Job
@@ -1143,14 +1136,39 @@ class AddJob(JobAction):
                 self.share_user(uninstaller)
                 uninstaller.action()
 
-    def _populate_arguments(self, subcommand, arguments, job):
+    @staticmethod
+    def _synchronize(job, related, keys, values):
+        """Make the objects of the related manager of a job match values,
+        a mapping between the tuple of their keys fields and the
+        dictionary of their other fields, in a few queries.
+        """
+        existing = {tuple(getattr(obj, key) for key in keys): obj for obj in related.all()}
+        created, updated = [], []
+        for identifier, fields in values.items():
+            try:
+                obj = existing.pop(identifier)
+            except KeyError:
+                created.append(related.model(job=job, **dict(zip(keys, identifier)), **fields))
+            else:
+                if any(getattr(obj, field) != value for field, value in fields.items()):
+                    for field, value in fields.items():
+                        setattr(obj, field, value)
+                    updated.append(obj)
+
+        related.filter(pk__in=[obj.pk for obj in existing.values()]).delete()
+        related.model.objects.bulk_create(created)
+        if updated:
+            related.model.objects.bulk_update(updated, list(fields))
+
+    def _populate_arguments(self, subcommand, arguments, job, choices):
         required = arguments.get('required')
         if required is not None:
             for rank, argument in enumerate(required):
                 arg = RequiredJobArgument.objects.create(
                         subcommand=subcommand,
-                        rank=rank, name=argument['name'])
-                self._populate_argument(arg, argument)
+                        rank=rank, name=argument['name'],
+                        **self._argument_fields(argument))
+                choices.extend(ArgumentChoice(argument=arg, value=choice) for choice in argument.get('choices', []))
 
         optional = arguments.get('optional')
         if optional is not None:
@@ -1158,8 +1176,9 @@ class AddJob(JobAction):
                 arg = OptionalJobArgument.objects.create(
                         subcommand=subcommand,
                         flag=argument['flag'], name=argument['name'],
-                        repeatable=argument.get('repeatable', False))
-                self._populate_argument(arg, argument)
+                        repeatable=argument.get('repeatable', False),
+                        **self._argument_fields(argument))
+                choices.extend(ArgumentChoice(argument=arg, value=choice) for choice in argument.get('choices', []))
 
         subcommands = arguments.get('subcommand')
         if subcommands is not None:
@@ -1174,17 +1193,54 @@ class AddJob(JobAction):
                         name = sub_argument['name']
                         self._populate_arguments(
                             job.subcommands.create(name=name, group=group_argument),
-                            sub_argument, job)
+                            sub_argument, job, choices)
 
-    def _populate_argument(self, argument, content):
-        argument.type = content['type']
-        argument.count_str = content['count']
-        argument.description = content.get('description')
-        argument.password = content.get('password', False)
-        argument.default = content.get('default')
-        for choice in content.get('choices', []):
-            ArgumentChoice.objects.create(argument=argument, value=choice)
-        argument.save()
+    @staticmethod
+    def _argument_fields(content):
+        return {
+                'type': content['type'],
+                'count': content['count'],
+                'description': content.get('description'),
+                'password': content.get('password', False),
+                'default': content.get('default'),
+        }
+
+
+class AddJobs(JobAction):
+    """Action responsible to add several Jobs whose files are on
+    the Controller's filesystem into the database, skipping the
+    ones whose description did not change since they were added.
+    """
+
+    def __init__(self, jobs):
+        super().__init__(jobs=jobs)
+
+    @require_connected_user(admin=True)
+    def _action(self):
+        added, unchanged, failed = [], [], {}
+        try:
+            for job in self.jobs:
+                try:
+                    name, path = job['name'], job['path']
+                except (KeyError, TypeError):
+                    raise errors.BadRequestError(
+                            'Jobs should be described by their name and path',
+                            job=job)
+                add_job_action = AddJob(name, path)
+                self.share_user(add_job_action)
+                try:
+                    registered = add_job_action._register(JOBS_CATALOG)
+                except errors.ConductorError as e:
+                    failed[name] = e.json['response']
+                else:
+                    (added if registered else unchanged).append(name)
+        finally:
+            JOBS_CATALOG.save()
+
+        result = {'added': added, 'unchanged': unchanged}
+        if failed:
+            raise errors.BadRequestError('Some Jobs could not be added', failed=failed, **result)
+        return result, 200
 
 
 class AddTarJob(JobAction):
@@ -1262,6 +1318,10 @@ class InfosJob(JobAction):
 class ListJobs(JobAction):
     """Action responsible to search information about Jobs"""
 
+    _index = None
+    _index_version = None
+    _index_lock = threading.Lock()
+
     def __init__(self, string_to_search=None, ratio=60):
         super().__init__(name=string_to_search, ratio=ratio)
 
@@ -1269,25 +1329,37 @@ class ListJobs(JobAction):
         if self.name is None:
             return [job.json for job in Job.objects.all()], 200
 
-        return [job.json for job in self._fuzzy_matching()], 200
+        names = self._jobs_index().search(self.name, self.ratio)
+        return [job.json for job in Job.objects.filter(name__in=names)], 200
 
-    def _fuzzy_matching(self):
-        delimiters = re.compile(r'\W|_')
-        for job in Job.objects.all():
-            search_fields = itertools.chain(
-                    delimiters.split(job.name),
-                    job.keywords.all())
-            if any(fuzz.token_set_ratio(word, self.name) > self.ratio
-                   for word in search_fields):
-                yield job
+    @classmethod
+    def _jobs_index(cls):
+        """Index of the names and keywords of the Jobs, built
+        again only when they changed since the last search.
+        """
+        version = ResourceVersion.objects.filter(name='jobs').values_list('version', flat=True).first()
+        with cls._index_lock:
+            if cls._index is None or cls._index_version != version:
+                keywords = defaultdict(list)
+                for job, keyword in Job.keywords.through.objects.values_list('job', 'keyword'):
+                    keywords[job].append(keyword)
+                cls._index = JobIndex(
+                        (name, keywords[name])
+                        for name in Job.objects.values_list('name', flat=True))
+                cls._index_version = version
+            return cls._index
 
 
 class ListExternalJobs(JobAction):
-    def __init__(self, repository):
-        super().__init__(repository=repository)
+    """Action responsible to search information about Jobs
+    available in an external repository.
+    """
+
+    def __init__(self, repository, string_to_search=None, ratio=60, update=False):
+        super().__init__(repository=repository, name=string_to_search, ratio=ratio, update=update)
 
     def _action(self):
-        return external_jobs.list_jobs_properties(self.repository), 200
+        return external_jobs.list_jobs_properties(self.repository, self.name, self.ratio, self.update), 200
 
 
 class GetKeywordsJob(JobAction):
@@ -2447,8 +2519,10 @@ class ListScenarioInstances(ScenarioInstanceAction):
     ScenarioInstances of a given Scenario.
     """
 
-    def __init__(self, project, name=None, max_per_page=None, page_offset=None, quiet=False):
-        super().__init__(name=name, project=project, max_per_page=max_per_page, page_offset=page_offset, quiet=quiet)
+    def __init__(self, project, name=None, max_per_page=None, page_offset=None, cursor=None, quiet=False):
+        super().__init__(
+                name=name, project=project, max_per_page=max_per_page,
+                page_offset=page_offset, cursor=cursor, quiet=quiet)
 
     def _action(self):
         scenario_info = InfosScenario(self.name, self.project)
@@ -2466,23 +2540,50 @@ class ListScenarioInstances(ScenarioInstanceAction):
         else:
             instances_query = ScenarioInstance.objects.filter(scenario_version__scenario__project=self.project)
 
-        if self.max_per_page is not None:
-            offset = self.page_offset or 0
-            page = instances_query.order_by('-id')[offset:offset+self.max_per_page]
-        else:
-            page = instances_query.order_by('-id')
+        if self.cursor is not None:
+            # Keyset pagination: the cursor is the ID of the last
+            # instance of the previous page, which does not require
+            # the database to count every skipped row like OFFSET does
+            instances_query = instances_query.filter(id__lt=self.cursor)
 
-        serialize = operator.attrgetter('limited_json' if self.quiet else 'json')
-        instances = [
-                serialize(instance) for instance in page
-        ]
+        page = instances_query.order_by('-id')
+        if self.max_per_page is not None:
+            offset = 0 if self.cursor is not None else self.page_offset or 0
+            page = page[offset:offset+self.max_per_page]
 
+        serializer = ScenarioInstancesSerializer(page)
+        instances = serializer.limited_json() if self.quiet else serializer.json()
         return instances, 200
 
 
-
 class RecursiveScenarioInstanceAction(ScenarioInstanceAction):
     def _recurse_into_scenario_instance(self, scenario_instance, action, *args):
+        try:
+            job_instances_ids = scenario_instance.summary.job_instances
+        except ScenarioInstanceSummary.DoesNotExist:
+            # Summary not backfilled yet, walk the tree instead
+            self._walk_scenario_instance(scenario_instance, action, *args)
+            return
+
+        job_instances = JobInstance.objects.filter(
+                id__in=job_instances_ids,
+                openbach_function_instance__isnull=False,
+        ).select_related(
+                'openbach_function_instance__scenario_instance',
+                'collector', 'agent',
+        ).order_by('id')
+        for job_instance in job_instances:
+            owner = job_instance.openbach_function_instance.scenario_instance
+            dates = {
+                    '@job_name': job_instance.job_name,
+                    '@scenario_start_date': owner.start_date,
+                    '@job_instance_start_date': job_instance.start_date,
+                    '@scenario_stop_date': owner.stop_date,
+                    '@job_instance_stop_date': job_instance.stop_date,
+            }
+            action(job_instance, *args, dates=dates)
+
+    def _walk_scenario_instance(self, scenario_instance, action, *args):
         functions = scenario_instance.openbach_functions_instances.exclude(
                 started_job__isnull=True, started_scenario__isnull=True)
         for openbach_function in functions:
@@ -2498,7 +2599,7 @@ class RecursiveScenarioInstanceAction(ScenarioInstanceAction):
                 action(job_instance, *args, dates=dates)
             with suppress(ScenarioInstance.DoesNotExist):
                 subscenario_instance = openbach_function.started_scenario
-                self._recurse_into_scenario_instance(subscenario_instance, action, *args)
+                self._walk_scenario_instance(subscenario_instance, action, *args)
 
 
 class StatisticsFilesCount(RecursiveScenarioInstanceAction):
@@ -2535,6 +2636,94 @@ class StatisticsFilesCount(RecursiveScenarioInstanceAction):
         return files_found, 200
 
 
+class RollupScenarioInstance(RecursiveScenarioInstanceAction):
+    """Action that aggregates the statistics of the jobs of a
+    finished Scenario at coarser resolutions, so queries on
+    long time ranges do not need to scan every point.
+    """
+
+    def __init__(self, instance_id):
+        super().__init__(instance_id=instance_id)
+
+    def _rollup_job_instance(self, start_job_instance, rolled_up, failed, **kwargs):
+        collector = start_job_instance.collector
+        connection = InfluxDBConnection(
+                collector.address,
+                collector.stats_query_port,
+                collector.stats_database_name,
+                collector.stats_database_precision)
+        stop_date = start_job_instance.stop_date or timezone.now()
+        try:
+            compute_rollups(
+                    connection,
+                    collector.stats_database_name,
+                    collector.stats_database_precision,
+                    start_job_instance.job_name,
+                    start_job_instance.id,
+                    start_job_instance.start_date.timestamp() * 1000,
+                    stop_date.timestamp() * 1000,
+                    settings.STATISTICS_ROLLUPS_DURATION)
+        except (Timeout, InfluxDBQueryError, OSError) as e:
+            syslog.syslog(
+                    syslog.LOG_WARNING,
+                    'Cannot compute rollups of job instance {}: {}'
+                    .format(start_job_instance.id, e))
+            failed.append(start_job_instance.id)
+        else:
+            rolled_up.append(start_job_instance.id)
+
+    def _action(self):
+        scenario_instance = self.get_scenario_instance_or_not_found_error()
+        if not scenario_instance.is_stopped:
+            raise errors.ConflictError(
+                    'Cannot compute rollups of a running Scenario Instance',
+                    scenario_instance_id=self.instance_id)
+
+        rolled_up, failed = [], []
+        self._recurse_into_scenario_instance(scenario_instance, self._rollup_job_instance, rolled_up, failed)
+        if not failed:
+            # Let the director know it need not try again on restart
+            ScenarioInstance.objects.filter(id=scenario_instance.id).update(statistics_rolled_up=True)
+        return {'job_instances': rolled_up}, 200
+
+
+class ScenarioInstanceLogs(RecursiveScenarioInstanceAction):
+    """Action that retrieve the logs of the jobs of a Scenario"""
+
+    def __init__(self, instance_id, level=7, credentials=None):
+        super().__init__(instance_id=instance_id, level=level, credentials=credentials)
+
+    def _group_by_collector(self, start_job_instance, job_instances, **kwargs):
+        collector = start_job_instance.collector
+        job_instances[collector.address, collector.logs_query_port].append(start_job_instance.id)
+
+    def _action(self):
+        scenario_instance = self.get_scenario_instance_or_not_found_error()
+        self._assert_user_in(scenario_instance.scenario.project.owners.all())
+
+        job_instances = defaultdict(list)
+        self._recurse_into_scenario_instance(scenario_instance, self._group_by_collector, job_instances)
+        return StreamedList(self._retrieve_logs(job_instances)), 200
+
+    def _retrieve_logs(self, job_instances):
+        def logs(collector):
+            address, port = collector
+            query = LogsQuery(address, port, self.credentials)
+            for log in query.instances_logs(job_instances[collector], self.level):
+                source = log['_source']
+                yield (
+                        source.get('job_instance_id'), log['_id'], log['sort'][0],
+                        source.get('severity_label'), source.get('logsource'), source.get('message'))
+
+        def warn(collector, error):
+            syslog.syslog(
+                    syslog.LOG_WARNING,
+                    'Cannot retrieve logs of scenario instance {} from '
+                    'collector at {}: {}'.format(self.instance_id, collector[0], error))
+
+        yield from iterate_in_parallel(logs, list(job_instances), warn)
+
+
 class ExportScenarioInstance(RecursiveScenarioInstanceAction):
     """Action responsible for information retrieval about a ScenarioInstance"""
 
@@ -2575,7 +2764,7 @@ class ExportScenarioInstance(RecursiveScenarioInstanceAction):
         stats.update(dates)
         csv_writer.writerow(stats)
 
-    def _fetch_generated_files(self, start_job_instance, collect_directory, dates):
+    def _list_generated_files(self, start_job_instance, generated_files, dates):
         stats_names = self.files.get(start_job_instance.job_name)
         if stats_names and start_job_instance.agent:
             collector = start_job_instance.collector
@@ -2612,12 +2801,42 @@ class ExportScenarioInstance(RecursiveScenarioInstanceAction):
                             if stat_name in file_paths
                     ]
                     if files_to_fetch:
-                        start_playbook(
-                                'fetch_file',
-                                 start_job_instance.agent.address,
-                                 normalized_job_name + '_'.join(stat_name.split()),
-                                 collect_directory,
-                                 files_to_fetch)
+                        generated_files.append((
+                                start_job_instance.agent.address,
+                                normalized_job_name + '_'.join(stat_name.split()),
+                                files_to_fetch))
+
+    def _fetch_generated_files(self, generated_files, directory):
+        """Retrieve the files generated on the agents, all at once, and
+        archive the ones of each statistic of each job instance in its
+        own tarball.
+        """
+        reports = retrieve_files(
+                FileTransfer(address, path, mirror_path(GENERATED_FILES_MIRROR, address, path))
+                for address, _, files in generated_files
+                for path in files)
+        for address, report in reports.items():
+            if 'error' in report or report['missing']:
+                syslog.syslog(
+                        syslog.LOG_WARNING,
+                        'Cannot retrieve some files generated on agent {} '
+                        'for scenario instance {}: {}'.format(
+                            address, self.instance_id,
+                            report.get('error') or ', '.join(report['missing'])))
+
+        for index, (address, prefix, files) in enumerate(generated_files):
+            paths = [
+                    (path, mirror_path(GENERATED_FILES_MIRROR, address, path))
+                    for path in files
+            ]
+            paths = [(path, local) for path, local in paths if local.exists()]
+            if not paths:
+                continue
+            root = os.path.commonpath([os.path.dirname(path) for path, _ in paths])
+            archive_name = os.path.join(directory, '{}.{}.tar.gz'.format(prefix, index))
+            with tarfile.open(archive_name, mode='w:gz') as tar:
+                for path, local in paths:
+                    tar.add(local.as_posix(), os.path.relpath(path, root or os.curdir))
 
     def _action(self):
         scenario_instance = self.get_scenario_instance_or_not_found_error()
@@ -2672,11 +2891,14 @@ class ExportScenarioInstance(RecursiveScenarioInstanceAction):
         if not self.files:
             return csv_path, 200
 
+        generated_files = []
+        self._recurse_into_scenario_instance(
+                scenario_instance,
+                self._list_generated_files,
+                generated_files)
+
         with tempfile.TemporaryDirectory(prefix='openbach_files/') as generated_dir:
-            self._recurse_into_scenario_instance(
-                    scenario_instance,
-                    self._fetch_generated_files,
-                    generated_dir + '/')
+            self._fetch_generated_files(generated_files, generated_dir)
 
             with tempfile.NamedTemporaryFile('wb', prefix='openbach_files/', suffix='.tar.gz', delete=False) as f:
                 with tarfile.open(fileobj=f, mode='w:gz') as tar:
@@ -3385,6 +3607,8 @@ class StatisticsAction(JobInstanceAction):
     with statistics of a JobInstance.
     """
 
+    CACHE_GRACE_PERIOD = 60
+
     def _build_connection(self, *, raw=False):
         job_instance = self.get_job_instance_or_not_found_error()
         if job_instance.project is not None:
@@ -3405,6 +3629,66 @@ class StatisticsAction(JobInstanceAction):
                 job_instances=[self.instance_id],
                 suffix=self.suffix))
 
+    def _is_completed(self, job_instance):
+        """Tell whether the statistics of this job instance
+        can still change or not.
+
+        Statistics may arrive late on the collector (e.g. when
+        spooled by rstats), so wait a bit after the job stopped.
+        """
+        if not job_instance.is_stopped:
+            return False
+        elapsed = timezone.now() - job_instance.stop_date
+        if elapsed.total_seconds() < self.CACHE_GRACE_PERIOD:
+            return False
+        openbach_function_instance = job_instance.openbach_function_instance
+        if openbach_function_instance is None:
+            return True
+        return openbach_function_instance.scenario_instance.is_stopped
+
+    def _cached_action(self, *parameters):
+        """Execute the action, using the results cache for
+        job instances whose statistics cannot change anymore.
+        """
+        job_instance = self.get_job_instance_or_not_found_error()
+        if not self._is_completed(job_instance):
+            return self._compute()
+
+        if job_instance.project is not None:
+            # Cached results must not bypass ownership checks
+            self._assert_user_in(job_instance.project.owners.all())
+
+        collector = job_instance.collector
+        key = (
+                collector.address, collector.stats_query_port,
+                collector.stats_database_name, type(self).__name__,
+                self.instance_id, self.name, self.suffix, self.origin,
+                *parameters)
+        result = RESULTS_CACHE.get(key)
+        if result is None:
+            result = self._compute()
+            RESULTS_CACHE.set(key, result)
+        return result
+
+    def _compute(self):
+        raise NotImplementedError
+
+
+class StatisticsAccess(StatisticsAction):
+    """Action that checks that the connected user is
+    allowed to see the statistics of a JobInstance.
+    """
+
+    def __init__(self, instance_id):
+        super().__init__(instance_id=instance_id)
+
+    @require_connected_user()
+    def _action(self):
+        job_instance = self.get_job_instance_or_not_found_error()
+        if job_instance.project is not None:
+            self._assert_user_in(job_instance.project.owners.all())
+        return None, 204
+
 
 class StatisticsOrigin(StatisticsAction):
     """Action that retrieve the first timestamp
@@ -3439,12 +3723,30 @@ class StatisticsNamesAndSuffixes(StatisticsAction):
 class StatisticsValues(StatisticsAction):
     """Action that retrieve values associated to a statistic in InfluxDB"""
 
-    def __init__(self, instance_id, name, suffix=None, origin=None):
+    def __init__(self, instance_id, name, suffix=None, origin=None, max_points=None):
         super().__init__(
                 instance_id=instance_id, name=name,
-                suffix=suffix, origin=origin)
+                suffix=suffix, origin=origin,
+                max_points=max_points)
 
     def _action(self):
+        if self.max_points is None:
+            # Full resolution series are too big to be kept around
+            return self._compute()
+        return self._cached_action(self.max_points)
+
+    def _compute(self):
+        if self.max_points is not None:
+            job_instance = self.get_job_instance_or_not_found_error()
+            job_name, connection = self._build_connection(raw=True)
+            query = StatisticsQuery(
+                    connection,
+                    job_instance.collector.stats_database_precision,
+                    job_name, self.instance_id, self.suffix,
+                    database=job_instance.collector.stats_database_name)
+            statistics = query.values(self.name, self.max_points, self.origin)
+            return ([], 200) if statistics is None else (statistics, 200)
+
         try:
             statistics_data = self._retrieve_statistics_data(self.origin)
         except StopIteration:
@@ -3470,6 +3772,9 @@ class StatisticsHistogram(StatisticsAction):
                 buckets=buckets, suffix=suffix, origin=origin)
 
     def _action(self):
+        return self._cached_action(self.buckets)
+
+    def _compute(self):
         try:
             statistics_data = self._retrieve_statistics_data(self.origin)
         except StopIteration:
@@ -3493,6 +3798,9 @@ class StatisticsComparison(StatisticsAction):
                 suffix=suffix, origin=origin)
 
     def _action(self):
+        return self._cached_action()
+
+    def _compute(self):
         try:
             statistics_data = self._retrieve_statistics_data(self.origin)
         except StopIteration:
@@ -3511,10 +3819,18 @@ class StatisticsComparison(StatisticsAction):
 # Miscelaneous #
 ################
 
+class DatabaseConnections(ConductorAction):
+    """Action that reports the usage of the conductor's database connections"""
+
+    @require_connected_user(admin=True)
+    def _action(self):
+        return connections.statistics(), 200
+
+
 class PushFile(ConductorAction):
-    """Action that send a file from the Controller to an Agent"""
+    """Action that send a file from the Controller to one or several Agents"""
 
-    def __init__(self, local_path, remote_path, address, users=(), groups=(), removes=()):
+    def __init__(self, local_path, remote_path, address, users=(), groups=(), removes=(), checksums=()):
         if not users:
             users = [None] * len(local_path)
 
@@ -3524,41 +3840,64 @@ class PushFile(ConductorAction):
         if not removes:
             removes = [False] * len(local_path)
 
+        if not checksums:
+            checksums = [None] * len(local_path)
+
         super().__init__(
                 local_path=local_path, remote_path=remote_path,
-                address=address, users=users, groups=groups, removes=removes)
+                address=address, users=users, groups=groups,
+                removes=removes, checksums=checksums)
 
     @require_connected_user()
     def _action(self):
-        if not (len(self.local_path) == len(self.remote_path) == len(self.users) == len(self.groups) == len(self.removes)):
+        if not (len(self.local_path) == len(self.remote_path) == len(self.users) == len(self.groups) == len(self.removes) == len(self.checksums)):
             raise errors.BadRequestError(
                     'amount mismatch between local paths ({}), '
-                    'remote paths ({}), users ({}), groups ({}), or removes ({})'
-                    .format(len(self.local_path), len(self.remote_path), len(self.users), len(self.groups), len(self.removes)))
-
-        agent_infos = InfosAgent(self.address)
-        self.share_user(agent_infos)
-        agent_infos._check_user_can_use_agent()
-        agent = agent_infos.get_agent_or_not_found_error()
+                    'remote paths ({}), users ({}), groups ({}), '
+                    'removes ({}), or checksums ({})'
+                    .format(len(self.local_path), len(self.remote_path), len(self.users),
+                            len(self.groups), len(self.removes), len(self.checksums)))
+
+        addresses = [self.address] if isinstance(self.address, str) else self.address
+        if not addresses:
+            raise errors.BadRequestError('no agent to send the files to')
+
+        agents = []
+        for address in addresses:
+            agent_infos = InfosAgent(address)
+            self.share_user(agent_infos)
+            agent_infos._check_user_can_use_agent()
+            agents.append(agent_infos.get_agent_or_not_found_error().address)
 
         users = [user if user else 'openbach' for user in self.users]
         groups = [group if group else user for user, group in zip(users, self.groups)]
         removes = [True if remove=="True" else False for remove in self.removes]
-        parameters = [
-                {
+        parameters = []
+        origins = {}
+        for local_path, remote_path, user, group, remove, checksum in zip(
+                self.local_path, self.remote_path, users, groups, removes, self.checksums):
+            destination = os.path.join(
+                    '/opt/openbach/agent/files/',
+                    self.connected_user.username,
+                    remote_path)
+            parameter = {
                     'source': local_path,
-                    'destination': os.path.join(
-                        '/opt/openbach/agent/files/',
-                        self.connected_user.username,
-                        remote_path),
+                    'destination': destination,
                     'user': user,
                     'group': group,
-                    'remove': remove
-                }
-                for local_path, remote_path, user, group, remove
-                in zip(self.local_path, self.remote_path, users, groups, removes)
-        ]
-        start_playbook('push_file', agent.address, parameters)
+                    'remove': remove,
+            }
+            if checksum is not None:
+                # Lets agents already holding this content skip the transfer
+                parameter['checksum'] = checksum
+            origin = origins.setdefault(local_path, destination)
+            if origin != destination:
+                # Duplicate the file on the agents instead of transferring it again
+                parameter['origin'] = origin
+            parameters.append(parameter)
+
+        # A single run sends the files to every agent at once
+        start_playbook('push_file', agents, parameters)
 
         return None, 204
 
@@ -3592,21 +3931,17 @@ class PullFile(ConductorAction):
         agent_infos._check_user_can_use_agent()
         agent = agent_infos.get_agent_or_not_found_error()
 
-        users = [user if user else 'openbach' for user in self.users]
-        groups = [group if group else user for user, group in zip(users, self.groups)]
         removes = [True if remove=="True" else False for remove in self.removes]
-        parameters = [
-                {
-                    'source': remote_path,
-                    'destination': local_path,
-                    'user': user,
-                    'group': group,
-                    'remove': remove
-                }
-                for local_path, remote_path, user, group, remove
-                in zip(self.local_path, self.remote_path, users, groups, removes)
+        transfers = [
+                FileTransfer(agent.address, remote_path, local_path, remove, user or None, group or None)
+                for local_path, remote_path, remove, user, group
+                in zip(self.local_path, self.remote_path, removes, self.users, self.groups)
         ]
-        start_playbook('pull_file', agent.address, parameters)
+        report = retrieve_files(transfers, SSHTransport(become=True))[agent.address]
+        if 'error' in report or report['missing']:
+            raise errors.UnprocessableError(
+                    'Cannot retrieve files from the Agent',
+                    address=agent.address, **report)
 
         return None, 204
 
@@ -3639,30 +3974,35 @@ class OrphanedLogs(ConductorAction):
         super().__init__(level=level, delay=delay, credentials=credentials)
 
     def _action(self):
-        return list(self._retrieve_orphans()), 200
+        collectors = [
+                (collector.address, collector.logs_query_port)
+                for collector in Collector.objects.all()
+        ]
+        return StreamedList(self._retrieve_orphans(collectors)), 200
 
-    def _retrieve_orphans(self):
-        severity = self.level
-        credentials = self.credentials
+    def _retrieve_orphans(self, collectors):
         if self.delay is None:
             timestamps = None
         else:
             now = int(datetime.now().timestamp() * 1000)
             timestamps = (now - self.delay, now)
 
-        for collector in Collector.objects.all():
-            connection = ElasticSearchConnection(collector.address, collector.logs_query_port, credentials)
-            try:
-                logs = connection.orphans(timestamps=timestamps)
-            except Timeout:
-                syslog.syslog(
-                        syslog.LOG_WARNING,
-                        'Cannot retrieve logs from collector at '
-                        '{}: Timeout'.format(collector.address))
-            else:
-                for log in logs.numbered_data.values():
-                    if log.severity <= severity:
-                        yield log._id, log._timestamp, log.severity_label, log.logsource, log.message
+        def orphans(collector):
+            address, port = collector
+            query = LogsQuery(address, port, self.credentials)
+            for log in query.orphans(self.level, timestamps):
+                source = log['_source']
+                yield log['_id'], log['sort'][0], source.get('severity_label'), source.get('logsource'), source.get('message')
+
+        def warn(collector, error):
+            syslog.syslog(
+                    syslog.LOG_WARNING,
+                    'Cannot retrieve logs from collector at '
+                    '{}: {}'.format(collector[0], error))
+
+        # Collectors are queried concurrently and logs
+        # are sent to the backend as soon as they arrive
+        yield from iterate_in_parallel(orphans, collectors, warn)
 
 
 class DatabasesInfos(CollectorAction):
@@ -3722,11 +4062,13 @@ class DeleteDatabases(CollectorAction):
         deleted = {'influxdb': False, 'elasticsearch': False}
 
         if self.influxdb:
+            RESULTS_CACHE.clear()
             try:
                 start_playbook(
                         'manage_retention_policies', self.address, 
                         openbach_influx_database=collector.stats_database_name, 
-                        influxdb_port=collector.stats_query_port)
+                        influxdb_port=collector.stats_query_port,
+                        rollups_duration=settings.STATISTICS_ROLLUPS_DURATION)
             except errors.ConductorError as err:
                 error = err.json()
                 syslog.syslog(
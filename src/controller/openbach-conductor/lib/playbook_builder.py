@@ -393,29 +393,14 @@ class PlaybookBuilder():
 
     @classmethod
     def push_file(cls, address, parameters, restart_services=False, cookie=None):
-        self = cls(address)
+        addresses = [address] if isinstance(address, str) else address
+        self = cls('\n'.join(addresses))
+        self.options.forks = max(len(addresses), self.options.forks)
         self.add_variables(
                 copy_parameters=parameters,
                 restart_services=restart_services)
         self.launch_playbook('push_files', session_cookie=cookie)
 
-    @classmethod
-    def pull_file(cls, address, parameters, restart_services=False, cookie=None):
-        self = cls(address)
-        self.add_variables(
-                copy_parameters=parameters,
-                restart_services=restart_services)
-        self.launch_playbook('pull_files', session_cookie=cookie)
-
-    @classmethod
-    def fetch_file(cls, address, archive_prefix, local_path, remote_paths, cookie=None):
-        self = cls(address)
-        self.add_variables(
-                local_path=local_path,
-                remote_paths=remote_paths,
-                archive_prefix=archive_prefix)
-        self.launch_playbook('fetch_files', session_cookie=cookie)
-
     @classmethod
     def gather_facts(cls, address, cookie=None):
         self = cls(address)
@@ -443,10 +428,11 @@ class PlaybookBuilder():
         self.launch_playbook('reboot', session_cookie=cookie)
 
     @classmethod
-    def manage_retention_policies(cls, address, openbach_influx_database, influxdb_port, cookie=None):
+    def manage_retention_policies(cls, address, openbach_influx_database, influxdb_port, rollups_duration, cookie=None):
         self = cls(address)
         self.add_variables(openbach_influx_database=openbach_influx_database)
         self.add_variables(influxdb_port=influxdb_port)
+        self.add_variables(rollups_duration=rollups_duration)
         self.launch_playbook('manage_retention_policies', session_cookie=cookie)
 
 def _run_playbook(queue):
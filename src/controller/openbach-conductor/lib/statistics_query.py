@@ -0,0 +1,384 @@
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+"""Downsampled retrieval of a statistic of a job instance.
+
+Rather than fetching a whole series to only display a few hundred
+points of it, the downsampling is pushed into InfluxDB as a
+`GROUP BY time()` query sized so that at most `max_points` points
+are returned. Fields that InfluxDB cannot aggregate are fetched as-is
+and reduced using the Largest-Triangle-Three-Buckets algorithm.
+
+Once a scenario instance is finished, its statistics are also
+aggregated (mean/min/max/count) at a 1s, 10s and 1min resolution into
+a dedicated retention policy of finite duration, so that later downsampled queries are
+answered from the coarsest rollup that still satisfies the requested
+resolution instead of scanning the full resolution data.
+
+Results concerning finished job instances never change anymore and
+are kept in a small LRU cache shared by the conductor threads.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+
+import math
+import threading
+from collections import OrderedDict
+
+import numpy
+
+
+DURATION_UNITS = {'ns': 'ns', 'n': 'ns', 'u': 'u', 'ms': 'ms', 's': 's', 'm': 'm', 'h': 'h'}
+PRECISIONS = {'ns': 10**6, 'u': 10**3, 'ms': 1, 's': 10**-3, 'm': 1 / 60000, 'h': 1 / 3600000}
+ROLLUP_RETENTION_POLICY = 'openbach_rollups'
+ROLLUP_DURATION = '52w'
+# Job instances whose statistics are final, for the statistics_cache of post-processing jobs
+STOPPED_MEASUREMENT = 'openbach_stopped_job_instances'
+# Resolutions of the rollups, from the finest to the coarsest, in milliseconds
+ROLLUPS = (('1s', 1000), ('10s', 10000), ('1m', 60000))
+
+
+def _quote_identifier(name):
+    return '"{}"'.format(name.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def _quote_string(value):
+    return "'{}'".format(str(value).replace('\\', '\\\\').replace("'", "\\'"))
+
+
+def _series(response):
+    """Iterate over the (columns, values) of each series
+    of each statement of an InfluxDB response.
+    """
+    for result in response.get('results', []):
+        if 'error' in result:
+            raise InfluxDBQueryError(result['error'])
+        for series in result.get('series', []):
+            yield series['columns'], series['values']
+
+
+class InfluxDBQueryError(Exception):
+    """InfluxDB refused to execute a statement"""
+
+
+def lttb(times, values, threshold):
+    """Largest-Triangle-Three-Buckets: return the indices of the
+    threshold points that best preserve the visual shape of the
+    (times, values) series.
+    """
+    length = len(times)
+    if threshold >= length or threshold < 3:
+        return numpy.arange(min(length, max(threshold, 0)))
+
+    times = numpy.asarray(times, dtype=float)
+    values = numpy.asarray(values, dtype=float)
+    edges = numpy.linspace(1, length - 1, threshold - 1).astype(int)
+    selected = numpy.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = length - 1
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        next_stop = edges[bucket + 2] if bucket + 2 < len(edges) else length
+        next_start = stop if stop < next_stop else stop - 1
+        average_time = times[next_start:next_stop].mean()
+        average_value = values[next_start:next_stop].mean()
+
+        area = numpy.abs(
+                (times[previous] - average_time) * (values[start:stop] - values[previous])
+                - (times[previous] - times[start:stop]) * (average_value - values[previous]))
+        previous = start + int(numpy.argmax(area))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def rollup_measurement(job_name, resolution):
+    return '{}.{}'.format(job_name, resolution)
+
+
+def _create_rollup_retention_policy(connection, database, duration=ROLLUP_DURATION):
+    """Create the rollups retention policy, or update its
+    duration if it already exists.
+    """
+    policy = 'RETENTION POLICY {} ON {} DURATION {}'.format(
+            _quote_identifier(ROLLUP_RETENTION_POLICY),
+            _quote_identifier(database), duration)
+    try:
+        for _ in _series(connection.sql_query('CREATE {} REPLICATION 1'.format(policy))):
+            pass
+    except InfluxDBQueryError as e:
+        if 'already exists' not in str(e):
+            raise
+        for _ in _series(connection.sql_query('ALTER {}'.format(policy))):
+            pass
+
+
+def compute_rollups(
+        connection, database, precision, job_name,
+        job_instance_id, start, stop, duration=ROLLUP_DURATION):
+    """Aggregate the statistics of a job instance between the start
+    and stop timestamps (in milliseconds) into the rollups retention
+    policy, kept for the given duration. Running it again overwrites
+    the previous rollups.
+
+    The job instance is then marked as stopped in the same retention
+    policy, so that caches of its statistics know they are final.
+    """
+    _create_rollup_retention_policy(connection, database, duration)
+    database = _quote_identifier(database)
+    policy = _quote_identifier(ROLLUP_RETENTION_POLICY)
+    unit = DURATION_UNITS.get(precision, 'ms')
+    scale = PRECISIONS.get(precision, 1)
+    condition = '"@job_instance_id" = {} AND time >= {}{unit} AND time <= {}{unit}'.format(
+            _quote_string(job_instance_id), int(start * scale), int(stop * scale), unit=unit)
+
+    statements = (
+            'SELECT MEAN(*), MIN(*), MAX(*), COUNT(*) INTO {}.{}.{} FROM {} '
+            'WHERE {} GROUP BY time({}), *'.format(
+                database, policy, _quote_identifier(rollup_measurement(job_name, resolution)),
+                _quote_identifier(job_name), condition, resolution)
+            for resolution, _ in ROLLUPS)
+    marker = (
+            'SELECT COUNT(*) INTO {}.{}.{} FROM {} WHERE {} GROUP BY '
+            '"@job_instance_id", "@scenario_instance_id", "@owner_scenario_instance_id"'.format(
+                database, policy, _quote_identifier(STOPPED_MEASUREMENT),
+                _quote_identifier(job_name), condition))
+    for statement in (*statements, marker):
+        # INTO queries are executed one at a time so a failure
+        # points to the offending resolution
+        for _ in _series(connection.sql_query(statement)):
+            pass
+
+
+class StatisticsQuery:
+    """Retrieve a single statistic of a job instance
+    through an InfluxDB connection of data_access.
+
+    When database is provided, downsampled queries are
+    routed to the rollups of the job instance, if any.
+    """
+
+    def __init__(self, connection, precision, job_name, job_instance_id, suffix=None, database=None):
+        self.connection = connection
+        self.unit = DURATION_UNITS.get(precision, 'ms')
+        self.scale = PRECISIONS.get(precision, 1)
+        self.job_name = job_name
+        self.database = database
+        self.measurement = _quote_identifier(job_name)
+        conditions = ['"@job_instance_id" = {}'.format(_quote_string(job_instance_id))]
+        if suffix is not None:
+            conditions.append('"@suffix" = {}'.format(_quote_string(suffix)))
+        self.condition = ' AND '.join(conditions)
+
+    def _query(self, *statements):
+        return self.connection.sql_query('; '.join(statements))
+
+    def bounds(self, name):
+        """Return the amount of points of a statistic
+        as well as its first and last timestamps.
+        """
+        field = _quote_identifier(name)
+        template = 'SELECT {}({}) FROM {} WHERE {}'
+        response = self._query(*(
+            template.format(function, field, self.measurement, self.condition)
+            for function in ('COUNT', 'FIRST', 'LAST')))
+
+        try:
+            count, first, last = response['results']
+            (_, [[_, count]]), = _series({'results': [count]})
+            (_, [[first, _]]), = _series({'results': [first]})
+            (_, [[last, _]]), = _series({'results': [last]})
+        except ValueError:
+            # No series at all: the statistic does not exist
+            return 0, None, None
+        return count, first, last
+
+    def first(self, name):
+        """Return the first timestamp of a statistic,
+        if it still has full resolution points.
+        """
+        query = 'SELECT FIRST({}) FROM {} WHERE {}'.format(
+                _quote_identifier(name), self.measurement, self.condition)
+        try:
+            (_, [[first, _]]), = _series(self._query(query))
+        except ValueError:
+            return None
+        return first
+
+    def raw(self, name):
+        query = 'SELECT {} FROM {} WHERE {}'.format(
+                _quote_identifier(name), self.measurement, self.condition)
+        times, values = [], []
+        for columns, points in _series(self._query(query)):
+            index = columns.index(name)
+            for point in points:
+                times.append(point[0])
+                values.append(point[index])
+        return times, values
+
+    def _rollup(self, resolution):
+        return '{}.{}.{}'.format(
+                _quote_identifier(self.database),
+                _quote_identifier(ROLLUP_RETENTION_POLICY),
+                _quote_identifier(rollup_measurement(self.job_name, resolution)))
+
+    def rollup_bounds(self, name):
+        """Same as bounds but computed on the coarsest rollup;
+        return None if the job instance has not been rolled up
+        or if the statistic could not be aggregated.
+        """
+        coarsest, duration = ROLLUPS[-1]
+        template = 'SELECT {}({}) FROM {} WHERE {}'
+        response = self._query(*(
+            template.format(function, _quote_identifier(field + name), self._rollup(coarsest), self.condition)
+            for function, field in (('SUM', 'count_'), ('FIRST', 'mean_'), ('LAST', 'mean_'))))
+
+        try:
+            count, first, last = response['results']
+            (_, [[_, count]]), = _series({'results': [count]})
+            (_, [[first, _]]), = _series({'results': [first]})
+            (_, [[last, _]]), = _series({'results': [last]})
+        except ValueError:
+            return None
+        # Rollups timestamps are the start of their time bucket
+        return count, first, last + int(duration * self.scale) - 1
+
+    def grouped(self, name, first, last, max_points, source=None):
+        interval = max(math.ceil((last - first + 1) / max_points), 1)
+        offset = first % interval
+        if source is not None:
+            # Align buckets on whole rollup buckets so each
+            # of them only aggregates complete rollups
+            duration = int(dict(ROLLUPS)[source] * self.scale)
+            interval = math.ceil(interval / duration) * duration
+            while last // interval - first // interval >= max_points:
+                interval += duration
+            offset = 0
+
+        query = (
+                'SELECT MEAN({field}) FROM {measurement} WHERE {condition} '
+                'AND time >= {first}{unit} AND time <= {last}{unit} '
+                'GROUP BY time({interval}{unit}, {offset}{unit}) FILL(none)'.format(
+                    field=_quote_identifier(name if source is None else 'mean_' + name),
+                    measurement=self.measurement if source is None else self._rollup(source),
+                    condition=self.condition, first=first, last=last,
+                    interval=interval, offset=offset, unit=self.unit))
+        times, values = [], []
+        for _, points in _series(self._query(query)):
+            for timestamp, value in points:
+                times.append(timestamp)
+                values.append(value)
+        return times[:max_points], values[:max_points]
+
+    def values(self, name, max_points=None, origin=None):
+        """Return the values of the statistic, downsampled to at
+        most max_points points if provided, in the same format than
+        the StatisticsValues action of the conductor.
+        """
+        source = None
+        bounds = None
+        if max_points is not None and self.database is not None:
+            bounds = self.rollup_bounds(name)
+        rolled_up = bounds is not None
+        if not rolled_up:
+            bounds = self.bounds(name)
+        count, first, last = bounds
+        if not count:
+            return None
+
+        if rolled_up and count > max_points:
+            # Coarsest rollup from which the requested resolution can
+            # be built out of whole rollup buckets without loosing
+            # more than a fifth of the points
+            interval = (last - first + 1) / max_points / self.scale
+            for resolution, duration in ROLLUPS:
+                if math.ceil(interval / duration) * duration <= interval * 1.25:
+                    source = resolution
+
+        if max_points is None or count <= max_points:
+            times, values = self.raw(name)
+        else:
+            try:
+                times, values = self.grouped(name, first, last, max_points, source)
+            except InfluxDBQueryError:
+                # Non-numeric fields cannot be averaged
+                times, values = self.raw(name)
+                try:
+                    indices = lttb(times, values, max_points)
+                except (TypeError, ValueError):
+                    indices = numpy.linspace(0, len(times) - 1, max_points).astype(int)
+                times = [times[i] for i in indices]
+                values = [values[i] for i in indices]
+
+        if rolled_up:
+            # Rollups are aligned on their buckets, so the first
+            # ones may start before the first point they aggregate
+            first_point = self.first(name)
+            if first_point is not None:
+                first = first_point
+                times = [max(timestamp, first) for timestamp in times]
+        if origin is None:
+            # Same reference than the full resolution
+            # series of data_access: their first point
+            origin = first
+        times = [timestamp - origin for timestamp in times]
+        return {name: values, 'time': times}
+
+
+class ResultsCache:
+    """Thread-safe LRU cache of statistics results"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._results.move_to_end(key)
+            except KeyError:
+                return None
+            return self._results[key]
+
+    def set(self, key, result):
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+RESULTS_CACHE = ResultsCache()
@@ -28,8 +28,62 @@ import ipaddress
 from django.core.serializers.json import DjangoJSONEncoder
 
 
+class StreamedList:
+    """Wrapper around an iterable whose items are lazily produced,
+    so that OpenbachJSONEncoder can write them as they come without
+    building the whole response in memory. It can only be iterated
+    once.
+    """
+
+    def __init__(self, iterable):
+        self._iterable = iterable
+
+    def __iter__(self):
+        return iter(self._iterable)
+
+    def __repr__(self):
+        return '<{} of {!r}>'.format(self.__class__.__name__, self._iterable)
+
+
+def _is_streamed(o):
+    if isinstance(o, StreamedList):
+        return True
+    return isinstance(o, dict) and any(_is_streamed(value) for value in o.values())
+
+
 class OpenbachJSONEncoder(DjangoJSONEncoder):
     def default(self, o):
         if isinstance(o, ipaddress._BaseAddress):
             return str(o)
+        if isinstance(o, StreamedList):
+            # Out of reach of iterencode, e.g. within a list
+            return list(o)
         return super().default(o)
+
+    def iterencode(self, o, _one_shot=False):
+        """Encode the items of the StreamedList found in o, or
+        in the dictionaries it holds, as they are produced.
+        """
+        if not _is_streamed(o):
+            return super().iterencode(o, _one_shot)
+        if isinstance(o, StreamedList):
+            return self._iterencode_streamed(o, _one_shot)
+        return self._iterencode_dict(o, _one_shot)
+
+    def _iterencode_streamed(self, o, _one_shot):
+        yield '['
+        for index, item in enumerate(o):
+            if index:
+                yield self.item_separator
+            yield from self.iterencode(item, _one_shot)
+        yield ']'
+
+    def _iterencode_dict(self, o, _one_shot):
+        yield '{'
+        for index, (key, value) in enumerate(o.items()):
+            if index:
+                yield self.item_separator
+            yield self.encode(str(key))
+            yield self.key_separator
+            yield from self.iterencode(value, _one_shot)
+        yield '}'
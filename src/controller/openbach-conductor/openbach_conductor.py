@@ -73,7 +73,8 @@ application = get_wsgi_application()
 
 from lib import openbach_conductor
 from lib.utils import OpenbachJSONEncoder
-from openbach_django.models import ScenarioInstance, CommandResult, InstalledJobCommandResult
+from openbach_django.connections import release_connections
+from openbach_django.models import ScenarioInstance, CommandResult, InstalledJobCommandResult, ResourceVersion
 
 
 syslog.openlog('openbach_conductor', syslog.LOG_PID, syslog.LOG_USER)
@@ -101,6 +102,7 @@ class BackendHandler(socketserver.BaseRequestHandler):
     def handle(self):
         """Handle message comming from the backend"""
 
+        signals.request_started.send(sender=self.__class__)
         fifo_infos = self.request.recv(4096).decode()
         fifoname = json.loads(fifo_infos)['fifoname']
         with open(fifoname) as fifo:
@@ -160,10 +162,13 @@ def clear_jobs_statuses():
     """
     CommandResult.objects.filter(pk__in=InstalledJobCommandResult.objects.filter(status_install__returncode=202).values('status_install')).update(returncode=500, response='{"state":"Controller restarted while installing"}')
     CommandResult.objects.filter(pk__in=InstalledJobCommandResult.objects.filter(status_uninstall__returncode=202).values('status_uninstall')).update(returncode=500, response='{"state":"Controller restarted while uninstalling"}')
+    # Bulk updates do not send the signals bumping versions
+    ResourceVersion.bump('command_results')
 
 
 def main(address='localhost', port=1113):
     clear_jobs_statuses()
+    release_connections()
 
     backend_server = ConductorServer((address, port), BackendHandler)
     try:
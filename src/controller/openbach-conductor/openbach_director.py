@@ -56,6 +56,7 @@ import pathlib
 import threading
 import traceback
 import socketserver
+from datetime import timedelta
 from contextlib import suppress
 from collections import defaultdict
 
@@ -81,6 +82,8 @@ application = get_wsgi_application()
 from django.utils import timezone
 from django.db.models import Q
 from django.core.exceptions import ObjectDoesNotExist
+from openbach_django import connections
+from openbach_django.connections import database_boundary, release_connections
 from openbach_django.models import (
         ScenarioInstance, JobInstance, OpenbachFunctionInstance,
         StartJobInstance as StartJobInstanceOpenbachFunction,
@@ -101,7 +104,8 @@ from lib.openbach_conductor import (
         PushFile as PushFileConductor,
         PullFile as PullFileConductor,
         Reboot as RebootConductor,
-        ThreadedAction, ScenarioInstanceAction, InfosScenarioInstance,
+        RollupScenarioInstance as RollupScenarioInstanceConductor,
+        StatisticsAction, ThreadedAction, ScenarioInstanceAction, InfosScenarioInstance,
 )
 
 
@@ -153,6 +157,9 @@ class StatusManager:
             if self.scheduler is None:
                 self.scheduler = BackgroundScheduler()
                 self.scheduler.start()
+                self.scheduler.add_job(
+                        connections_manager, 'interval', minutes=1,
+                        id='database_connections')
 
     def _stop_watch(self, job_id):
         with suppress(JobLookupError):
@@ -185,7 +192,18 @@ class StatusManager:
                 thread = self.scenarios.pop(scenario_id)
             thread.stop()
 
+    def add_rollup(self, scenario_id):
+        # Leave some time for late statistics to reach the collector
+        run_date = timezone.now() + timedelta(seconds=StatisticsAction.CACHE_GRACE_PERIOD)
+        with self._mutex:
+            self.scheduler.add_job(
+                    rollup_manager, 'date', run_date=run_date,
+                    args=(scenario_id,),
+                    id='rollup_{}'.format(scenario_id),
+                    replace_existing=True)
+
 
+@database_boundary
 def status_manager(job_instance_id, scenario_instance_id, username):
     """Check and update the status of a job instance based
     on the informations returned by its agent.
@@ -221,6 +239,22 @@ def status_manager(job_instance_id, scenario_instance_id, username):
             StatusManager().remove_job(scenario_instance_id, job_instance_id)
 
 
+@database_boundary
+def rollup_manager(scenario_instance_id):
+    """Aggregate the statistics of a finished scenario instance"""
+    try:
+        RollupScenarioInstanceConductor(scenario_instance_id).action()
+    except errors.ConductorError as error:
+        syslog.syslog(syslog.LOG_WARNING, str(error.json))
+
+
+def connections_manager():
+    """Report the usage of the database connections pools"""
+    for alias, usage in connections.statistics().items():
+        log_level = syslog.LOG_WARNING if usage['waiting'] else syslog.LOG_INFO
+        syslog.syslog(log_level, str({'database': alias, 'connections': usage}))
+
+
 #################################
 # OpenbachFunctions description #
 #################################
@@ -455,6 +489,7 @@ class OpenbachFunctionThread(threading.Thread):
                     'An OpenbachFunction is not implemented',
                     openbach_function_name=verbose_name)
 
+    @database_boundary
     def run(self):
         try:
             self._run()
@@ -518,6 +553,7 @@ class ScenarioInstanceStatus(threading.Thread):
         self._openbach_functions = []
         self._is_stopped = threading.Event()
 
+    @database_boundary
     def run(self):
         try:
             self._run()
@@ -532,6 +568,10 @@ class ScenarioInstanceStatus(threading.Thread):
             }
             syslog.syslog(syslog.LOG_ERR, str(log_message))
             self._terminate_instance()
+        finally:
+            if self.scenario_instance.openbach_function_instance is None:
+                # Subscenarios are aggregated along with their owner
+                StatusManager().add_rollup(self.scenario_instance.id)
 
     def _run(self):
         self.scenario_instance.status = ScenarioInstance.Status.RUNNING
@@ -593,10 +633,13 @@ class ScenarioInstanceStatus(threading.Thread):
                     self._launch_openbach_function_instance(openbach_function_instance)
 
             if openbach_functions_instances.filter(UNFINISHED_FUNCTIONS).exists():
+                # Do not hold a connection of the pool while idling
+                release_connections()
                 time.sleep(0.2)
                 continue
 
             if self._has_instances_running(spawned_jobs, spawned_scenarios):
+                release_connections()
                 time.sleep(1)
             else:
                 break
@@ -644,6 +687,8 @@ class ScenarioInstanceStatus(threading.Thread):
         openbach_function_thread.start()
 
     def _join_openbach_functions(self):
+        # The joined threads may need a connection of the pool to finish
+        release_connections()
         for thread in self._openbach_functions:
             thread.join()
         self._openbach_functions.clear()
@@ -674,6 +719,7 @@ class DirectorServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer)
 
 
 class ScenarioHandler(socketserver.BaseRequestHandler):
+    @database_boundary
     def handle(self):
         length, = struct.unpack('>I', receive_all(self.request, 4))
         message = receive_all(self.request, length).decode()
@@ -734,6 +780,16 @@ def main(socket_name=DEFAULT_UNIX_DOMAIN):
         stopper.connected_user = owner
         stopper.action()
 
+    # Rollups only live in the scheduler, schedule again the
+    # ones lost when the previous director stopped
+    missing_rollups = ScenarioInstance.objects.filter(
+            stop_date__isnull=False,
+            openbach_function_instance__isnull=True,
+            statistics_rolled_up=False)
+    for scenario_id in missing_rollups.values_list('id', flat=True):
+        status_manager.add_rollup(scenario_id)
+    release_connections()
+
     # Start listening for orders
     server = DirectorServer(socket_name, ScenarioHandler)
     try:
@@ -37,11 +37,11 @@ __credits__ = '''Contributors:
 
 
 import os
+import time
 import socket
 import syslog
 import argparse
 from datetime import datetime
-from functools import partial
 from contextlib import suppress
 try:
     import simplejson as json
@@ -56,7 +56,13 @@ import collect_agent
 # Configure logger
 syslog.openlog('send_logs', syslog.LOG_PID, syslog.LOG_USER)
 LOGS_DIR = '/var/log/openbach/'
+CHECKPOINT_FILE = '/opt/openbach/agent/jobs/send_logs/checkpoints.json'
 DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+CHUNK_SIZE = 1024 * 1024  # Bytes read at once from log files
+BATCH_SIZE = 64 * 1024  # Bytes of messages sent in a single gathered write
+IOV_MAX = os.sysconf('SC_IOV_MAX') if 'SC_IOV_MAX' in os.sysconf_names else 1024
+MAX_RETRIES = 8
+MAX_BACKOFF = 30  # Seconds
 
 
 def get_collector_infos(
@@ -71,7 +77,92 @@ def get_collector_infos(
     return config
 
 
-def build_socket_sender():
+class LogsSender:
+    """Ship batches of syslog messages to the collector.
+
+    On TCP, messages are newline-terminated and each batch is sent with
+    a single gathered write; a lost connection is re-established with
+    an exponential backoff and the whole batch is sent again. On UDP,
+    each message is its own datagram. In both cases, the amount of
+    bytes sent per second can be limited.
+    """
+
+    def __init__(self, address, sock_type, rate_limit=None, max_retries=MAX_RETRIES):
+        self.address = address
+        self.sock_type = sock_type
+        self.rate_limit = rate_limit
+        self.max_retries = max_retries
+        self.sock = None
+        self._next_send = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def connect(self):
+        try:
+            self.sock = socket.socket(socket.AF_INET, self.sock_type)
+        except socket.error:
+            collect_agent.send_log(syslog.LOG_NOTICE, 'Failed to create socket')
+            raise
+        if self.sock_type == socket.SOCK_STREAM:
+            try:
+                self.sock.connect(self.address)
+            except socket.error:
+                self.close()
+                raise
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _throttle(self, size):
+        if not self.rate_limit:
+            return
+        now = time.monotonic()
+        start = max(now, self._next_send)
+        self._next_send = start + size / self.rate_limit
+        if start > now:
+            time.sleep(start - now)
+
+    def _send_stream(self, messages):
+        buffers = [message + b'\n' for message in messages]
+        while buffers:
+            sent = self.sock.sendmsg(buffers[:IOV_MAX])
+            while buffers and sent >= len(buffers[0]):
+                sent -= len(buffers.pop(0))
+            if sent:
+                buffers[0] = buffers[0][sent:]
+
+    def _send_datagrams(self, messages):
+        for message in messages:
+            self.sock.sendto(message, self.address)
+
+    def send(self, messages):
+        self._throttle(sum(map(len, messages)))
+        send = self._send_stream if self.sock_type == socket.SOCK_STREAM else self._send_datagrams
+        backoff = 0.5
+        for retry in range(self.max_retries + 1):
+            try:
+                if self.sock is None:
+                    self.connect()
+                send(messages)
+                return
+            except socket.error as error:
+                self.close()
+                collect_agent.send_log(
+                        syslog.LOG_NOTICE,
+                        'Error sending logs to the collector: {}'.format(error))
+                if retry == self.max_retries:
+                    raise
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+
+
+def build_socket_sender(rate_limit=None):
     try:
         collector = get_collector_infos()
     except yaml.YAMLError:
@@ -98,56 +189,106 @@ def build_socket_sender():
                 'Collector configuration file is malformed')
         raise
 
-    logstash = (address, int(port))
+    return LogsSender((address, int(port)), sock_type, rate_limit)
+
+
+def format_message(line):
+    """Convert a line of the local JSON logs into an RFC3164 message"""
+    return (
+            '<{line[pri]}>{line[timestamp]} '
+            '{line[hostname]} {line[programname]}'
+            '[{line[procid]}]: {line[msg]}'
+            .format(line=json.loads(line))
+    ).encode()
+
+
+def read_batches(path, offset=0, batch_size=BATCH_SIZE, chunk_size=CHUNK_SIZE):
+    """Read complete lines of a log file, starting at the given offset,
+    in large chunks and group their formatted messages into batches.
+    Yield each batch along with the offset of the first unread line.
+    """
+    with open(path, 'rb') as log:
+        log.seek(offset)
+        pending = b''
+        batch, batch_size_so_far = [], 0
+        while True:
+            chunk = log.read(chunk_size)
+            if not chunk:
+                break
+            lines = (pending + chunk).split(b'\n')
+            # Last line is either empty or still being written: keep it for later
+            pending = lines.pop()
+            for line in lines:
+                offset += len(line) + 1
+                if not line.strip():
+                    continue
+                try:
+                    message = format_message(line)
+                except (ValueError, KeyError):
+                    collect_agent.send_log(
+                            syslog.LOG_WARNING,
+                            'Skipping malformed log line in {}: {!r}'.format(path, line))
+                    continue
+                batch.append(message)
+                batch_size_so_far += len(message)
+                if batch_size_so_far >= batch_size:
+                    yield batch, offset
+                    batch, batch_size_so_far = [], 0
+        if batch:
+            yield batch, offset
+
+
+def load_checkpoints():
     try:
-        sock = socket.socket(socket.AF_INET, sock_type)
-    except socket.error:
-        collect_agent.send_log(syslog.LOG_NOTICE, 'Failed to create socket')
-        raise
+        with open(CHECKPOINT_FILE) as checkpoints:
+            return json.load(checkpoints)
+    except (OSError, ValueError):
+        return {}
 
-    if sock_type == socket.SOCK_STREAM:
-        sock.connect(logstash)
-        sender = sock.send
-    else:
-        def sender(message):
-            sock.sendto(message, logstash)
 
-    return sock, sender
+def save_checkpoints(checkpoints):
+    temporary = CHECKPOINT_FILE + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(checkpoints, f)
+    os.replace(temporary, CHECKPOINT_FILE)
 
 
-def send_logs(filename, send_log):
-    with open(os.path.join(LOGS_DIR, filename)) as log:
-        for line in log:
-            message = (
-                    '<{line[pri]}>{line[timestamp]} '
-                    '{line[hostname]} {line[programname]}'
-                    '[{line[procid]}]: {line[msg]}'
-                    .format(line=json.loads(line))
-            )
-            try:
-                send_log(message.encode())
-            except socket.error as error:
-                collect_agent.send_log(
-                        syslog.LOG_NOTICE,
-                        'Error code: {}, Message {}'.format(*error))
-                raise
+def send_logs(filename, sender, checkpoints):
+    """Ship the lines of a log file that were not sent by a previous
+    run, recording the offset reached after each batch.
+    """
+    path = os.path.join(LOGS_DIR, filename)
+    inode = os.stat(path).st_ino
+    checkpoint = checkpoints.get(filename, {})
+    offset = checkpoint.get('offset', 0)
+    if checkpoint.get('inode') != inode or offset > os.path.getsize(path):
+        # File was rotated or truncated since last time
+        offset = 0
+
+    for batch, offset in read_batches(path, offset):
+        sender.send(batch)
+        checkpoints[filename] = {'inode': inode, 'offset': offset}
+        save_checkpoints(checkpoints)
 
 
-def main(origin, jobs=None):
+def main(origin, jobs=None, rate_limit=None, reset=False):
     # We don't need to send stats so configure logs only
     collect_agent.register_collect('')
-    sock, send_log = build_socket_sender()
+    checkpoints = load_checkpoints()
 
     jobs = set(jobs) if jobs else set()
     origin_timestamp = datetime.timestamp(origin)
 
-    with sock:
+    with build_socket_sender(rate_limit) as sender:
         for filename in os.listdir(LOGS_DIR):
-            job_name, _ = filename.rsplit('_', 1)
-            file_timestamp = os.path.getmtime(os.path.join(LOGS_DIR, filename))
-            if job_name in jobs and file_timestamp >= origin_timestamp:
-                with suppress(ValueError):
-                    send_logs(filename, send_log)
+            with suppress(ValueError):
+                job_name, _ = filename.rsplit('_', 1)
+                file_timestamp = os.path.getmtime(os.path.join(LOGS_DIR, filename))
+                if job_name in jobs and file_timestamp >= origin_timestamp:
+                    if reset:
+                        # Only forget about the files selected by this run
+                        checkpoints.pop(filename, None)
+                    send_logs(filename, sender, checkpoints)
 
 
 if __name__ == '__main__':
@@ -162,6 +303,13 @@ if __name__ == '__main__':
             '-j', '--job_name',
             action='append',
             help='name of a Job to send logs from')
+    parser.add_argument(
+            '-r', '--rate_limit', type=int,
+            help='maximum amount of bytes sent to the collector per second')
+    parser.add_argument(
+            '-R', '--reset', action='store_true',
+            help='send the logs again from the start of the files '
+            'instead of only the lines added since the previous run')
 
     # get args
     args = parser.parse_args()
@@ -170,4 +318,4 @@ if __name__ == '__main__':
     except ValueError:
         parser.error('date and time are not in the expected ({}) format'.format(DATE_FORMAT))
     else:
-        main(date, args.job_name)
+        main(date, args.job_name, args.rate_limit, args.reset)
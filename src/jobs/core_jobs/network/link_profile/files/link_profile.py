@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+"""Sources of the Job link_profile"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Joaquin MUGUERZA <joaquin.muguerza@viveris.fr>
+ * David FERNANDES <david.fernandes@viveris.fr>
+ * Francklin SIMO <francklin.simo@viveris.fr>
+ * Matthieu PETROU <matthieu.petrou@viveris.fr>
+'''
+
+import sys
+import json
+import time
+import signal
+import syslog
+import argparse
+import threading
+import subprocess
+from collections import namedtuple, deque
+
+import collect_agent
+
+
+MAX_ERRORS = 100
+HANDLE_INGRESS = 'ffff:'
+
+
+ProfileStep = namedtuple('ProfileStep', ['timestamp', 'delay', 'jitter', 'loss', 'rate'])
+
+
+class TcError(Exception):
+    pass
+
+
+def run_command(cmd):
+    """ Run a command, return its output """
+    p = subprocess.run(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+    if p.returncode:
+        raise TcError("Error when executing command '{}': '{}'".format(' '.join(cmd), p.stderr.decode()))
+    return p.stdout.decode()
+
+
+def find_netem(qdiscs):
+    """ Locate the netem qdisc to change among the JSON output of tc
+    qdisc show: the one installed by tc_configure_link, if any, so
+    that its tree is kept. Return its parent and handle and whether
+    it already exists; raise a ValueError if another tree is installed.
+    """
+    managed = [
+            qdisc for qdisc in qdiscs
+            if qdisc.get('handle') not in ('0:', HANDLE_INGRESS)
+    ]
+    if not managed:
+        return 'root', '1:', False
+    netems = [qdisc for qdisc in managed if qdisc['kind'] == 'netem']
+    if len(netems) != 1:
+        raise ValueError(
+                'a tree of qdiscs not ending with a single netem '
+                'qdisc is already installed ({})'.format(
+                    ', '.join('{} {}'.format(q['kind'], q['handle']) for q in managed)))
+    netem, = netems
+    return 'root' if netem.get('root') else netem['parent'], netem['handle'], True
+
+
+class TcBackend:
+    """Long-lived tc process fed with netem changes through its
+    batch mode, so that each step costs a write into a pipe instead
+    of a new process.
+
+    The netem qdisc installed by tc_configure_link is changed in
+    place, keeping the htb classes limiting the bandwidth above it;
+    otherwise a netem qdisc is installed at the root of the interface.
+    """
+
+    def __init__(self, interface, buffer_size):
+        self.interface = interface
+        self.buffer_size = buffer_size
+        self.parent = ['root']
+        self.handle = '1:'
+        self.existing = False
+        self.process = None
+        self.errors = deque(maxlen=MAX_ERRORS)
+
+    def _read_errors(self):
+        for line in self.process.stderr:
+            self.errors.append(line.strip())
+
+    def _send(self, *command):
+        try:
+            self.process.stdin.write(' '.join(command) + '\n')
+        except BrokenPipeError:
+            raise TcError('tc exited while applying link profile on {}'.format(self.interface)) from None
+
+    def setup(self):
+        qdiscs = run_command(['tc', '-j', 'qdisc', 'show', 'dev', self.interface])
+        try:
+            parent, self.handle, self.existing = find_netem(json.loads(qdiscs or '[]'))
+        except ValueError as error:
+            raise TcError('Cannot apply link profile on {}: {}'.format(self.interface, error)) from None
+        self.parent = ['root'] if parent == 'root' else ['parent', parent]
+        if not self.existing:
+            run_command([
+                'tc', 'qdisc', 'replace', 'dev', self.interface, *self.parent,
+                'handle', self.handle, 'netem', 'limit', str(self.buffer_size)])
+
+        self.process = subprocess.Popen(
+                ['tc', '-force', '-batch', '-'],
+                stdin=subprocess.PIPE, stderr=subprocess.PIPE,
+                universal_newlines=True, bufsize=1)
+        # Drain errors as they come so tc never blocks on a full pipe
+        self.reader = threading.Thread(target=self._read_errors, daemon=True)
+        self.reader.start()
+
+    def _qdisc(self, action, *options):
+        self._send('qdisc', action, 'dev', self.interface, *self.parent, 'handle', self.handle, *options)
+
+    def change(self, step):
+        self._qdisc('change', *netem_options(step, self.buffer_size))
+
+    def clear(self):
+        if self.existing:
+            # Keep the tree of tc_configure_link, only remove the impairments
+            self._qdisc('change', 'netem', 'limit', str(self.buffer_size))
+        else:
+            self._qdisc('del')
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self.process.wait()
+        self.reader.join()
+        self.process = None
+        if returncode or self.errors:
+            raise TcError('Error when applying link profile on {}: {}'.format(
+                self.interface, '\n'.join(self.errors) or 'tc exited with code {}'.format(returncode)))
+
+
+def netem_options(step, buffer_size):
+    """ Build the netem parameters applying a step of the profile """
+    options = ['netem', 'limit', str(buffer_size)]
+    if step.delay:
+        options.extend(['delay', '{}ms'.format(step.delay)])
+        if step.jitter:
+            options.append('{}ms'.format(step.jitter))
+    if step.loss:
+        options.extend(['loss', 'random', '{}%'.format(step.loss)])
+    if step.rate:
+        options.extend(['rate', '{}bit'.format(step.rate)])
+    return options
+
+
+RATE_UNITS = {'K': 10**3, 'M': 10**6, 'G': 10**9}
+
+
+def _parse_value(value, converter=float):
+    return None if value in ('', '-') else converter(value)
+
+
+def _parse_rate(value):
+    """ Convert a rate such as 512K or 10M into bits per second """
+    multiplier = RATE_UNITS.get(value[-1:].upper())
+    if multiplier is None:
+        return int(float(value))
+    return int(float(value[:-1]) * multiplier)
+
+
+def parse_trace(lines):
+    """ Read a trace made of 'timestamp delay jitter loss rate' lines.
+
+    Timestamps are in seconds relative to the start of the replay,
+    delay and jitter in milliseconds, loss in percents and rate in
+    bits per second with an optional K, M or G suffix. Columns can be separated by spaces
+    or commas, a '-' leaves a parameter unset and lines starting
+    with a '#' are ignored.
+    """
+    steps = []
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.replace(',', ' ').split()
+        fields.extend('-' * (5 - len(fields)))
+        try:
+            timestamp, delay, jitter, loss, rate = fields
+            step = ProfileStep(
+                    float(timestamp), _parse_value(delay), _parse_value(jitter),
+                    _parse_value(loss), _parse_value(rate, _parse_rate))
+        except ValueError:
+            raise ValueError('Invalid trace line {}: {!r}'.format(line_number, line)) from None
+        if steps and step.timestamp < steps[-1].timestamp:
+            raise ValueError('Trace timestamps are not sorted at line {}'.format(line_number))
+        steps.append(step)
+    return steps
+
+
+def last_step_duration(steps):
+    """ Default duration of the last step of a profile: the same
+    as the one of the step before it, or a second if there is none.
+    """
+    if len(steps) < 2:
+        return 1.0
+    return steps[-1].timestamp - steps[-2].timestamp
+
+
+def replay(steps, backend, loops=1, report=None, last_duration=None, clock=time.monotonic, sleep=time.sleep):
+    """ Apply each step of the profile at its timestamp relative to
+    the start of the replay, using a monotonic clock so that steps
+    are scheduled against absolute deadlines and lateness does not
+    accumulate. The last step lasts last_duration seconds, after which
+    the profile restarts when looping. The report callable receives
+    each applied step and its drift, in seconds, from its deadline.
+    """
+    if not steps:
+        return
+    if last_duration is None:
+        last_duration = last_step_duration(steps)
+    period = steps[-1].timestamp + last_duration
+    start = clock()
+
+    def wait_until(deadline):
+        remaining = deadline - clock()
+        if remaining > 0:
+            sleep(remaining)
+
+    for loop in range(loops):
+        offset = loop * period
+        for step in steps:
+            deadline = start + offset + step.timestamp
+            wait_until(deadline)
+            backend.change(step)
+            drift = clock() - deadline
+            if report is not None:
+                report(step, drift)
+    wait_until(start + loops * period)
+
+
+def send_step_statistics(step, drift):
+    statistics = {'drift': drift * 1000}
+    for name in ('delay', 'jitter', 'loss', 'rate'):
+        value = getattr(step, name)
+        if value is not None:
+            statistics[name] = value
+    collect_agent.send_stat(collect_agent.now(), **statistics)
+
+
+def main(interface, trace, loops, buffer_size, last_step_duration, clear):
+    try:
+        with open(trace) as trace_file:
+            steps = parse_trace(trace_file)
+    except (OSError, ValueError) as error:
+        message = 'Cannot load link profile: {}'.format(error)
+        collect_agent.send_log(syslog.LOG_ERR, message)
+        sys.exit(message)
+
+    backend = TcBackend(interface, buffer_size)
+
+    def stop(signum, frame):
+        try:
+            if clear and backend.process is not None:
+                backend.clear()
+            backend.close()
+        except TcError as error:
+            collect_agent.send_log(syslog.LOG_ERR, str(error))
+            sys.exit(str(error))
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    try:
+        backend.setup()
+        replay(steps, backend, loops or sys.maxsize, send_step_statistics, last_step_duration)
+    except TcError as error:
+        collect_agent.send_log(syslog.LOG_ERR, str(error))
+        try:
+            backend.close()
+        except TcError:
+            pass
+        sys.exit(str(error))
+    stop(None, None)
+
+if __name__ == '__main__':
+    with collect_agent.use_configuration('/opt/openbach/agent/jobs/link_profile/link_profile_rstats_filter.conf'):
+        # Define Usage
+        parser = argparse.ArgumentParser(
+                description=__doc__,
+                formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        parser.add_argument(
+                'interface', help='Name of the interface to configure')
+        parser.add_argument(
+                'trace', help='Path to the trace file describing the link profile')
+        parser.add_argument(
+                '-l', '--loops', type=int, default=1,
+                help='Number of times the profile is replayed (0 for infinite)')
+        parser.add_argument(
+                '--buffer_size', type=int, default=10000,
+                help='Size of the buffer for netem limit parameter')
+        parser.add_argument(
+                '-d', '--last_step_duration', type=float,
+                help='Duration of the last step of the profile, in seconds, '
+                'before it ends or restarts (default: same as the step before it)')
+        parser.add_argument(
+                '-c', '--clear', action='store_true',
+                help='Remove the netem qdisc, or its impairments if it was installed '
+                'by tc_configure_link, once the profile is over')
+
+        args = vars(parser.parse_args())
+        main(**args)
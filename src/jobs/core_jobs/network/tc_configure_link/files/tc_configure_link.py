@@ -39,20 +39,28 @@ __credits__ = '''Contributors:
 
 import re
 import sys
+import json
 import syslog
 import argparse
 import subprocess
+from collections import namedtuple
 
 import collect_agent
 
 
 HANDLE_INGRESS = 'ffff:'
 IFB = 'ifb{}'
+STATE_FILENAME = '/var/run/tc_configure_link.json'
 
 
-def run_command(cmd):
+TcNode = namedtuple('TcNode', ['kind', 'parent', 'handle', 'options'])
+
+
+def run_command(cmd, stdin=None):
     """ Run a command, return return code """
-    p = subprocess.run(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+    p = subprocess.run(
+            cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE,
+            input=None if stdin is None else stdin.encode())
     if p.returncode:
         message = "Error when executing command '{}': '{}'".format(
                     ' '.join(cmd), p.stderr.decode())
@@ -61,15 +69,154 @@ def run_command(cmd):
     return p.returncode, p.stdout.decode()
 
 
+def run_batch(commands):
+    """ Send all tc commands at once to a single tc process """
+    if commands:
+        batch = ''.join(' '.join(cmd) + '\n' for cmd in commands)
+        run_command(['tc', '-batch', '-'], stdin=batch)
+
+
+def netem_options(delay, jitter, delay_distribution, loss_model, loss_model_params, buffer_size):
+    """ Build the netem parameters setting a delay, jitter and losses """
+    options = ['netem', 'limit', str(buffer_size)]
+    if delay:
+        options.extend(['delay', '{}ms'.format(delay)])
+        if jitter and jitter > 0:
+            options.extend(['{}ms'.format(jitter), 'distribution', delay_distribution])
+    if loss_model and loss_model_params:
+        options.extend(['loss', loss_model])
+        options.extend('{}%'.format(param) for param in loss_model_params)
+    return tuple(options)
+
+
+def build_tree(delay, jitter, delay_distribution, bandwidth, loss_model, loss_model_params, buffer_size):
+    """ Compile the desired configuration into the list of qdiscs and
+    classes to install on an interface, parents first.
+    """
+    nodes = []
+    parent, handle = 'root', '1:'
+    if bandwidth:
+        nodes.extend([
+            TcNode('qdisc', 'root', '1:', ('htb', 'default', '11')),
+            TcNode('class', '1:', '1:1', ('htb', 'rate', '{}bps'.format(bandwidth), 'burst', '1000b')),
+            TcNode('class', '1:1', '1:11', ('htb', 'rate', '{}bit'.format(bandwidth), 'burst', '1000b')),
+        ])
+        parent, handle = '1:11', '10:'
+    options = netem_options(delay, jitter, delay_distribution, loss_model, loss_model_params, buffer_size)
+    nodes.append(TcNode('qdisc', parent, handle, options))
+    return nodes
+
+
+def tree_shape(nodes):
+    """ Identify each node of a tree by its kind, handle and type """
+    return [(node.kind, node.handle, node.options[0]) for node in nodes]
+
+
+def node_command(action, interface, node):
+    """ Build the tc batch line to add or change a node on an interface """
+    if node.kind == 'qdisc':
+        parent = ['root'] if node.parent == 'root' else ['parent', node.parent]
+        return ['qdisc', action, 'dev', interface, *parent, 'handle', node.handle, *node.options]
+    return ['class', action, 'dev', interface, 'parent', node.parent, 'classid', node.handle, *node.options]
+
+
+def diff_tree(interface, desired, recorded=None, live=None):
+    """ Compute the tc batch lines turning the current tree of an
+    interface into the desired one.
+
+    The recorded tree, as applied by a previous run of this job, is
+    only trusted if the live configuration still has the same shape;
+    in that case, only the nodes whose parameters differ from the
+    desired ones are changed in place. The parameters of a node are
+    considered different if they were not the ones recorded or if
+    their live options, as reported by tc, changed since they were
+    recorded: nodes modified by another tool are thus applied again.
+    Otherwise the interface is reset and the whole tree is added again.
+    """
+    if live is None:
+        live = {}
+    shape = tree_shape(desired)
+    if recorded is not None:
+        recorded_tree, recorded_live = recorded
+        if tree_shape(recorded_tree) == shape and set(shape) == set(live):
+            return [
+                    node_command('change', interface, new)
+                    for old, new, node in zip(recorded_tree, desired, shape)
+                    if old != new or live[node] != recorded_live.get(node)
+            ]
+
+    commands = [['qdisc', 'del', 'dev', interface, 'root']] if live else []
+    commands.extend(node_command('add', interface, node) for node in desired)
+    return commands
+
+
+def parse_tc_state(qdiscs, classes):
+    """ Extract the nodes managed by this job from the JSON output of
+    tc qdisc show and tc class show, along with their live options.
+    """
+    state = {
+            ('qdisc', qdisc['handle'], qdisc['kind']): qdisc.get('options')
+            for qdisc in qdiscs
+            if qdisc.get('handle') not in ('0:', HANDLE_INGRESS)
+    }
+    state.update(
+            (('class', klass['handle'], klass['class']), klass.get('options'))
+            for klass in classes)
+    return state
+
+
+def read_tc_state(interface):
+    """ Retrieve the qdiscs and classes installed on an interface """
+    _, qdiscs = run_command(['tc', '-j', 'qdisc', 'show', 'dev', interface])
+    _, classes = run_command(['tc', '-j', 'class', 'show', 'dev', interface])
+    return parse_tc_state(json.loads(qdiscs or '[]'), json.loads(classes or '[]'))
+
+
+def load_recorded_trees():
+    """ Retrieve the trees applied by previous runs of this job and
+    the live state of their nodes right after they were applied.
+    """
+    try:
+        with open(STATE_FILENAME) as state:
+            trees = json.load(state)
+        return {
+                interface: (
+                    [TcNode(kind, parent, handle, tuple(options)) for kind, parent, handle, options in record['tree']],
+                    {(kind, handle, type_): options for kind, handle, type_, options in record['live']},
+                )
+                for interface, record in trees.items()
+        }
+    except (OSError, ValueError, TypeError, KeyError):
+        return {}
+
+
+def save_recorded_trees(trees):
+    records = {
+            interface: {
+                'tree': tree,
+                'live': [[*node, options] for node, options in live.items()],
+            }
+            for interface, (tree, live) in trees.items()
+    }
+    try:
+        with open(STATE_FILENAME, 'w') as state:
+            json.dump(records, state)
+    except OSError as error:
+        collect_agent.send_log(syslog.LOG_WARNING, 'Could not record applied configuration: {}'.format(error))
+
+
+def ingress_redirections(interface):
+    """ Find ifbs that are associated to interface """
+    cmd = ['tc', 'filter', 'show', 'dev', interface, 'parent', HANDLE_INGRESS]
+    _, output = run_command(cmd)
+    return re.findall(r'Egress Redirect to device (\w+)', output)
+
+
 def clear_ingress(interfaces):
     for interface in interfaces.split(','):
-        # Find ifbs that are associated to interface
-        cmd = ['tc', 'filter', 'show', 'dev', interface, 'parent', HANDLE_INGRESS]
-        _, output = run_command(cmd)
-        ifbs = re.findall('Egress Redirect to device (\w+)', output)
-        # Remove filter rule redirecting all incoming traffics from interface to ifb interface
-        cmd = ['tc', 'filter', 'del', 'dev', interface, 'parent', HANDLE_INGRESS]
+        ifbs = ingress_redirections(interface)
         # Check if an ingress qdisc exists, if so remove it on interface
+        # (this also removes the filter redirecting incoming traffic to the ifb interface)
         cmd = ['tc', 'qdisc', 'show', 'dev', interface, 'ingress']
         _, output = run_command(cmd)
         ingress_qdiscs = re.findall('qdisc ingress', output)
@@ -107,110 +254,86 @@ def delete_qdisc(interface, qdisc):
     run_command(cmd)
 
 
-def add_qdisc_ingress(interface, ifb, buffer_size):
-    cmds = [
-            ['ip', 'link', 'set', 'dev', ifb, 'up', 'qlen', str(buffer_size)],
-            ['tc', 'qdisc', 'add', 'dev', interface, 'handle', HANDLE_INGRESS, 'ingress'], 
+def ingress_commands(interface, ifb):
+    """ Build the tc batch lines redirecting all incoming traffic from interface to ifb """
+    return [
+            ['qdisc', 'add', 'dev', interface, 'handle', HANDLE_INGRESS, 'ingress'],
             [
-                'tc', 'filter', 'add', 'dev', interface,
+                'filter', 'add', 'dev', interface,
                 'parent', HANDLE_INGRESS, 'u32', 'match',
                 'u32', '0', '0', 'action', 'mirred',
                 'egress', 'redirect', 'dev', ifb,
             ],
     ]
-    for cmd in cmds:
-        run_command(cmd)
-
-
-def add_qdisc_bandwidth(interface, bandwidth):
-    """ Add a qdisc to limit the bandwidth on interface """
-    cmds = [
-            ['tc', 'qdisc', 'add', 'dev', interface, 'root', 'handle', '1:', 'htb', 'default', '11'],
-            [
-                'tc', 'class', 'add', 'dev', interface, 'parent',
-                '1:', 'classid', '1:1', 'htb', 'rate', '{}bps'.format(bandwidth),
-                'burst', '1000b',
-            ],
-            [
-                'tc', 'class', 'add', 'dev', interface, 'parent',
-                '1:1', 'classid', '1:11', 'htb', 'rate', '{}bit'.format(bandwidth),
-                'burst', '1000b',
-            ],
-    ]
-    for cmd in cmds:
-        run_command(cmd)
 
 
-def add_qdisc_delay(interface, delay, jitter, delay_distribution, loss_model, loss_model_params, handle, buffer_size):
-    """ Add a qdisc to set a delay, and jitter on interface """
-    cmd = ['tc', 'qdisc', 'add', 'dev', interface]
-    cmd.extend(handle)
-    cmd.extend(['netem', 'limit', str(buffer_size)])
-    if delay:
-       cmd.extend(['delay', '{}ms'.format(str(delay))])
-       if jitter and jitter > 0: 
-          cmd.extend(['{}ms'.format(str(jitter)), 'distribution', delay_distribution])
-    if loss_model and loss_model_params:
-       cmd.extend(['loss', loss_model])
-       for param in loss_model_params: 
-           cmd.extend(['{}%'.format(str(param))])
-    run_command(cmd)
+def check_bandwidth(bandwidth):
+    if bandwidth and not re.findall(r'^[0-9]+[KM]$', bandwidth):
+        collect_agent.send_log(syslog.LOG_ERR,
+                "Invalid format for bandwidth: expecting "
+                "'{}', found '{}'".format('{VALUE}{M|K}', bandwidth))
+        sys.exit(1)
 
 
 def apply_conf(interfaces, mode, delay=None, jitter=None, delay_distribution=None, 
                bandwidth=None, loss_model=None, loss_model_params=None, buffer_size=None):
     collect_agent.send_log(syslog.LOG_DEBUG, 'Starting tc_configure_link job (apply {})'.format(mode))
+    check_bandwidth(bandwidth)
+    desired = build_tree(delay, jitter, delay_distribution, bandwidth, loss_model, loss_model_params, buffer_size)
+    recorded_trees = load_recorded_trees()
+    commands = []
+    changed = []
+
+    def configure(interface, live=None):
+        tree_commands = diff_tree(interface, desired, recorded_trees.get(interface), live)
+        if tree_commands:
+            changed.append(interface)
+        commands.extend(tree_commands)
 
     if mode == 'egress' or mode == 'all':
         for interface in interfaces.split(','):
-            handle = ['root', 'handle', '1:']
-            # Delete existing qdisc
-            # Check if a root qdisc exists, if so remove it on interface
-            cmd = ['tc', 'qdisc', 'show', 'dev', interface]
-            _, output = run_command(cmd)
-            output = re.findall('qdisc netem', output)
-            if output:
-               delete_qdisc(interface, 'root')
             # Add qlen
             run_command(['ip', 'link', 'set', interface, 'qlen', str(buffer_size)])
-            # Add bandwidth if relevant
-            if bandwidth:
-                if not re.findall(r'^[0-9]+[KM]$', bandwidth):
-                    collect_agent.send_log(syslog.LOG_ERR,
-                            "Invalid format for bandwidth: expecting "
-                            "'{}', found '{}'".format('{VALUE}{M|K}', bandwidth))
-                    sys.exit(1)
-                add_qdisc_bandwidth(interface, bandwidth)
-                handle = ['parent', '1:11', 'handle', '10:']
-            # Add delay
-            add_qdisc_delay(interface, delay, jitter, delay_distribution, loss_model, loss_model_params, handle, buffer_size)
+            configure(interface, read_tc_state(interface))
     if mode == 'ingress' or mode == 'all':
         # Ingress configuration
-        clear_ingress(interfaces)
-        run_command(['modprobe', '-r', 'ifb'])
-        run_command(['modprobe', 'ifb', 'numifbs={}'.format(str(len(interfaces.split(','))))])
-        for index, interface in enumerate(interfaces.split(',')):
-            handle = ['root', 'handle', '1:']
+        interfaces = interfaces.split(',')
+        ifbs = [IFB.format(str(index)) for index in range(len(interfaces))]
+        if all(ingress_redirections(interface) == [ifb] for interface, ifb in zip(interfaces, ifbs)):
+            # Ifbs are already wired to the interfaces: only update their trees
+            for ifb in ifbs:
+                run_command(['ip', 'link', 'set', 'dev', ifb, 'qlen', str(buffer_size)])
+                configure(ifb, read_tc_state(ifb))
+        else:
             # Clear ingress configuration and add a new one
-            add_qdisc_ingress(interface, IFB.format(str(index)), buffer_size)
-            # Add bandwidth if relevant
-            if bandwidth:
-               if not re.findall(r'^[0-9]+[KM]$', bandwidth):
-                  collect_agent.send_log(syslog.LOG_ERR,
-                        "Invalid format for bandwidth: expecting "
-                        "'{}', found '{}'".format('{VALUE}{M|K}', bandwidth))
-                  sys.exit(1)
-               add_qdisc_bandwidth(IFB.format(str(index)), bandwidth)
-               handle = ['parent', '1:11', 'handle', '10:']
-            # Add delay
-            add_qdisc_delay(IFB.format(str(index)), delay, jitter, delay_distribution, loss_model, loss_model_params, handle, buffer_size)
+            clear_ingress(','.join(interfaces))
+            run_command(['modprobe', '-r', 'ifb'])
+            run_command(['modprobe', 'ifb', 'numifbs={}'.format(str(len(interfaces)))])
+            for interface, ifb in zip(interfaces, ifbs):
+                run_command(['ip', 'link', 'set', 'dev', ifb, 'up', 'qlen', str(buffer_size)])
+                commands.extend(ingress_commands(interface, ifb))
+                recorded_trees.pop(ifb, None)
+                configure(ifb)
+
+    run_batch(commands)
+    # Record the live options of the new nodes to detect later changes made by other tools
+    for interface in changed:
+        recorded_trees[interface] = (desired, read_tc_state(interface))
+    save_recorded_trees(recorded_trees)
 
 
 def clear_conf(interfaces, mode):
+    recorded_trees = load_recorded_trees()
     if mode in {'ingress', 'all'}:
+        for interface in interfaces.split(','):
+            for ifb in ingress_redirections(interface):
+                recorded_trees.pop(ifb, None)
         clear_ingress(interfaces)
     if mode in {'egress', 'all'}:
         clear_egress(interfaces)
+        for interface in interfaces.split(','):
+            recorded_trees.pop(interface, None)
+    save_recorded_trees(recorded_trees)
 
 
 if __name__ == '__main__':
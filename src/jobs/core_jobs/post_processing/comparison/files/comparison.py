@@ -40,17 +40,22 @@ import argparse
 import tempfile
 import itertools
 
+from post_processing_worker import delegate
+# Hand the job over to the warm worker, when available, before heavy imports
+delegate(__name__, __file__)
+
 import matplotlib.pyplot as plt
 
 import collect_agent
-from data_access.post_processing import Statistics, save
+from data_access.post_processing import save
+from statistics_cache import CachedStatistics
 
 
 def main(job_instance_ids, statistics_names, stats_with_suffixes, ylabels, titles, xlabel_job_instance_names, pickle):
     file_ext = 'pickle' if pickle else 'png'
     xlabel_instance_names = iter(xlabel_job_instance_names)
 
-    statistics = Statistics.from_default_collector()
+    statistics = CachedStatistics.from_default_collector()
     with tempfile.TemporaryDirectory(prefix='openbach-comparison-') as root:
         for fields, ylabel, title in itertools.zip_longest(statistics_names, ylabels, titles):
             figure, axis = plt.subplots()
@@ -41,10 +41,15 @@ import argparse
 import tempfile
 import itertools
 
+from post_processing_worker import delegate
+# Hand the job over to the warm worker, when available, before heavy imports
+delegate(__name__, __file__)
+
 import matplotlib.pyplot as plt
 
 import collect_agent
-from data_access.post_processing import Statistics, _Plot, save
+from data_access.post_processing import _Plot, save
+from statistics_cache import CachedStatistics
 
 
 def main(
@@ -56,7 +61,7 @@ def main(
     plot = _Plot.plot_cumulative_histogram if cumulative else _Plot.plot_histogram
     legends = iter(legend)
 
-    statistics = Statistics.from_default_collector()
+    statistics = CachedStatistics.from_default_collector()
     with tempfile.TemporaryDirectory(prefix='openbach-histogram-') as root:
         for fields, label, title, filename in itertools.zip_longest(statistics_names, labels, titles, filenames):
             figure, axis = plt.subplots()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+"""Warm worker running the post-processing jobs
+
+Post-processing jobs spend most of their start-up time importing numpy,
+pandas, matplotlib and data_access. This worker imports them once and
+listens on a local socket; each job script then only hands its command
+line and environment over to the worker, which forks a pre-warmed child
+to run it, and exits with the same return code. The job standard
+streams are handed over along with the request so its output still
+reaches the caller.
+
+The worker is started on demand by the first job finding no socket to
+connect to (this job runs normally meanwhile) and stops by itself after
+an idle period. It re-executes itself, keeping its socket, whenever one
+of the modules it keeps imported is modified on disk (e.g. the jobs are
+reinstalled) so jobs never run against stale code.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+import os
+import sys
+import json
+import time
+import array
+import errno
+import runpy
+import select
+import signal
+import socket
+import argparse
+import importlib
+import traceback
+import subprocess
+from contextlib import suppress
+
+
+SOCKET_PATH = '/var/run/openbach_post_processing.sock'
+WORKER_ENVIRONMENT = 'OPENBACH_POST_PROCESSING_WORKER'
+IDLE_TIMEOUT = 600  # Seconds without any job before the worker stops
+MAX_JOBS = os.cpu_count() or 1
+STANDARD_STREAMS = (0, 1, 2)
+# Job-side helpers imported by the worker; jobs use their own copies
+LOCAL_MODULES = ('statistics_cache', 'streaming_aggregation')
+
+
+def delegate(name, filename, socket_path=SOCKET_PATH):
+    """Run the calling job script into the worker, if any, and exit
+    with its return code. Return normally if the job should rather
+    run in the current process.
+    """
+    if name != '__main__' or os.environ.get(WORKER_ENVIRONMENT) or {'-h', '--help'} & set(sys.argv):
+        return
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except OSError:
+        connection.close()
+        _spawn_worker(socket_path)
+        return
+
+    request = {
+            'script': os.path.abspath(filename),
+            'argv': sys.argv,
+            'environ': dict(os.environ),
+            'cwd': os.getcwd(),
+    }
+    with connection, connection.makefile('rb') as stream:
+        for output in (sys.stdout, sys.stderr):
+            with suppress(AttributeError, ValueError, OSError):
+                output.flush()
+        try:
+            connection.sendmsg(
+                    [json.dumps(request).encode() + b'\n'],
+                    [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', STANDARD_STREAMS))])
+        except OSError:
+            return
+        response = stream.readline()
+
+    if not response:
+        # Worker died before answering; do the work ourselves
+        return
+    sys.exit(json.loads(response)['returncode'])
+
+
+def _spawn_worker(socket_path):
+    try:
+        subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), '--socket', socket_path],
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL, start_new_session=True)
+    except OSError:
+        pass
+
+
+def _receive_request(connection):
+    """Read a request and the standard streams sent along with it"""
+    fds = array.array('i')
+    data, ancillary, _, _ = connection.recvmsg(
+            65536, socket.CMSG_SPACE(len(STANDARD_STREAMS) * fds.itemsize))
+    for level, kind, payload in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(payload[:len(payload) - len(payload) % fds.itemsize])
+
+    while data and not data.endswith(b'\n'):
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return json.loads(data), list(fds)
+
+
+def _run_job(request, fds):
+    """Body of the forked child: become the requested job"""
+    for target, fd in zip(STANDARD_STREAMS, fds):
+        os.dup2(fd, target)
+    for fd in fds:
+        if fd not in STANDARD_STREAMS:
+            os.close(fd)
+
+    # Let the job import its own copy of the helpers rather than
+    # the one of whichever job spawned the worker
+    directory = os.path.dirname(request['script'])
+    for name in LOCAL_MODULES:
+        module = sys.modules.get(name)
+        filename = getattr(module, '__file__', None)
+        if filename and os.path.dirname(os.path.abspath(filename)) != directory:
+            del sys.modules[name]
+
+    os.environ.clear()
+    os.environ.update(request['environ'])
+    os.environ[WORKER_ENVIRONMENT] = '1'
+    os.chdir(request['cwd'])
+    sys.argv = request['argv']
+    sys.path.insert(0, os.path.dirname(request['script']))
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+    try:
+        runpy.run_path(request['script'], run_name='__main__')
+    except SystemExit as e:
+        code = e.code
+        if code is None:
+            code = 0
+        elif not isinstance(code, int):
+            print(code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    else:
+        code = 0
+
+    # os._exit skips the interpreter shutdown, flush by hand
+    for stream in (sys.stdout, sys.stderr):
+        with suppress(AttributeError, ValueError, OSError):
+            stream.flush()
+    return code
+
+
+def _handle(connection):
+    """Body of the per-connection child: run the job in a grandchild
+    and kill it if the client goes away (e.g. the job is stopped).
+    """
+    with connection, connection.makefile('wb') as stream:
+        request, fds = _receive_request(connection)
+        pid = os.fork()
+        if not pid:
+            connection.close()
+            os._exit(_run_job(request, fds))
+        for fd in fds:
+            os.close(fd)
+
+        while True:
+            finished, status = os.waitpid(pid, os.WNOHANG)
+            if finished:
+                break
+            readable, _, _ = select.select([connection], [], [], 0.1)
+            if readable and not connection.recv(1, socket.MSG_PEEK):
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+                return
+        returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+        stream.write(json.dumps({'returncode': returncode}).encode() + b'\n')
+
+
+def _modification_times(filenames):
+    times = {}
+    for filename in filenames:
+        try:
+            times[filename] = os.stat(filename).st_mtime_ns
+        except OSError:
+            times[filename] = None
+    return times
+
+
+def _reexec(server, socket_path, max_jobs, idle_timeout, children):
+    """Replace the worker by a fresh interpreter serving on the same
+    socket; running jobs stay children of the new process image.
+    """
+    os.set_inheritable(server.fileno(), True)
+    os.execv(sys.executable, [
+        sys.executable, os.path.abspath(__file__),
+        '--socket', socket_path,
+        '--jobs', str(max_jobs),
+        '--idle-timeout', str(idle_timeout),
+        '--fd', str(server.fileno()),
+        *(str(pid) for pid in children),
+    ])
+
+
+def serve(socket_path=SOCKET_PATH, max_jobs=MAX_JOBS, idle_timeout=IDLE_TIMEOUT, fd=None, children=()):
+    # Warm up everything the post-processing jobs need
+    import numpy, pandas, matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot
+    import collect_agent
+    import data_access.post_processing
+    warmed = [collect_agent, data_access.post_processing]
+    for module in LOCAL_MODULES:
+        with suppress(ImportError):
+            warmed.append(importlib.import_module(module))
+    watched = {os.path.abspath(__file__)}
+    watched.update(
+            os.path.abspath(module.__file__) for module in warmed
+            if getattr(module, '__file__', None))
+    loaded = _modification_times(watched)
+
+    os.umask(0o077)
+    if fd is not None:
+        # Re-executed worker: keep serving on the inherited socket
+        server = socket.socket(fileno=fd)
+    else:
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server.bind(socket_path)
+        except OSError as e:
+            if e.errno != errno.EADDRINUSE:
+                raise
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                    probe.connect(socket_path)
+            except OSError:
+                # Stale socket from a dead worker
+                os.unlink(socket_path)
+                server.bind(socket_path)
+            else:
+                # Another worker is already serving
+                return
+        server.listen()
+    server.settimeout(1)
+
+    children = set(children)
+    last_activity = time.monotonic()
+    try:
+        while children or time.monotonic() - last_activity < idle_timeout:
+            while children:
+                pid, _ = os.waitpid(-1, os.WNOHANG if len(children) < max_jobs else 0)
+                if not pid:
+                    break
+                children.discard(pid)
+                last_activity = time.monotonic()
+
+            current = _modification_times(watched)
+            if None in current.values():
+                # Jobs uninstalled: let the next one start a new worker
+                break
+            if current != loaded:
+                try:
+                    _reexec(server, socket_path, max_jobs, idle_timeout, children)
+                except OSError:
+                    loaded = current
+
+            try:
+                connection, _ = server.accept()
+            except socket.timeout:
+                continue
+
+            last_activity = time.monotonic()
+            pid = os.fork()
+            if not pid:
+                server.close()
+                try:
+                    _handle(connection)
+                finally:
+                    os._exit(0)
+            connection.close()
+            children.add(pid)
+    finally:
+        server.close()
+        os.unlink(socket_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+            '-s', '--socket', default=SOCKET_PATH,
+            help='path to the socket to listen on')
+    parser.add_argument(
+            '-j', '--jobs', type=int, default=MAX_JOBS,
+            help='maximal amount of jobs running concurrently')
+    parser.add_argument(
+            '-i', '--idle-timeout', type=float, default=IDLE_TIMEOUT,
+            help='seconds without any job before the worker stops')
+    parser.add_argument(
+            '--fd', type=int, help=argparse.SUPPRESS)
+    parser.add_argument(
+            'children', type=int, nargs='*', help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    serve(args.socket, args.jobs, args.idle_timeout, args.fd, args.children)
@@ -42,22 +42,22 @@ import tempfile
 import itertools
 from datetime import datetime,timedelta
 
+from post_processing_worker import delegate
+# Hand the job over to the warm worker, when available, before heavy imports
+delegate(__name__, __file__)
+
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from dateutil.parser import parse
-from pkg_resources import parse_version as version
 
 import collect_agent
-from data_access.post_processing import Statistics, save, _Plot
+from data_access.post_processing import save
+from statistics_cache import CachedStatistics
+from streaming_aggregation import QuantileSketch, fetch_chunks, accumulate
 
 
 UNIT_OPTION={'s', 'ms' ,'bits/s', 'Kbits/s', 'Mbits/s','Gbits/s','Bytes' ,'KBytes', 'MBytes', 'GBytes'}
-SET_AXIS_PARAMETERS = {'axis': 1}
-if version(pd.__version__) < version('1.5.0'):
-    SET_AXIS_PARAMETERS['inplace'] = False
-else:
-    SET_AXIS_PARAMETERS['copy'] = True
 
 
 def multiplier(base, unit):
@@ -92,7 +92,7 @@ def main(
         reference, step, stat_unit, table_unit,
         figure_title, y_label, x_label, agents_legend,
         stats_with_suffixes, use_grid, use_legend):
-    statistics = Statistics.from_default_collector()
+    statistics = CachedStatistics.from_default_collector()
     statistics.origin = 0
 
     with tempfile.TemporaryDirectory(prefix='openbach-pseudo_cdf_comparison-') as root_folder:
@@ -106,24 +106,23 @@ def main(
         figure, axis = plt.subplots()
 
         for agent, agent_legend in zip(agents_name, itertools.chain(agents_legend, itertools.repeat(None))):
-            data_collection = statistics.fetch(
-                    job=job_name, agent=agent,
+            # Stream data into a quantile sketch instead of sorting the whole series
+            sketch = QuantileSketch()
+            chunks = fetch_chunks(
+                    statistics, job=job_name, agent=agent,
                     suffix=None if stats_with_suffixes else '',
                     fields=[statistic_name], timestamps=timestamps)
+            accumulate(chunks, {(statistic_name, None): sketch}, {(statistic_name, None): scale_factor * reference / 100})
+            if not sketch.count:
+                collect_agent.send_log(
+                        syslog.LOG_WARNING,
+                        'agent {} did not produce the statistic {} for job {}'.format(agent, statistic_name, job_name))
+                continue
 
-            df = pd.concat([
-                    plot.dataframe.set_axis(
-                        plot.dataframe.columns.get_level_values('statistic'),
-                        **SET_AXIS_PARAMETERS)
-                    for plot in data_collection
-            ])
-
-            df = (df.dropna() / scale_factor / reference) * 100
-            df.sort_values(by=statistic_name, inplace=True)
-            df.reset_index(drop=True, inplace=True)
             values_amount = 100 // step
-            cdf = df.loc[np.linspace(df.index.max(), df.index.min(), values_amount, dtype=int, endpoint=False)[::-1]][statistic_name]
-            cdf.index = np.linspace(100, 0, values_amount, dtype=int, endpoint=False)[::-1]
+            percents = np.linspace(100, 0, values_amount, dtype=int, endpoint=False)[::-1]
+            ranks = np.linspace(sketch.count - 1, 0, values_amount, dtype=int, endpoint=False)[::-1]
+            cdf = pd.Series([sketch.value_at_rank(rank) for rank in ranks], index=percents)
             cdf.name = agent_legend or agent
             cdf.plot(ax=axis)
 
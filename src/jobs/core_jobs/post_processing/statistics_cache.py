@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+"""On-disk cache of the statistics fetched from InfluxDB by the post-processing jobs
+
+Raw InfluxDB responses are stored compressed, keyed by the InfluxDB
+server, database and timestamps precision they were fetched with along
+with the canonical form of the query (measurement, scenario, job
+instances, agent, suffix, fields and time range all being part of it).
+
+Once a scenario instance is stopped, the controller marks each of its
+job instances as such in the rollups retention policy of InfluxDB.
+Entries whose job instances, or scenario instance, are all marked are
+complete and served as-is. Other entries only get their tail fetched
+again and merged into the cached response. In both cases, entries
+expire after a while and are then fully fetched again, so points that
+arrived late or out of order (e.g. replayed from the spool of rstats)
+are eventually taken into account.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+import os
+import re
+import gzip
+import json
+import time
+import syslog
+import hashlib
+import tempfile
+from pathlib import Path
+from contextlib import suppress
+
+import collect_agent
+from data_access.post_processing import Statistics
+
+
+DEFAULT_CACHE_FOLDER = '/var/cache/openbach/statistics/'
+ENTRY_TTL = 60 * 60  # Seconds before an entry is fully fetched again
+# Written by the controller, see statistics_query.py in the conductor
+ROLLUP_RETENTION_POLICY = 'openbach_rollups'
+STOPPED_MEASUREMENT = 'openbach_stopped_job_instances'
+MAX_CACHE_SIZE = 2 * 1024**3  # Bytes
+PRECISIONS = {'s': 1, 'ms': 10**3, 'u': 10**6, 'ns': 10**9}
+SELECT_QUERY = re.compile(r'^SELECT (?P<fields>.+?) FROM (?P<source>.+?)(?: WHERE (?P<condition>.+))?$', re.DOTALL)
+INSTANCE_TAG = re.compile(r'"@(?P<tag>job_instance_id|scenario_instance_id|owner_scenario_instance_id)" = \'(?P<id>\d+)\'')
+
+
+def canonical_query(query):
+    """Sort the fields of a SELECT query so that equivalent requests
+    share the same cache entry whatever the order of their fields.
+    """
+    match = SELECT_QUERY.match(query)
+    if match is None:
+        return query
+
+    fields = ','.join(sorted(match['fields'].split(',')))
+    query = 'SELECT {} FROM {}'.format(fields, match['source'])
+    if match['condition'] is not None:
+        query = '{} WHERE {}'.format(query, match['condition'])
+    return query
+
+
+def is_cacheable(query):
+    """Only raw points selections can be cached and extended with
+    their tail; aggregated results change with every new point.
+    """
+    match = SELECT_QUERY.match(query)
+    return match is not None and '(' not in match['fields']
+
+
+def tail_query(query, last_timestamp, precision='ms'):
+    """Restrict a SELECT query to the points newer than the given timestamp"""
+    unit = '' if precision == 'ns' else precision
+    condition = 'time > {}{}'.format(last_timestamp, unit)
+    match = SELECT_QUERY.match(query)
+    if match is None or match['condition'] is None:
+        return '{} WHERE {}'.format(query, condition)
+    return 'SELECT {} FROM {} WHERE ({}) AND {}'.format(
+            match['fields'], match['source'], match['condition'], condition)
+
+
+def stopped_query(query, database):
+    """Build the query listing the job instances among the ones
+    the given query selects that the controller marked as stopped,
+    along with the amount of series it should return if they all are.
+
+    Return None if the query does not select specific job
+    or scenario instances.
+    """
+    match = SELECT_QUERY.match(query)
+    if match is None or match['condition'] is None:
+        return None
+    instances = {}
+    for tag, instance_id in INSTANCE_TAG.findall(match['condition']):
+        instances.setdefault(tag, set()).add(instance_id)
+    if not instances:
+        return None
+
+    if 'job_instance_id' in instances:
+        # Job instances are more specific than scenario instances
+        instances = {'job_instance_id': instances['job_instance_id']}
+        expected = len(instances['job_instance_id'])
+    else:
+        # All job instances of a scenario are marked at once
+        expected = 1
+    condition = ' OR '.join(
+            '"@{}" = \'{}\''.format(tag, instance_id)
+            for tag, ids in instances.items() for instance_id in sorted(ids))
+    stopped = 'SELECT * FROM "{}"."{}"."{}" WHERE {} GROUP BY "@job_instance_id" LIMIT 1'.format(
+            database, ROLLUP_RETENTION_POLICY, STOPPED_MEASUREMENT, condition)
+    return stopped, expected
+
+
+def count_series(response):
+    return sum(len(result.get('series', [])) for result in response.get('results', []))
+
+
+def has_errors(response):
+    return 'error' in response or any('error' in result for result in response.get('results', []))
+
+
+def latest_timestamp(response):
+    """Find the most recent point of all the series of a response"""
+    timestamps = [
+            serie['values'][-1][serie['columns'].index('time')]
+            for result in response.get('results', [])
+            for serie in result.get('series', [])
+            if serie.get('values') and 'time' in serie['columns']
+    ]
+    return max(timestamps, default=None)
+
+
+def _merge_serie(serie, tail):
+    columns = serie['columns']
+    new_columns = [column for column in tail['columns'] if column not in columns]
+    if new_columns:
+        columns.extend(new_columns)
+        for row in serie['values']:
+            row.extend([None] * len(new_columns))
+
+    positions = [columns.index(column) for column in tail['columns']]
+    for tail_row in tail.get('values', []):
+        row = [None] * len(columns)
+        for position, value in zip(positions, tail_row):
+            row[position] = value
+        serie.setdefault('values', []).append(row)
+
+
+def merge_responses(response, tail):
+    """Append the points of the tail response to the matching series
+    of the cached response, adding new series or columns as needed.
+    """
+    results = response.setdefault('results', [])
+    for index, tail_result in enumerate(tail.get('results', [])):
+        if index >= len(results):
+            results.append(tail_result)
+            continue
+
+        series = results[index].setdefault('series', [])
+        for tail_serie in tail_result.get('series', []):
+            key = (tail_serie.get('name'), tail_serie.get('tags'))
+            for serie in series:
+                if (serie.get('name'), serie.get('tags')) == key:
+                    _merge_serie(serie, tail_serie)
+                    break
+            else:
+                series.append(tail_serie)
+    return response
+
+
+class CachedStatistics(Statistics):
+    def __init__(
+            self, ip, port=8086, db_name='openbach', precision='ms',
+            cache_folder=DEFAULT_CACHE_FOLDER, entry_ttl=ENTRY_TTL,
+            max_size=MAX_CACHE_SIZE):
+        super().__init__(ip, port, db_name, precision)
+        self.source = [ip, port, db_name, precision]
+        self.db_name = db_name
+        self.precision = precision
+        self.entry_ttl = entry_ttl
+        self.max_size = max_size
+        self.cache_folder = Path(cache_folder)
+        try:
+            self.cache_folder.mkdir(parents=True, exist_ok=True)
+        except OSError as error:
+            collect_agent.send_log(syslog.LOG_WARNING, 'Statistics cache disabled: {}'.format(error))
+            self.cache_folder = None
+
+    def _entry_key(self, query):
+        """Everything the response to the query depends upon"""
+        return [*self.source, query]
+
+    def _entry_path(self, key):
+        digest = hashlib.sha1(json.dumps(key).encode()).hexdigest()
+        return self.cache_folder / '{}.json.gz'.format(digest)
+
+    def _load(self, path, key):
+        try:
+            with gzip.open(path, 'rt') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('key') != key:
+            return None
+        # Keep track of usage for eviction
+        os.utime(path)
+        return entry
+
+    def _store(self, path, entry):
+        temporary = None
+        try:
+            with tempfile.NamedTemporaryFile(dir=self.cache_folder, suffix='.tmp', delete=False) as f:
+                temporary = f.name
+                with gzip.open(f, 'wt') as storage:
+                    json.dump(entry, storage)
+            os.replace(temporary, path)
+        except OSError as error:
+            collect_agent.send_log(syslog.LOG_WARNING, 'Could not cache statistics: {}'.format(error))
+            if temporary is not None:
+                with suppress(FileNotFoundError):
+                    os.unlink(temporary)
+        else:
+            self.prune()
+
+    def prune(self):
+        """Remove the least recently used entries until the cache fits in its maximal size"""
+        entries = []
+        for entry in self.cache_folder.glob('*.json.gz'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Pruned by another job in the meantime
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        entries.sort()
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total_size <= self.max_size:
+                break
+            with suppress(FileNotFoundError):
+                entry.unlink()
+            total_size -= size
+
+    def sql_query(self, query):
+        query = canonical_query(query)
+        if self.cache_folder is None or not is_cacheable(query):
+            return super().sql_query(query)
+
+        key = self._entry_key(query)
+        path = self._entry_path(key)
+        entry = self._load(path, key)
+        now = time.time()
+        if entry is not None and now - entry.get('fetched', 0) >= self.entry_ttl:
+            entry = None
+        if entry is not None and entry['complete']:
+            return entry['response']
+
+        complete = self.is_complete(query)
+        if entry is None or complete or entry['last_timestamp'] is None:
+            # Fetch everything once complete, in case
+            # some points arrived out of order meanwhile
+            response = super().sql_query(query)
+            fetched = now
+        else:
+            tail = super().sql_query(tail_query(query, entry['last_timestamp'], self.precision))
+            if has_errors(tail):
+                return tail
+            response = merge_responses(entry['response'], tail)
+            fetched = entry['fetched']
+
+        if not has_errors(response):
+            self._store(path, {
+                'key': key,
+                'last_timestamp': latest_timestamp(response),
+                'complete': complete,
+                'fetched': fetched,
+                'response': response,
+            })
+        return response
+
+    def is_complete(self, query):
+        """Tell whether the controller marked as stopped all the
+        job instances, or scenario instances, a query selects.
+        """
+        stopped = stopped_query(query, self.db_name)
+        if stopped is None:
+            return False
+        stopped, expected = stopped
+        response = super().sql_query(stopped)
+        return not has_errors(response) and count_series(response) >= expected
+
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+
+# OpenBACH is a generic testbed able to control/configure multiple
+# network/physical entities (under test) and collect data from them. It is
+# composed of an Auditorium (HMIs), a Controller, a Collector and multiple
+# Agents (one for each network entity that wants to be tested).
+#
+#
+# Copyright © 2016-2023 CNES
+#
+#
+# This file is part of the OpenBACH testbed.
+#
+#
+# OpenBACH is a free software : you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY, without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see http://www.gnu.org/licenses/.
+
+"""Out-of-core aggregation of the statistics fetched from InfluxDB
+
+Points are streamed from InfluxDB in fixed-size chunks and folded into
+mergeable accumulators (moments, boundaries, quantile sketches and
+fixed-bins histograms) so that the memory needed by the post-processing
+jobs does not depend on the length of the series. The accumulators
+render the same frames than the in-memory `_Plot` methods they replace,
+so the existing plotting code can be reused as-is through `AccumulatedPlot`.
+"""
+
+
+__author__ = 'Viveris Technologies'
+__credits__ = '''Contributors:
+ * Mathias ETTINGER <mathias.ettinger@toulouse.viveris.com>
+'''
+
+import math
+import json
+import itertools
+from collections import Counter
+
+import requests
+import numpy as np
+import pandas as pd
+from data_access.post_processing import _Plot
+
+
+CHUNK_SIZE = 100000  # Points per chunk sent by InfluxDB
+MANDATORY_TAGS = ('@agent_name', '@job_instance_id', '@scenario_instance_id', '@owner_scenario_instance_id', '@suffix')
+
+
+def fetch_chunks(statistics, job=None, scenario=None, agent=None, job_instances=(),
+                 suffix=None, fields=None, timestamps=None, condition=None, chunk_size=CHUNK_SIZE):
+    """Stream the points matching the query as dataframes of at most
+    chunk_size rows, holding the 'time' column and one numeric column
+    per requested field.
+    """
+    query = statistics._raw_influx_query(job, scenario, agent, job_instances, suffix, fields, timestamps, condition)
+    parameters = {'q': query, 'chunked': 'true', 'chunk_size': chunk_size}
+    with requests.get(statistics.querying_URL, params=parameters, stream=True, timeout=statistics.TIMEOUT) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            for result in json.loads(line).get('results', []):
+                if 'error' in result:
+                    raise RuntimeError('The query \'{}\' failed: {}'.format(query, result['error']))
+                for serie in result.get('series', []):
+                    chunk = pd.DataFrame(serie.get('values', []), columns=serie['columns'])
+                    columns = [column for column in chunk.columns if column != 'time' and column not in MANDATORY_TAGS]
+                    if columns:
+                        chunk[columns] = chunk[columns].apply(pd.to_numeric, errors='coerce')
+                        yield chunk[['time'] + columns]
+
+
+def fetch_maxima(statistics, job=None, scenario=None, agent=None, job_instances=(),
+                 suffix=None, fields=None, timestamps=None, condition=None):
+    """Let InfluxDB compute the maximum of each field matching the query.
+
+    When no fields are given, this also discovers which fields exist.
+    """
+    selection = 'MAX(*)' if not fields else ','.join('MAX("{0}") AS "max_{0}"'.format(field) for field in fields)
+    query = statistics._raw_influx_query(job, scenario, agent, job_instances, suffix, selection, timestamps, condition)
+    maxima = {}
+    for result in statistics.sql_query(query).get('results', []):
+        for serie in result.get('series', []):
+            for values in serie.get('values', []):
+                for column, value in zip(serie['columns'], values):
+                    if column.startswith('max_') and value is not None:
+                        name = column[len('max_'):]
+                        maxima[name] = max(value, maxima.get(name, value))
+    return maxima
+
+
+def time_bins(timestamps, time_aggregation):
+    """Compute the temporal bin of each timestamp, in milliseconds"""
+    dates = pd.DatetimeIndex(pd.to_datetime(timestamps, unit='ms'))
+    return np.asarray(getattr(dates, time_aggregation))
+
+
+def histogram_bins(bin_size, offset, maximum):
+    nb_segments = math.ceil((maximum - offset) / bin_size)
+    maximum = nb_segments * bin_size + offset
+    return np.linspace(offset, maximum, nb_segments + 1, dtype='int')
+
+
+def _percentile_label(percentile):
+    return '{:g}%'.format(100 * percentile)
+
+
+class Moments:
+    """Count, mean, variance and boundaries of a stream of values,
+    merged chunk by chunk using Chan's parallel algorithm.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def add(self, values):
+        if len(values):
+            chunk = Moments()
+            chunk.count = len(values)
+            chunk.mean = values.mean()
+            chunk.m2 = ((values - chunk.mean) ** 2).sum()
+            chunk.minimum = values.min()
+            chunk.maximum = values.max()
+            self.merge(chunk)
+
+    def merge(self, other):
+        count = self.count + other.count
+        if not count:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else math.nan
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch with bounded relative error.
+
+    Values are counted in logarithmically sized buckets so that any
+    quantile is estimated within relative_accuracy of its true value
+    whatever the amount of values seen.
+    """
+
+    def __init__(self, relative_accuracy=0.005, zero_threshold=1e-9):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.zero_threshold = zero_threshold
+        self.positives = Counter()
+        self.negatives = Counter()
+        self.zeros = 0
+        self.count = 0
+
+    def _buckets(self, magnitudes):
+        keys, counts = np.unique(np.ceil(np.log(magnitudes) / self.log_gamma).astype(int), return_counts=True)
+        return dict(zip(keys.tolist(), counts.tolist()))
+
+    def add(self, values):
+        self.count += len(values)
+        positives = values[values > self.zero_threshold]
+        negatives = values[values < -self.zero_threshold]
+        self.zeros += len(values) - len(positives) - len(negatives)
+        self.positives.update(self._buckets(positives))
+        self.negatives.update(self._buckets(-negatives))
+
+    def merge(self, other):
+        self.count += other.count
+        self.zeros += other.zeros
+        self.positives.update(other.positives)
+        self.negatives.update(other.negatives)
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def value_at_rank(self, rank):
+        """Estimate the value of the given rank (starting at 0) in the sorted stream"""
+        buckets = itertools.chain(
+                ((-self._value(key), self.negatives[key]) for key in sorted(self.negatives, reverse=True)),
+                [(0.0, self.zeros)],
+                ((self._value(key), self.positives[key]) for key in sorted(self.positives)))
+        seen = 0
+        value = math.nan
+        for value, count in buckets:
+            seen += count
+            if seen > rank:
+                break
+        return value
+
+    def quantile(self, q):
+        return self.value_at_rank(math.floor(q * (self.count - 1))) if self.count else math.nan
+
+
+class BinnedStatistics:
+    """Moments and quantiles of values grouped by temporal bins"""
+
+    def __init__(self, relative_accuracy=0.005):
+        self.relative_accuracy = relative_accuracy
+        self.moments = {}
+        self.sketches = {}
+
+    def add(self, bins, values):
+        for key in np.unique(bins).tolist():
+            selected = values[bins == key]
+            if key not in self.moments:
+                self.moments[key] = Moments()
+                self.sketches[key] = QuantileSketch(self.relative_accuracy)
+            self.moments[key].add(selected)
+            self.sketches[key].add(selected)
+
+    def describe(self, percentiles=(.25, .75)):
+        """Build the same frame than pandas' groupby(...).describe()"""
+        percentiles = sorted(set(percentiles) | {.5})
+        columns = ['count', 'mean', 'std', 'min'] + [_percentile_label(p) for p in percentiles] + ['max']
+        rows = []
+        for key in sorted(self.moments):
+            moments, sketch = self.moments[key], self.sketches[key]
+            quantiles = [min(max(sketch.quantile(p), moments.minimum), moments.maximum) for p in percentiles]
+            rows.append([moments.count, moments.mean, moments.std, moments.minimum] + quantiles + [moments.maximum])
+        return pd.DataFrame(rows, index=sorted(self.moments), columns=columns, dtype=float)
+
+
+class BinnedHistogram:
+    """Fixed-bins histograms of values grouped by temporal bins"""
+
+    def __init__(self, bins):
+        self.bins = bins
+        self.counts = {}
+        self.total = np.zeros(len(bins) - 1)
+
+    def add(self, bins, values):
+        for key in np.unique(bins).tolist():
+            histogram, _ = np.histogram(values[bins == key], self.bins)
+            self.counts[key] = self.counts.get(key, 0) + histogram
+            self.total += histogram
+
+    @staticmethod
+    def _normalize(histogram):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return histogram / histogram.sum() * 100
+
+    def frame(self, add_total=True):
+        """Build the same frame than `_Plot.temporal_binning_histogram`"""
+        keys = sorted(self.counts)
+        stats = pd.DataFrame(
+                [self._normalize(self.counts[key]) for key in keys],
+                index=['{}-{}'.format(key, key + 1) for key in keys],
+                columns=self.bins[1:])
+        if add_total:
+            total = pd.DataFrame([self._normalize(self.total)], index=['total'], columns=self.bins[1:])
+            stats = pd.concat([stats, total])
+        return stats
+
+
+class AccumulatedPlot(_Plot):
+    """Plot helper drawing temporal binning figures from accumulators
+    instead of a fully loaded dataframe.
+
+    Accumulators are stored by statistic name and time aggregation;
+    when the index given to the plotting methods is not None, it is
+    appended to this key so several figures can use the same statistic
+    with different parameters.
+    """
+
+    def __init__(self, accumulators):
+        super().__init__(pd.DataFrame())
+        self.accumulators = accumulators
+
+    def _accumulator(self, statistic_name, time_aggregation, index):
+        if index is None:
+            return self.accumulators[statistic_name, time_aggregation]
+        return self.accumulators[statistic_name, time_aggregation, index]
+
+    def temporal_binning_statistics(
+            self, statistic_name=None, index=None,
+            time_aggregation='hour', percentiles=[.05, .25, .75, .95]):
+        stats = self._accumulator(statistic_name, time_aggregation, index).describe(percentiles)
+        stats.index.name = 'Time ({}s)'.format(time_aggregation)
+        yield stats
+
+    def temporal_binning_histogram(
+            self, statistic_name=None, index=None, bin_size=100,
+            offset=0, maximum=None, time_aggregation='hour',
+            add_total=True, scale_factor=None):
+        stats = self._accumulator(statistic_name, time_aggregation, index).frame(add_total)
+        stats.index.name = 'Time ({}s)'.format(time_aggregation)
+        yield stats
+
+
+def accumulate(chunks, accumulators, scale_factors=None):
+    """Feed the values of each chunk into the accumulators keyed by
+    (statistic name, time aggregation, *extra) where extra items, such
+    as the index of a figure, only tell apart accumulators of the same
+    statistic; a None time aggregation feeds a plain accumulator (such
+    as a QuantileSketch) with all the values. Values are divided by the
+    scale factor stored under the same key, if any.
+    """
+    scale_factors = scale_factors or {}
+    for chunk in chunks:
+        bins = {}
+        for key, accumulator in accumulators.items():
+            field, time_aggregation, *_ = key
+            if field not in chunk:
+                continue
+            values = chunk[field].to_numpy(dtype=float)
+            present = ~np.isnan(values)
+            values = values[present] / scale_factors.get(key, 1)
+            if time_aggregation is None:
+                accumulator.add(values)
+                continue
+            if time_aggregation not in bins:
+                bins[time_aggregation] = time_bins(chunk['time'].to_numpy(), time_aggregation)
+            accumulator.add(bins[time_aggregation][present], values)
@@ -45,13 +45,18 @@ import textwrap
 import itertools
 from datetime import datetime,timedelta
 
+from post_processing_worker import delegate
+# Hand the job over to the warm worker, when available, before heavy imports
+delegate(__name__, __file__)
+
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from dateutil.parser import parse
 
 import collect_agent
-from data_access.post_processing import Statistics, save, _Plot
+from data_access.post_processing import save, _Plot
+from statistics_cache import CachedStatistics
 
 
 COLUMN_NUMBER = 4
@@ -217,7 +222,7 @@ def main(
         function, reference, num_bars, start_day, start_evening, start_night,
         stat_unit, table_unit, agents_title, stat_title,
         figure_title, stats_with_suffixes, filled_box):
-    statistics = Statistics.from_default_collector()
+    statistics = CachedStatistics.from_default_collector()
     statistics.origin = 0
     with tempfile.TemporaryDirectory(prefix='openbach-summary_agent_comparison-') as root_folder:
         if not timestamp_boundaries:
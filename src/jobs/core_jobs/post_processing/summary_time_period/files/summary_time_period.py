@@ -42,6 +42,10 @@ import tempfile
 import itertools
 from datetime import datetime
 
+from post_processing_worker import delegate
+# Hand the job over to the warm worker, when available, before heavy imports
+delegate(__name__, __file__)
+
 import numpy as np
 import pandas as pd
 from dateutil.parser import parse
@@ -50,7 +54,7 @@ from openpyxl.utils import get_column_letter
 from openpyxl.styles import Alignment, Side, Border, Font, PatternFill
 
 import collect_agent
-from data_access.post_processing import Statistics
+from statistics_cache import CachedStatistics
 
 
 UNIT_OPTION={'s', 'ms' ,'bits/s', 'Kbits/s', 'Mbits/s','Gbits/s','Bytes' ,'KBytes', 'MBytes', 'GBytes'}
@@ -165,7 +169,7 @@ def main(
         reference, stability_threshold, stat_unit, table_unit,
         path_to_file, stat_title, compute_median, compute_mean, stats_with_suffixes):
 
-    statistics = Statistics.from_default_collector()
+    statistics = CachedStatistics.from_default_collector()
     statistics.origin = 0
     with tempfile.TemporaryDirectory(prefix='openbach-summary_time_period-') as root_folder:
         if not timestamp_boundaries:
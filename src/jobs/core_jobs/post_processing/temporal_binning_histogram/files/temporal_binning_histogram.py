@@ -40,13 +40,21 @@ import os.path
 import argparse
 import tempfile
 import itertools
+from collections import Counter
+
+from post_processing_worker import delegate
+# Hand the job over to the warm worker, when available, before heavy imports
+delegate(__name__, __file__)
 
-import pandas as pd
 import matplotlib.pyplot as plt
-from pkg_resources import parse_version as version
 
 import collect_agent
-from data_access.post_processing import Statistics, save, _Plot
+from data_access.post_processing import save
+from statistics_cache import CachedStatistics
+from streaming_aggregation import (
+        BinnedHistogram, AccumulatedPlot,
+        fetch_chunks, fetch_maxima, accumulate, histogram_bins,
+)
 
 
 AGGREGATION_OPTIONS = {'year', 'month', 'day', 'hour', 'minute', 'second'}
@@ -62,12 +70,6 @@ COLORMAP_OPTION = {
 }
 UNIT_OPTION = {'s', 'ms' ,'bits/s', 'Kbits/s', 'Mbits/s','Gbits/s','Bytes' ,'KBytes', 'MBytes', 'GBytes'}
 
-SET_AXIS_PARAMETERS = {'axis': 1}
-if version(pd.__version__) < version('1.5.0'):
-    SET_AXIS_PARAMETERS['inplace'] = False
-else:
-    SET_AXIS_PARAMETERS['copy'] = True
-
 
 def multiplier(base, unit):
         if unit == base:
@@ -98,7 +100,7 @@ def main(
         figures_titles, legends_titles, stat_units, legend_units,
         use_legend, add_global, pickle, colormap):
     file_ext = 'pickle' if pickle else 'png'
-    statistics = Statistics.from_default_collector()
+    statistics = CachedStatistics.from_default_collector()
     statistics.origin = 0
     with tempfile.TemporaryDirectory(prefix='openbach-temporal-binning-histogram-') as root:
         metadatas = itertools.zip_longest(
@@ -106,37 +108,21 @@ def main(
                 bins_sizes, axis_labels, figures_titles, legends_titles,
                 stat_units, legend_units, colormap, fillvalue=[])
         for job, fields, aggregations, bin_sizes, labels, titles, legend_titles, stat_units, legend_units, cms in metadatas:
-            data_collection = statistics.fetch(
-                    job_instances=job,
-                    suffix = None if stats_with_suffixes else '',
-                    fields=fields)
-
-            # Drop multi-index columns to easily concatenate dataframes from their statistic names
-            df = pd.concat([
-                    plot.dataframe.set_axis(
-                        plot.dataframe.columns.get_level_values('statistic'),
-                        **SET_AXIS_PARAMETERS)
-                    for plot in data_collection
-            ])
-
-            # Recreate a multi-indexed columns so the plot can function properly
-            df.columns = pd.MultiIndex.from_tuples(
-                    [('', '', '', '', stat) for stat in df.columns],
-                    names=['job', 'scenario', 'agent', 'suffix', 'statistic'])
-
-            plot = _Plot(df)
+            suffix = None if stats_with_suffixes else ''
+            maxima = fetch_maxima(statistics, job_instances=job, suffix=suffix, fields=fields)
             if not fields:
-                fields = list(df.columns.get_level_values('statistic'))
+                fields = sorted(maxima)
 
             metadata = itertools.zip_longest(
                     fields, labels, bin_sizes, aggregations,
                     legend_titles, stat_units, legend_units, titles, cms)
 
+            figures = []
             for field, label, bin_size, aggregation, legend, stat_unit, legend_unit, title, cm in metadata:
                 scale_factor = 1 if stat_unit is None else multiplier(stat_unit, legend_unit or stat_unit)
                 cmap = COLORMAP_OPTION[cm or 'red2green']
 
-                if field not in df.columns.get_level_values('statistic'):
+                if field not in maxima:
                     collect_agent.send_log(
                             syslog.LOG_WARNING,
                             'job instances {} did not produce the statistic {}'.format(job, field))
@@ -171,17 +157,40 @@ def main(
                             'instances {}: using the default value 100 instead'.format(field, job))
                     bin_size = 100
 
+                figures.append((field, label, bin_size, aggregation, legend, legend_unit, title, cmap, scale_factor))
+
+            if not figures:
+                continue
+
+            # Aggregate all the figures at once while streaming data chunk
+            # by chunk; a statistic can be drawn several times with other
+            # parameters, so accumulators are keyed by figure index too
+            accumulators = {}
+            scale_factors = {}
+            for index, (field, _, bin_size, aggregation, _, _, _, _, scale_factor) in enumerate(figures):
+                key = field, aggregation, index
+                accumulators[key] = BinnedHistogram(histogram_bins(
+                    bin_size, offset, maximum if maximum is not None else maxima[field] / scale_factor))
+                scale_factors[key] = scale_factor
+            fields = sorted({field for field, *_ in figures})
+            chunks = fetch_chunks(statistics, job_instances=job, suffix=suffix, fields=fields)
+            accumulate(chunks, accumulators, scale_factors)
+            plot = AccumulatedPlot(accumulators)
+
+            occurrences = Counter(field for field, *_ in figures)
+            for index, (field, label, bin_size, aggregation, legend, legend_unit, title, cmap, scale_factor) in enumerate(figures):
                 figure, axis = plt.subplots()
 
                 axis = plot.plot_temporal_binning_histogram(
-                        axis, label, field, None, bin_size, offset,
+                        axis, label, field, index, bin_size, offset,
                         maximum, aggregation, add_global, use_legend,
                         legend, legend_unit, cmap, scale_factor)
 
                 if title is not None:
                     axis.set_title(title)
 
-                filepath = os.path.join(root, 'temporal_binning_histogram_{}.{}'.format(field, file_ext))
+                name = field if occurrences[field] == 1 else '{}_{}'.format(field, index)
+                filepath = os.path.join(root, 'temporal_binning_histogram_{}.{}'.format(name, file_ext))
                 save(figure, filepath, pickle, False)
                 collect_agent.store_files(collect_agent.now(), figure=filepath)
 
@@ -42,20 +42,22 @@ import argparse
 import tempfile
 import itertools
 
-import pandas as pd
+from post_processing_worker import delegate
+# Hand the job over to the warm worker, when available, before heavy imports
+delegate(__name__, __file__)
+
 import matplotlib.pyplot as plt
-from pkg_resources import parse_version as version
 
 import collect_agent
-from data_access.post_processing import Statistics, save, _Plot
+from data_access.post_processing import save
+from statistics_cache import CachedStatistics
+from streaming_aggregation import (
+        BinnedStatistics, AccumulatedPlot,
+        fetch_chunks, fetch_maxima, accumulate,
+)
 
 
 TIME_OPTIONS = {'year', 'month', 'day', 'hour', 'minute', 'second'}
-SET_AXIS_PARAMETERS = {'axis': 1}
-if version(pd.__version__) < version('1.5.0'):
-    SET_AXIS_PARAMETERS['inplace'] = False
-else:
-    SET_AXIS_PARAMETERS['copy'] = True
 
 
 def main(
@@ -64,37 +66,20 @@ def main(
         median, average, deviation, boundaries, min_max, pickle):
 
     file_ext = 'pickle' if pickle else 'png'
-    statistics = Statistics.from_default_collector()
+    statistics = CachedStatistics.from_default_collector()
     statistics.origin = 0
     with tempfile.TemporaryDirectory(prefix='openbach-temporal-binning-statistics-') as root:
         for job, fields, aggregations, labels, titles in itertools.zip_longest(
                 job_instance_ids, statistics_names, aggregations_periods, axis_labels, figures_titles,
                 fillvalue=[]):
-            data_collection = statistics.fetch(
-                    job_instances=job,
-                    suffix = None if stats_with_suffixes else '',
-                    fields=fields)
-
-            # Drop multi-index columns to easily concatenate dataframes from their statistic names
-            df = pd.concat([
-                    plot.dataframe.set_axis(
-                        plot.dataframe.columns.get_level_values('statistic'),
-                        **SET_AXIS_PARAMETERS)
-                    for plot in data_collection
-            ])
-
-            # Recreate a multi-indexed columns so the plot can function properly
-            df.columns = pd.MultiIndex.from_tuples(
-                    [('', '', '', '', stat) for stat in df.columns],
-                    names=['job', 'scenario', 'agent', 'suffix', 'statistic'])  
-
-            plot = _Plot(df)
-
+            suffix = None if stats_with_suffixes else ''
+            maxima = fetch_maxima(statistics, job_instances=job, suffix=suffix, fields=fields)
             if not fields:
-                fields = list(df.columns.get_level_values('statistic'))
+                fields = sorted(maxima)
 
+            figures = []
             for field, label, aggregation, title in itertools.zip_longest(fields, labels, aggregations, titles):
-                if field not in df.columns.get_level_values('statistic'):
+                if field not in maxima:
                     collect_agent.send_log(
                             syslog.LOG_WARNING,
                             'job instances {} did not produce the statistic {}'.format(job, field))
@@ -115,6 +100,20 @@ def main(
                             '"hour" instead'.format(aggregation, field, job, TIME_OPTIONS))
                     aggregation = 'hour'
 
+                figures.append((field, label, aggregation, title))
+
+            if not figures:
+                continue
+
+            # Aggregate all the figures at once while streaming data chunk by chunk
+            accumulators = {(field, aggregation): BinnedStatistics() for field, _, aggregation, _ in figures}
+            chunks = fetch_chunks(
+                    statistics, job_instances=job, suffix=suffix,
+                    fields=sorted({field for field, _, _, _ in figures}))
+            accumulate(chunks, accumulators)
+            plot = AccumulatedPlot(accumulators)
+
+            for field, label, aggregation, title in figures:
                 figure, axis = plt.subplots()
 
                 axis = plot.plot_temporal_binning_statistics(